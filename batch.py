@@ -0,0 +1,215 @@
+# -*- coding: utf8 -*-
+"""Code for the batches of drawing operations
+
+This module turns a batch of L, V, H and K operations into the rectangles of
+cells they leave visible. The batch is swept from its last operation to its
+first, keeping the union of the cells already drawn, so any part of an
+operation that a later one overwrites is dropped before it's drawn. Drawing
+a batch then costs about as much as its visible area, however many
+operations overlap.
+"""
+from bisect import bisect_left, bisect_right
+
+#
+# Number of arguments of each kind of operation, its value included
+SHAPES = {'L': 3, 'V': 4, 'H': 4, 'K': 5}
+
+
+def to_rect(operation):
+    """ Converts an operation to the rectangle of cells it draws
+
+    Args:
+        operation (tuple): the command letter of the operation followed by
+            the arguments of its TextImage method, such as
+            ('V', col, row_up, row_down, value)
+
+    Returns:
+        tuple: the (col_top, row_top, col_bottom, row_bottom, value)
+            rectangle
+
+    Raises:
+        ValueError: The command is not L, V, H or K, or has a wrong number
+            of arguments
+    """
+    kind = operation[0] if operation else None
+    if SHAPES.get(kind) != len(operation) - 1:
+        raise ValueError
+
+    if kind == 'L':
+        _, col, row, value = operation
+        return col, row, col, row, value
+
+    if kind == 'V':
+        _, col, row_up, row_down, value = operation
+        return col, row_up, col, row_down, value
+
+    if kind == 'H':
+        _, col_left, col_right, row, value = operation
+        return col_left, row, col_right, row, value
+
+    return tuple(operation[1:])
+
+
+class Intervals(object):
+    """ A union of intervals of columns
+
+    The first and last positions of its disjoint intervals are kept in two
+    sorted lists, and touching intervals are merged, so a line covered from
+    side to side is a single interval.
+    """
+
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def paint(self, left, right):
+        """ Adds the positions left-right to the union
+
+        Returns:
+            list(tuple): the (left, right) intervals of the positions that
+                were out of the union
+        """
+        first, last, pieces = self._gaps(left, right)
+        starts, ends = self.starts, self.ends
+
+        if first < last:
+            left = min(left, starts[first])
+            right = max(right, ends[last-1])
+        starts[first:last] = [left]
+        ends[first:last] = [right]
+
+        return pieces
+
+    def _gaps(self, left, right):
+        """ Finds the intervals that overlap or touch the positions
+        left-right, as a slice of the lists, and the positions out of them
+        """
+        starts, ends = self.starts, self.ends
+        first = bisect_left(ends, left - 1)
+        last = bisect_right(starts, right + 1)
+
+        pieces = []
+        position = left
+        for index in range(first, last):
+            if starts[index] > position:
+                pieces.append((position, min(starts[index] - 1, right)))
+            position = max(position, ends[index] + 1)
+        if position <= right:
+            pieces.append((position, right))
+
+        return first, last, pieces
+
+
+class Coverage(object):
+    """ The cells drawn so far, as bands of consecutive rows drawn alike
+
+    Each band is the first row of its rows and the union of their drawn
+    intervals. Drawing a rectangle splits the bands at its first and last
+    rows, draws each band inside at once and merges the bands left alike,
+    so its cost follows the number of bands it crosses, not its rows.
+
+    Args:
+        top (int): first row that may be drawn
+        bottom (int): last row that may be drawn
+    """
+
+    def __init__(self, top, bottom):
+        self.bottom = bottom
+        self._tops = [top]
+        self._lines = [Intervals()]
+
+    def paint(self, col_top, row_top, col_bottom, row_bottom):
+        """ Draws a rectangle of cells
+
+        Args:
+            col_top (int): Top horizontal position of the rectangle
+            row_top (int): Top verticaal position of the rectangle
+            col_bottom (int): Bottom horizontal position of the rectangle
+            row_bottom (int): Bottom vertical position of the rectangle
+
+        Returns:
+            list(tuple): the (col_top, row_top, col_bottom, row_bottom)
+                rectangles of the cells that were not drawn before
+        """
+        first = self._split(row_top)
+        last = self._split(row_bottom + 1)
+        tops = self._tops
+        lines = self._lines
+
+        # Consecutive bands with the same new intervals are joined into
+        # rectangles
+        rects = []
+        pending = []
+        start = row_top
+        for band in range(first, last):
+            pieces = lines[band].paint(col_top, col_bottom)
+            if pieces != pending:
+                rects.extend((left, start, right, tops[band] - 1)
+                             for left, right in pending)
+                pending = pieces
+                start = tops[band]
+        rects.extend((left, start, right, row_bottom)
+                     for left, right in pending)
+
+        self._merge(max(first, 1), min(last + 1, len(tops)))
+        return rects
+
+    def _split(self, row):
+        """ Starts a band at a row, unless it's past the last row
+
+        Returns:
+            int: the index of the band starting at the row
+        """
+        if row > self.bottom:
+            return len(self._tops)
+
+        band = bisect_right(self._tops, row) - 1
+        if self._tops[band] == row:
+            return band
+
+        line = self._lines[band]
+        copy = Intervals()
+        copy.starts = line.starts[:]
+        copy.ends = line.ends[:]
+        self._tops.insert(band + 1, row)
+        self._lines.insert(band + 1, copy)
+        return band + 1
+
+    def _merge(self, first, last):
+        """ Merges each band among first-last with the band before it if
+        they were drawn alike """
+        tops = self._tops
+        lines = self._lines
+        for band in range(last - 1, first - 1, -1):
+            line, previous = lines[band], lines[band-1]
+            if line.starts == previous.starts and line.ends == previous.ends:
+                del tops[band]
+                del lines[band]
+
+
+def visible_rects(rects):
+    """ Finds the parts of a sequence of rectangles that no later rectangle
+    overwrites
+
+    Args:
+        rects (list(tuple)): the (col_top, row_top, col_bottom, row_bottom,
+            value) rectangles, in drawing order
+
+    Returns:
+        list(tuple): disjoint rectangles in the same format, whose drawing in
+            any order leaves the cells as drawing every rectangle in order
+    """
+    if not rects:
+        return []
+
+    coverage = Coverage(min(rect[1] for rect in rects),
+                        max(rect[3] for rect in rects))
+    visible = []
+    for col_top, row_top, col_bottom, row_bottom, value in reversed(rects):
+        visible.extend(rect + (value,) for rect in
+                       coverage.paint(col_top, row_top, col_bottom,
+                                      row_bottom))
+
+    return visible
@@ -0,0 +1,336 @@
+# -*- coding: utf8 -*-
+"""Benchmarks of the text image operations at scale
+
+This module times each text image operation on every storage, across a
+range of canvas sizes and shapes, and measures its peak memory with
+tracemalloc. It also replays generated command scripts through
+handle_user_input, as the program does. The results are written as JSON, so
+they can be compared with the results of another commit, failing if any
+operation got slower than a threshold.
+
+Usage:
+    python benchmark.py --output results.json
+    python benchmark.py --compare baseline.json --threshold 1.5
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from main import handle_user_input
+from text_image import TextImage
+from row_image import RowMajorTextImage
+from compact_image import CompactTextImage
+from numpy_image import NumpyTextImage, numpy
+from tiled_image import TiledTextImage
+from rle_image import RunLengthTextImage
+
+#
+# Storages under benchmark, by name
+STORAGES = {'list': TextImage,
+            'rows': RowMajorTextImage,
+            'compact': CompactTextImage,
+            'tiled': TiledTextImage,
+            'rle': RunLengthTextImage}
+if numpy is not None:
+    STORAGES['numpy'] = NumpyTextImage
+
+#
+# Canvas sizes, as (cols, rows), including wide and tall shapes
+SIZES = [(100, 100), (1000, 1000), (4000, 250), (250, 4000)]
+
+#
+# Number of commands of each replayed script
+SCRIPT_LENGTH = 2000
+
+
+def draw_comb(image):
+    """ Draws walls that leave a single serpentine 'O' region, the worst
+    case of fill_region: every row of the region is split in many runs """
+    for col in range(1, image.cols, 2):
+        if col % 4 == 1:
+            image.vertical_values(col, 0, image.rows - 2, 'W')
+        else:
+            image.vertical_values(col, 1, image.rows - 1, 'W')
+
+
+def make_script(cols, rows, length, seed=0):
+    """ Generates a script of random drawing commands
+
+    Args:
+        cols (int): number of columns of the canvas
+        rows (int): number of rows of the canvas
+        length (int): number of commands after the initialization
+        seed (int): seed of the random commands
+
+    Returns:
+        list(str): the command lines
+    """
+    rand = random.Random(seed)
+    lines = ['I %d %d' % (cols, rows)]
+
+    for _ in range(length):
+        col, row = rand.randint(1, cols), rand.randint(1, rows)
+        right, down = rand.randint(col, cols), rand.randint(row, rows)
+        value = rand.choice('ABCDEFO')
+        lines.append(rand.choice([
+            'L %d %d %s' % (col, row, value),
+            'V %d %d %d %s' % (col, row, down, value),
+            'H %d %d %d %s' % (col, right, row, value),
+            'K %d %d %d %d %s' % (col, row, min(right, col + 50),
+                                  min(down, row + 50), value),
+            'F %d %d %s' % (col, row, value),
+            ]))
+
+        # A few clears and prints, as in interactive sessions
+        if rand.random() < 0.01:
+            lines.append('C')
+        if rand.random() < 0.005:
+            lines.append('P')
+
+    return lines
+
+
+def run_lines(image, lines):
+    """ Runs command lines through handle_user_input, with the printed
+    images discarded """
+    errors = []
+    with redirect_stdout(io.StringIO()):
+        for line in lines:
+            handle_user_input(image, line, errors.append)
+
+
+def make_cases(directory):
+    """ Builds the benchmark cases
+
+    Each case is a (name, setup, run) tuple. setup is called with a new
+    image of the canvas size before each measurement and is not measured.
+    run is the measured call, with the image and the value returned by
+    setup.
+
+    Args:
+        directory (str): directory for the saved files
+
+    Returns:
+        list(tuple): the benchmark cases
+    """
+    filename = os.path.join(directory, 'image.bmp')
+
+    def fresh(image):
+        pass
+
+    def drawn(image):
+        image.key_in_rect(0, 0, image.cols // 2, image.rows // 2, 'K')
+        image.horizontal_values(0, image.cols - 1, image.rows - 1, 'H')
+
+    def script(image):
+        return make_script(image.cols, image.rows, SCRIPT_LENGTH)
+
+    def frames(image):
+        rand = random.Random(0)
+        batch = []
+        for _ in range(SCRIPT_LENGTH):
+            col, row = rand.randrange(image.cols), rand.randrange(image.rows)
+            batch.append(('K', col, row, rand.randrange(col, image.cols),
+                          rand.randrange(row, image.rows), rand.choice('ABC')))
+        return batch
+
+    return [
+        ('initialize_matrix', fresh,
+         lambda image, _: image.initialize_matrix(image.cols, image.rows)),
+        ('clear_matrix', drawn, lambda image, _: image.clear_matrix()),
+        ('key_in_rect', fresh,
+         lambda image, _: image.key_in_rect(0, 0, image.cols - 1,
+                                            image.rows - 1, 'K')),
+        ('fill_region', fresh,
+         lambda image, _: image.fill_region(0, 0, 'F')),
+        ('fill_region_worst', draw_comb,
+         lambda image, _: image.fill_region(0, 0, 'F')),
+        ('copy_region', drawn,
+         lambda image, _: image.copy_region(0, 0, image.cols // 2 - 1,
+                                            image.rows // 2 - 1,
+                                            image.cols // 2, image.rows // 2)),
+        ('image_2_str', drawn, lambda image, _: image.image_2_str()),
+        ('window_2_str', drawn,
+         lambda image, _: image.window_2_str(
+             image.cols // 2, image.rows // 2,
+             min(image.cols // 2 + 79, image.cols - 1),
+             min(image.rows // 2 + 23, image.rows - 1))),
+        ('save_matrix', drawn,
+         lambda image, _: image.save_matrix(filename)),
+        ('script', script, run_lines),
+        ('draw_batch', frames, lambda image, batch: image.draw_batch(batch)),
+        ]
+
+
+def measure(storage, cols, rows, setup, run, repeat):
+    """ Measures an operation on a new image
+
+    Args:
+        storage (type): TextImage subclass of the image
+        cols (int): number of columns of the image
+        rows (int): number of rows of the image
+        setup (function): prepares the image, not measured
+        run (function): the measured operation
+        repeat (int): number of timed runs, the fastest is kept
+
+    Returns:
+        tuple: the time of the fastest run, in seconds, and the peak of
+            memory allocated by the operation, in bytes
+    """
+    best = None
+    for _ in range(repeat):
+        image = storage(cols=cols, rows=rows)
+        state = setup(image)
+        start = time.perf_counter()
+        run(image, state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # tracemalloc slows the operation down, so memory is a separate run
+    image = storage(cols=cols, rows=rows)
+    state = setup(image)
+    tracemalloc.start()
+    try:
+        run(image, state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+
+def run_benchmarks(storages=None, sizes=None, operations=None, repeat=3,
+                   progress=None):
+    """ Runs the benchmark cases on every storage and canvas size
+
+    Args:
+        storages (list(str)): names of the storages, all by default
+        sizes (list(tuple)): (cols, rows) canvas sizes, SIZES by default
+        operations (list(str)): names of the cases, all by default
+        repeat (int): number of timed runs of each measurement
+        progress (function): called with each result as it's measured
+
+    Returns:
+        list(dict): a result for each storage, size and case, with its
+            time in seconds and its peak memory in bytes
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, setup, run in make_cases(directory):
+            if operations and name not in operations:
+                continue
+            for storage in storages or sorted(STORAGES):
+                for cols, rows in sizes or SIZES:
+                    seconds, peak = measure(STORAGES[storage], cols, rows,
+                                            setup, run, repeat)
+                    result = {'operation': name, 'storage': storage,
+                              'cols': cols, 'rows': rows,
+                              'seconds': seconds, 'peak_bytes': peak}
+                    results.append(result)
+                    if progress is not None:
+                        progress(result)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Finds the results slower than their baseline by a threshold
+
+    Args:
+        results (list(dict)): the current results
+        baseline (list(dict)): the results to compare with
+        threshold (float): ratio of the times that is a regression
+
+    Returns:
+        list(tuple): each regressed result and its baseline time
+    """
+    def key(result):
+        return (result['operation'], result['storage'],
+                result['cols'], result['rows'])
+
+    previous = dict((key(result), result['seconds']) for result in baseline)
+    regressions = []
+    for result in results:
+        seconds = previous.get(key(result))
+        if seconds and result['seconds'] > seconds * threshold:
+            regressions.append((result, seconds))
+
+    return regressions
+
+
+def parse_size(text):
+    """ Parses a COLSxROWS canvas size """
+    cols, _, rows = text.partition('x')
+    return int(cols), int(rows)
+
+
+def print_result(result):
+    """ Prints a result as a line of the benchmark progress """
+    print("%-18s %-8s %5dx%-5d %10.6fs %12d bytes" % (
+        result['operation'], result['storage'], result['cols'],
+        result['rows'], result['seconds'], result['peak_bytes']))
+
+
+def main(argv=None):
+    """ Benchmark entry point
+
+    Args:
+        argv (list(str)): command line arguments, sys.argv by default
+
+    Returns:
+        int: exit status, non zero if an operation regressed
+    """
+    parser = argparse.ArgumentParser(description="Text images benchmarks")
+    parser.add_argument('--output', metavar='FILENAME',
+                        help="write the results to a JSON file")
+    parser.add_argument('--compare', metavar='FILENAME',
+                        help="JSON results of a previous run to compare with")
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help="time ratio over the compared results that "
+                             "is a regression")
+    parser.add_argument('--storage', action='append', choices=sorted(STORAGES),
+                        help="storage to benchmark, all by default")
+    parser.add_argument('--size', action='append', type=parse_size,
+                        metavar='COLSxROWS',
+                        help="canvas size to benchmark, several by default")
+    parser.add_argument('--operation', action='append',
+                        help="operation to benchmark, all by default")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="timed runs of each measurement")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.storage, args.size, args.operation,
+                             args.repeat, print_result)
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)['results']
+
+    regressions = compare(results, baseline, args.threshold)
+    for result, seconds in regressions:
+        sys.stderr.write("regression: %s %s %dx%d %.6fs, was %.6fs\n" % (
+            result['operation'], result['storage'], result['cols'],
+            result['rows'], result['seconds'], seconds))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
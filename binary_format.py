@@ -0,0 +1,182 @@
+# -*- coding: utf8 -*-
+"""Code for the binary format of the saved text images
+
+This module converts text images to and from a compact binary format. The
+file starts with a header holding the image size and its palette, the
+distinct values of its cells, followed by the cells, row by row, as one byte
+indexes into the palette. The cells may be run-length encoded or compressed
+with zlib, so images made of long runs of 'O' take a small fraction of the
+plain text layout.
+
+The format is converted with C level string operations only, such as
+translate, regular expressions and struct, never character by character.
+"""
+import re
+import struct
+import zlib
+
+#
+# The magic number is not valid UTF-8, so no saved text image starts with it
+MAGIC = b'\x89TXI'
+VERSION = 1
+
+#
+# Header: magic, version, compression, cols, rows and palette length
+HEADER = struct.Struct('<4sBBIIH')
+
+#
+# Run-length encoded cells: palette index and run length
+RUN = struct.Struct('<BI')
+MAX_RUN = 0xFFFFFFFF
+RUN_PATTERN = re.compile(b'(.)\\1*', re.DOTALL)
+
+COMPRESSIONS = ('none', 'rle', 'zlib')
+
+
+def is_binary(data):
+    """ Checks if the content of a file is in the binary format
+
+    Args:
+        data (bytes): content of the file
+
+    Returns:
+        bool: flag of binary content
+    """
+    return data.startswith(MAGIC)
+
+
+def encode(cols, rows, cells, compression='zlib'):
+    """ Converts the cells of an image to the binary format
+
+    Args:
+        cols (int): number of columns of the image
+        rows (int): number of rows of the image
+        cells (str): the values of the cells, row by row
+        compression (str): how the cells are compressed: 'none', 'rle'
+            or 'zlib'
+
+    Returns:
+        bytes: the image in the binary format
+
+    Raises:
+        ValueError: The compression is unknown, some value is not a single
+            character or the image has more than 256 distinct values
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError
+
+    if len(cells) != cols * rows:
+        raise ValueError
+
+    palette = ''.join(sorted(set(cells)))
+    if len(palette) > 256:
+        raise ValueError
+
+    # Each value is replaced by its index in the palette, with a byte table
+    # when every value is ASCII
+    if palette.isascii():
+        table = bytearray(256)
+        for index, value in enumerate(palette):
+            table[ord(value)] = index
+        data = cells.encode('ascii').translate(table)
+    else:
+        table = dict((ord(value), index)
+                     for index, value in enumerate(palette))
+        data = cells.translate(table).encode('latin-1')
+
+    if compression == 'rle':
+        data = b''.join([pack_run(match.group(1)[0], len(match.group()))
+                         for match in RUN_PATTERN.finditer(data)])
+    elif compression == 'zlib':
+        data = zlib.compress(data)
+
+    encoded_palette = palette.encode('utf8')
+    header = HEADER.pack(MAGIC, VERSION, COMPRESSIONS.index(compression),
+                         cols, rows, len(encoded_palette))
+
+    return header + encoded_palette + data
+
+
+def pack_run(index, length):
+    """ Packs a run of cells, split in as many records as its length needs
+
+    Args:
+        index (int): palette index of the run
+        length (int): number of cells of the run
+
+    Returns:
+        bytes: the records of the run
+    """
+    records = []
+    while length > MAX_RUN:
+        records.append(RUN.pack(index, MAX_RUN))
+        length -= MAX_RUN
+    records.append(RUN.pack(index, length))
+
+    return b''.join(records)
+
+
+def decode(data):
+    """ Converts an image in the binary format to the text layout written
+    by save_matrix
+
+    Args:
+        data (bytes): the image in the binary format
+
+    Returns:
+        bytes: the rows of the image, each one followed by a newline
+
+    Raises:
+        ValueError: The data is not a valid image in the binary format
+    """
+    try:
+        magic, version, compression, cols, rows, size = (
+            HEADER.unpack_from(data))
+        palette = data[HEADER.size:HEADER.size+size].decode('utf8')
+        cells = data[HEADER.size+size:]
+
+        if magic != MAGIC or version != VERSION or \
+                compression >= len(COMPRESSIONS):
+            raise ValueError
+
+        if COMPRESSIONS[compression] == 'rle':
+            cells = b''.join([bytes((index,)) * length
+                              for index, length in RUN.iter_unpack(cells)])
+        elif COMPRESSIONS[compression] == 'zlib':
+            cells = zlib.decompress(cells)
+    except (struct.error, zlib.error):
+        raise ValueError
+
+    if len(cells) != cols * rows or (cells and max(cells) >= len(palette)):
+        raise ValueError
+
+    if not cells:
+        return b''
+
+    # Each index is replaced by its value, with a byte table when every
+    # value is ASCII
+    if palette.isascii():
+        table = bytearray(range(256))
+        for index, value in enumerate(palette):
+            table[index] = ord(value)
+        return split_rows(cells.translate(table), cols, b'\n')
+
+    text = cells.decode('latin-1').translate(dict(enumerate(palette)))
+    return split_rows(text, cols, '\n').encode('utf8')
+
+
+def split_rows(cells, cols, newline):
+    """ Lays the cells of an image in rows, each one followed by a newline
+
+    Args:
+        cells (str or bytes): the values of the cells, row by row
+        cols (int): number of columns of the image
+        newline (str or bytes): the newline, of the same type of cells
+
+    Returns:
+        str or bytes: the rows of the image
+    """
+    lines = [cells[start:start+cols] for start in range(0, len(cells), cols)]
+    lines.append(newline[:0])
+
+    return newline.join(lines)
@@ -0,0 +1,167 @@
+# -*- coding: utf8 -*-
+"""Client of the text images server
+
+This module sends command lines to a text images server, one at a time,
+from a script file or the standard input, and writes the output of the
+commands to the standard output and their errors to the standard error.
+
+Usage:
+    python client.py --port 8765 script.txt
+    python client.py --unix /tmp/text_image.sock < script.txt
+"""
+import argparse
+import asyncio
+import sys
+
+
+class ServerError(Exception):
+    """ Error answered by the server to a command
+
+    Attributes:
+        error_type (str): the flagged type of the error
+        message (str): the error message
+    """
+
+    def __init__(self, error_type, message):
+        super(ServerError, self).__init__(error_type)
+        self.error_type = error_type
+        self.message = message
+
+
+class ImageClient(object):
+    """ Connection to a text images server, a session with its own image
+
+    Args:
+        reader (asyncio.StreamReader): stream of the answers
+        writer (asyncio.StreamWriter): stream of the command lines
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, host=None, port=None, path=None):
+        """ Connects to a server on TCP, or on a Unix socket if a path is
+        given
+
+        Returns:
+            ImageClient: the connected client
+        """
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+
+        return cls(reader, writer)
+
+    async def send(self, line):
+        """ Runs a command line on the server
+
+        Args:
+            line (str): The command line
+
+        Returns:
+            str: the output of the command
+
+        Raises:
+            ServerError: The command is invalid or failed
+        """
+        self._writer.write(line.rstrip('\n').encode('utf8') + b'\n')
+        await self._writer.drain()
+
+        status = (await self._reader.readline()).decode('utf8').split()
+        if not status:
+            raise ConnectionError("connection closed by the server")
+
+        data = await self._reader.readexactly(int(status[-1]))
+        if status[0] == 'ERROR':
+            raise ServerError(status[1], data.decode('utf8'))
+
+        return data.decode('utf8')
+
+    async def close(self):
+        """ Ends the session """
+        try:
+            self._writer.write(b'X\n')
+            await self._writer.drain()
+        except ConnectionError:
+            pass
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+async def run_lines(client, lines, output=None, errors=None):
+    """ Runs command lines on the server, one at a time
+
+    Args:
+        client (ImageClient): the connected client
+        lines (iterable(str)): the command lines
+        output (file): text stream of the outputs, the standard output by
+            default
+        errors (file): text stream of the errors, the standard error by
+            default
+
+    Returns:
+        int: number of failed commands
+    """
+    output = output or sys.stdout
+    errors = errors or sys.stderr
+    failed = 0
+
+    for number, line in enumerate(lines, 1):
+        command = line.split()
+        if not command:
+            continue
+        if command[0] == 'X':
+            break
+
+        try:
+            output.write(await client.send(line))
+        except ServerError as error:
+            failed += 1
+            title = error.message.split('\n')[0]
+            errors.write("line %d: %s\n" % (number, title.strip(' >')))
+
+    return failed
+
+
+async def run(host, port, path, lines):
+    """ Connects to the server and runs the command lines """
+    client = await ImageClient.connect(host, port, path)
+    try:
+        return await run_lines(client, lines)
+    finally:
+        await client.close()
+
+
+def main(argv=None):
+    """ Client entry point
+
+    Args:
+        argv (list(str)): command line arguments, sys.argv by default
+
+    Returns:
+        int: exit status, non zero if a command failed
+    """
+    parser = argparse.ArgumentParser(description="Text images client")
+    parser.add_argument('script', nargs='?',
+                        help="file of command lines, the standard input by "
+                             "default")
+    parser.add_argument('--host', default='localhost', help="TCP host")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port")
+    parser.add_argument('--unix', metavar='PATH',
+                        help="connect to a Unix socket instead of TCP")
+    args = parser.parse_args(argv)
+
+    if args.script is None:
+        failed = asyncio.run(run(args.host, args.port, args.unix, sys.stdin))
+    else:
+        with open(args.script) as f:
+            failed = asyncio.run(run(args.host, args.port, args.unix, f))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+# -*- coding: utf8 -*-
+"""Code for the CommandStats class, the timings of the program commands
+
+This module holds the CommandStats class, which tallies how long each command
+takes, split in phases such as parsing and running. Each tally keeps its
+count, total, minimum and maximum, and a histogram of fixed buckets for the
+percentiles, so recording a timing costs a binary search and a few
+additions, cheap enough to be always on.
+"""
+from bisect import bisect_right
+
+#
+# Lower bounds of the histogram buckets, in nanoseconds. The bounds grow by
+# a factor of 2 ** (1/4), so a percentile is within 19% of the real value
+BUCKETS = sorted(set(int(2 ** (step / 4.0)) for step in range(4 * 48)))
+
+
+class Timing(object):
+    """ The tally of the timings of a command phase
+
+    Attributes:
+        count (int): number of timings
+        total (int): sum of the timings, in nanoseconds
+        minimum (int): shortest timing, in nanoseconds
+        maximum (int): longest timing, in nanoseconds
+        buckets (list(int)): number of timings in each histogram bucket
+    """
+
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, elapsed):
+        """ Adds a timing to the tally
+
+        Args:
+            elapsed (int): the timing, in nanoseconds
+        """
+        self.count += 1
+        self.total += elapsed
+        if self.minimum is None or elapsed < self.minimum:
+            self.minimum = elapsed
+        if elapsed > self.maximum:
+            self.maximum = elapsed
+        self.buckets[max(0, bisect_right(BUCKETS, elapsed) - 1)] += 1
+
+    def percentile(self, fraction):
+        """ Estimates a percentile of the timings from the histogram
+
+        Args:
+            fraction (float): the percentile, from 0 to 1
+
+        Returns:
+            int: upper bound of the bucket holding the percentile, in
+                nanoseconds, never over the longest timing
+        """
+        rank = max(1, int(round(fraction * self.count)))
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                if index + 1 < len(BUCKETS):
+                    return min(BUCKETS[index+1], self.maximum)
+                return self.maximum
+
+        return self.maximum
+
+
+class CommandStats(object):
+    """ Timings of the program commands, by command letter and phase
+
+    Attributes:
+        timings (dict): maps a (command, phase) pair to its Timing
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    def record(self, command, phase, elapsed):
+        """ Records the timing of a command phase
+
+        Args:
+            command (str): the command letter
+            phase (str): the phase of the command, such as 'parse' or 'run'
+            elapsed (int): the timing, in nanoseconds
+        """
+        timing = self.timings.get((command, phase))
+        if timing is None:
+            timing = self.timings[(command, phase)] = Timing()
+        timing.add(elapsed)
+
+    def clear(self):
+        """ Forgets every timing """
+        self.timings.clear()
+
+    def format(self):
+        """ Formats the timings as a table, in milliseconds
+
+        Returns:
+            str: a line for each command phase, sorted by command
+        """
+        lines = ["%-7s %-6s %8s %11s %9s %9s %9s %9s" % (
+            'command', 'phase', 'count', 'total ms', 'min ms', 'p50 ms',
+            'p99 ms', 'max ms')]
+
+        for (command, phase), timing in sorted(self.timings.items()):
+            lines.append("%-7s %-6s %8d %11.3f %9.3f %9.3f %9.3f %9.3f" % (
+                command, phase, timing.count, timing.total / 1e6,
+                timing.minimum / 1e6, timing.percentile(0.5) / 1e6,
+                timing.percentile(0.99) / 1e6, timing.maximum / 1e6))
+
+        return '\n'.join(lines) + '\n'
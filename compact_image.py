@@ -0,0 +1,375 @@
+# -*- coding: utf8 -*-
+"""Code for the CompactTextImage class, a byte packed text image
+
+This module holds the CompactTextImage class, a TextImage that keeps its
+matrix as a single contiguous bytearray instead of a list of lists of str
+objects. A cell costs one byte instead of a pointer to a str object plus the
+list overhead, so large canvases fit in an order of magnitude less memory.
+"""
+import re
+import sys
+from text_image import TextImage
+
+ZERO = b'O'
+ZERO_RUN = re.compile(b'O+')
+
+
+def to_byte(value):
+    """ Converts a cell value to its one byte representation
+
+    Args:
+        value (str): value to be converted
+
+    Returns:
+        bytes: the single byte representing the value
+
+    Raises:
+        ValueError: The value is not a single ASCII character, so it can't
+            be stored in one byte
+    """
+    data = value.encode('ascii')
+    if len(data) != 1:
+        raise ValueError
+
+    return data
+
+
+def pack_segment(segment):
+    """ Converts a segment of cells, as read by any storage, to bytes
+
+    Args:
+        segment (bytes or list): the values of the cells
+
+    Returns:
+        bytes: the cells, one byte each
+
+    Raises:
+        ValueError: Some value is not a single ASCII character
+    """
+    if isinstance(segment, bytes):
+        return segment
+
+    return b''.join([to_byte(value) for value in segment])
+
+
+def pack_columns(image):
+    """ Packs a 2d list of columns into bytes, row by row
+
+    Args:
+        image (list(list)): a 2d list (columns of rows) of single ASCII
+            character values
+
+    Returns:
+        bytes: the cells of the image, row by row
+
+    Raises:
+        ValueError: Some value is not a single ASCII character
+    """
+    rows = len(image[0])
+    data = ''.join([''.join([column[row] for column in image])
+                    for row in range(rows)]).encode('ascii')
+    if len(data) != len(image) * rows:
+        raise ValueError
+
+    return data
+
+
+def parse_rows(data):
+    """ Checks the layout of the content of a saved image file
+
+    Args:
+        data (bytes): content of the file
+
+    Returns:
+        tuple: the content ending with a newline, its number of columns and
+            its number of rows
+
+    Raises:
+        ValueError: The rows have different widths or some value is not a
+            single ASCII character
+    """
+    if not data:
+        return data, 0, 0
+
+    if not data.endswith(b'\n'):
+        data += b'\n'
+
+    # Every row ends at a multiple of the first row length
+    cols = data.find(b'\n')
+    stride = cols + 1
+    if cols < 1 or len(data) % stride:
+        raise ValueError
+
+    rows = len(data) // stride
+    if data[cols::stride] != b'\n' * rows or data.count(b'\n') != rows:
+        raise ValueError
+
+    if not data.isascii():
+        raise ValueError
+
+    return data, cols, rows
+
+
+def zero_runs(data, start, width, left, right):
+    """ Find the runs of 'O' bytes of a row that touch an interval
+
+    Each run is returned whole, even if it goes beyond the interval.
+
+    Args:
+        data (memoryview): buffer holding the row bytes
+        start (int): position of the row in the buffer
+        width (int): number of bytes of the row
+        left (int): Initial horizontal position of the interval
+        right (int): Final horizontal position of the interval
+    Returns:
+        list(tuple): first and last horizontal positions of each run
+    """
+
+    # A run holding the left position may start before it. It's found in
+    # blocks of doubling size, so the cost follows the length of the run
+    # instead of its position in the row
+    begin = start + left
+    if data[begin] == ZERO[0]:
+        size = 64
+        while begin > start:
+            low = max(start, begin - size)
+            kept = len(bytes(data[low:begin]).rstrip(ZERO))
+            begin = low + kept
+            if kept:
+                break
+            size *= 2
+
+    # Only the interval is searched, and a run reaching its end is followed
+    # in blocks of doubling size, so the cost never follows the row width
+    stop = start + right + 1
+    runs = [[match.start(), match.end()]
+            for match in ZERO_RUN.finditer(data, begin, stop)]
+
+    if runs and runs[-1][1] == stop:
+        end = stop
+        size = 64
+        while end < start + width:
+            high = min(start + width, end + size)
+            piece = bytes(data[end:high])
+            zeros = len(piece) - len(piece.lstrip(ZERO))
+            end += zeros
+            if zeros < len(piece):
+                break
+            size *= 2
+        runs[-1][1] = end
+
+    return [(first - start, last - start - 1) for first, last in runs]
+
+
+class CompactTextImage(TextImage):
+    """ Text image stored in a single contiguous bytearray
+
+    This class has the same interface of the TextImage class, but the image
+    attribute is a bytearray with one byte per cell. The cells are stored
+    row by row, so the cell (col, row) is the byte at row * cols + col. This
+    makes a row write a single slice assignment, a column write an extended
+    slice assignment and the rendering of a row a plain bytes slice.
+
+    Since each cell is one byte, the values must be single ASCII characters.
+    Any other value raises ValueError.
+
+    Clearing the image, or initializing it again with the same size, only
+    marks its rows as stale, so it takes constant time. A stale row reads as
+    'O' and is zeroed in the bytearray when it's first used again.
+
+    Args:
+        image (list(list)): a 2d list (columns of rows) to instantiate
+        cols (int): number of columns to instantiate a empty image
+        rows (int): number of rows to instantiate a empty image
+
+    Attributes:
+        image (bytearray): the cells of the image, row by row
+        cols (int): number of columns of the image matrix
+        rows (int): number of rows of the image matrix
+        stride (int): number of bytes from the start of a row to the next.
+            It is the number of columns, unless a subclass lays extra bytes
+            after each row
+    """
+
+    def __init__(self, image=[], cols=0, rows=0):
+
+        #
+        # If a image was passed, pack it row by row
+        if image:
+            self.cols = len(image)
+            self.rows = len(image[0])
+            self.stride = self.cols
+            self.image = bytearray(pack_columns(image))
+            return
+
+        self.cols = cols
+        self.rows = rows
+        self.initialize_matrix(cols, rows)
+
+    def is_image_set(self):
+        """Check if the class attribute image is setted with values
+
+        Returns:
+            bool: flag of emtpy image attribute
+        """
+        return bool(self.image)
+
+    def memory_size(self):
+        """ Estimates the memory held by the cells of the image
+
+        Returns:
+            int: approximate size of the image attribute, in bytes
+        """
+        return sys.getsizeof(self.image)
+
+    def image_2_str(self):
+        """ Format the image matrix to a human readable format
+
+        Returns:
+            str: Human readable format of the image matrix
+        """
+        if not self.is_image_set():
+            return ''
+
+        # Memoryview slices avoid copying every row before the join
+        self._refresh(0, self.rows - 1)
+        cols = self.cols
+        view = memoryview(self.image)
+        output = b'\n'.join([view[start:start+cols]
+                             for start in range(0, len(view), cols)])
+
+        return (output + b'\n').decode('ascii')
+
+    #
+    # Storage kernels
+    #
+
+    def _allocate(self, cols, rows):
+        """ Set the image attribute with an empty cols x rows matrix """
+
+        # The bytearray of an image of the same size is cleared lazily
+        image = getattr(self, 'image', None)
+        if image is not None and self.stride == cols and \
+                len(image) == cols * rows:
+            self._expire()
+            return
+
+        self.stride = cols
+        self.image = bytearray(ZERO * (cols * rows))
+
+    def _parse(self, data):
+        """ Convert the content of a saved image file to an image attribute,
+        without touching the image """
+        data, cols, rows = parse_rows(data)
+        return cols, rows, bytearray(data.replace(b'\n', b''))
+
+    def _assign(self, image):
+        """ Set the image attribute with a matrix returned by _parse """
+        self.stride = self.cols
+        self.image = image
+
+    def _check_value(self, value):
+        """ Checks if a value can be stored in a cell, raising ValueError
+        if not """
+        to_byte(value)
+
+    def _convert_segment(self, segment):
+        """ Converts a segment read by the _read_segment of any storage to
+        bytes, raising ValueError if some value can't be stored """
+        return pack_segment(segment)
+
+    def _clear(self):
+        """ Set every cell of the image to 'O' """
+        self._expire()
+
+    def _zero_row(self, row):
+        """ Set every cell of a row to 'O' """
+        start = row * self.stride
+        self.image[start:start+self.cols] = ZERO * self.cols
+
+    def _get_cell(self, col, row):
+        """ Get the value of the cell at (col, row) """
+        self._refresh(row, row)
+        return chr(self.image[row * self.stride + col])
+
+    def _set_cell(self, col, row, value):
+        """ Set the value of the cell at (col, row) """
+        self._refresh(row, row)
+        self.image[row * self.stride + col] = to_byte(value)[0]
+
+    def _set_vertical(self, col, row_up, row_down, value):
+        """ Set the cells (col, row_up-row_down) with value """
+        self._refresh(row_up, row_down)
+        stride = self.stride
+        start = row_up * stride + col
+        stop = row_down * stride + col + 1
+        self.image[start:stop:stride] = (
+            to_byte(value) * (row_down - row_up + 1))
+
+    def _set_horizontal(self, col_left, col_right, row, value):
+        """ Set the cells (col_left-col_right, row) with value """
+        self._refresh(row, row)
+        start = row * self.stride
+        self.image[start+col_left:start+col_right+1] = (
+            to_byte(value) * (col_right - col_left + 1))
+
+    def _set_rect(self, col_top, row_top, col_bottom, row_bottom, value):
+        """ Set the rectangle from (col_top, row_top) to
+        (col_bottom, row_bottom) with value """
+        self._refresh(row_top, row_bottom)
+        stride = self.stride
+
+        # A rectangle as wide as the rows is a contiguous block
+        if col_top == 0 and col_bottom == stride - 1:
+            self.image[row_top*stride:(row_bottom+1)*stride] = (
+                to_byte(value) * ((row_bottom - row_top + 1) * stride))
+            return
+
+        line = to_byte(value) * (col_bottom - col_top + 1)
+        for start in range(row_top*stride, (row_bottom+1)*stride, stride):
+            self.image[start+col_top:start+col_bottom+1] = line
+
+    def _read_segment(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) as bytes """
+        self._refresh(row, row)
+        start = row * self.stride
+        return bytes(self.image[start+col_left:start+col_right+1])
+
+    def _write_segment(self, row, col_left, segment):
+        """ Set the cells from (col_left, row) on with a segment of bytes """
+        self._refresh(row, row)
+        start = row * self.stride + col_left
+        self.image[start:start+len(segment)] = segment
+
+    def _zero_runs(self, row, left, right):
+        """ Find the runs of 'O' cells of a row that touch an interval
+
+        Args:
+            row (int): Vertical position of the runs
+            left (int): Initial horizontal position of the interval
+            right (int): Final horizontal position of the interval
+        Returns:
+            list(tuple): first and last horizontal positions of each run
+        """
+        self._refresh(row, row)
+        return zero_runs(memoryview(self.image), row * self.stride, self.cols,
+                         left, right)
+
+    def _segment_str(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) joined as
+        a string """
+        self._refresh(row, row)
+        start = row * self.stride
+        return self.image[start+col_left:start+col_right+1].decode('ascii')
+
+    def _row_str(self, row):
+        """ Get the values of a row joined as a string, without newline """
+        self._refresh(row, row)
+        start = row * self.stride
+        return self.image[start:start+self.cols].decode('ascii')
+
+    def _row_bytes(self, row):
+        """ Get the values of a row encoded as bytes, without newline """
+        self._refresh(row, row)
+        start = row * self.stride
+        return memoryview(self.image)[start:start+self.cols]
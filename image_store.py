@@ -0,0 +1,306 @@
+# -*- coding: utf8 -*-
+"""Code for the ImageStore class, a memory bounded store of text images
+
+This module holds the ImageStore class, which keeps many text images, such
+as the images of the server sessions, by key. The memory of the resident
+images is kept under a budget: when it's exceeded, the least recently used
+images are spilled to disk in the binary format and restored when they are
+used again. The undo history of an image counts in its memory, and is
+spilled along with it. Its counters of hits, misses and
+evictions tell how well the budget fits the working set.
+"""
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+#
+# Default memory budget of the resident images, in bytes
+DEFAULT_BUDGET = 256 << 20
+
+
+class Entry(object):
+    """ An image of the store
+
+    Attributes:
+        image (TextImage): the image
+        size (int): memory held by the cells and the undo history of the
+            image when it was last measured, in bytes, 0 if spilled
+        pins (int): number of users of the image, which is never spilled
+            while in use
+        filename (str): file of the spilled cells, None if resident. The
+            undo history, if any, is spilled to the same name with a
+            '.undo' suffix
+        lock (threading.Lock): held while the image is spilled or restored
+    """
+
+    __slots__ = ('image', 'size', 'pins', 'filename', 'lock')
+
+    def __init__(self, image):
+        self.image = image
+        self.size = 0
+        self.pins = 0
+        self.filename = None
+        self.lock = threading.Lock()
+
+
+class ImageStore(object):
+    """ Store of text images by key, under a memory budget
+
+    An image is used between acquire and release calls, which pin it, so it
+    is never spilled while in use. Its memory is measured on release, since
+    it may have been resized, and the least recently used images are then
+    spilled until the resident images fit the budget again. A single image
+    larger than the budget stays resident while in use.
+
+    The store is thread safe, and the slow part of its calls, spilling and
+    restoring the images, runs out of its lock. So the server calls it from
+    its thread pool, and a large spill never holds up the other sessions.
+
+    Args:
+        factory (function): creates the image of a new key
+        budget (int): memory cap of the resident images, in bytes
+        directory (str): directory of the spilled images, a temporary one
+            removed on close by default
+
+    Attributes:
+        budget (int): memory cap of the resident images, in bytes
+        size (int): memory held by the resident images, in bytes
+        hits (int): acquired images that were resident
+        misses (int): acquired images that were spilled or new
+        evictions (int): images spilled to disk
+    """
+
+    def __init__(self, factory, budget=DEFAULT_BUDGET, directory=None):
+        self.factory = factory
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._temporary = directory is None
+        self._directory = directory or tempfile.mkdtemp(prefix='text_images')
+        self._entries = {}
+        self._recent = OrderedDict()
+        self._serial = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def acquire(self, key):
+        """ Gets the image of a key for use, restoring it if spilled or
+        creating it if new
+
+        Args:
+            key (hashable): the key of the image
+
+        Returns:
+            TextImage: the image, pinned until release is called
+
+        Raises:
+            OSError: The spilled image can't be read
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                entry = self._entries[key] = Entry(self.factory())
+            elif entry.filename is None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            entry.pins += 1
+
+        # A spill of the image still running ends before the restore
+        try:
+            with entry.lock:
+                if entry.filename is not None:
+                    restore(entry.image, entry.filename)
+                    entry.filename = None
+        except Exception:
+            with self._lock:
+                entry.pins -= 1
+            raise
+
+        with self._lock:
+            self._recent[key] = entry
+            self._recent.move_to_end(key)
+            self._measure(entry)
+
+        return entry.image
+
+    def release(self, key):
+        """ Ends a use of the image of a key, spilling the least recently
+        used images if the store is over its budget
+
+        Args:
+            key (hashable): the key of the image
+
+        Raises:
+            OSError: An image can't be spilled
+        """
+        with self._lock:
+            entry = self._entries[key]
+            entry.pins -= 1
+            self._measure(entry)
+
+        self._evict()
+
+    def discard(self, key):
+        """ Drops the image of a key, resident or spilled
+
+        Args:
+            key (hashable): the key of the image
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+
+            self._recent.pop(key, None)
+            self.size -= entry.size
+
+        with entry.lock:
+            if entry.filename is not None:
+                remove(entry.image, entry.filename)
+
+    def close(self):
+        """ Drops every image, and the spill directory if it's temporary """
+        for key in list(self._entries):
+            self.discard(key)
+
+        if self._temporary:
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    def format(self):
+        """ Formats the state and counters of the store
+
+        Returns:
+            str: a line with the resident and spilled images, their memory
+                and the counters
+        """
+        with self._lock:
+            return ("store: %d resident, %d spilled, %.1f of %.1f MiB, "
+                    "%d hits, %d misses, %d evictions\n" % (
+                        len(self._recent),
+                        len(self._entries) - len(self._recent),
+                        self.size / 1048576.0, self.budget / 1048576.0,
+                        self.hits, self.misses, self.evictions))
+
+    def _measure(self, entry):
+        """ Updates the memory of a resident image and its undo history """
+        size = entry.image.memory_size()
+        if entry.image.journal is not None:
+            size += entry.image.journal.size
+        self.size += size - entry.size
+        entry.size = size
+
+    def _evict(self):
+        """ Spills the least recently used images that are not in use, until
+        the resident images fit the budget """
+        while True:
+            with self._lock:
+                victim = self._victim()
+                if victim is None:
+                    return
+                key, entry, size = victim
+
+            # Only the spill runs out of the store lock. An acquire of the
+            # image waits for it on the lock of the entry
+            try:
+                spill(entry.image, entry.filename)
+            except Exception:
+                with self._lock:
+                    entry.filename = None
+                    self.evictions -= 1
+
+                    # A discarded image is no longer counted
+                    if key in self._entries:
+                        entry.size = size
+                        self.size += size
+                        self._recent[key] = entry
+                raise
+            finally:
+                entry.lock.release()
+
+    def _victim(self):
+        """ Picks the least recently used image to be spilled, if the
+        resident images are over the budget, taking the lock of its entry
+
+        Returns:
+            tuple: the key, entry and former size of the image, or None if
+                no image has to or can be spilled
+        """
+        if self.size <= self.budget:
+            return None
+
+        for key, entry in self._recent.items():
+            if entry.pins or not entry.size:
+                continue
+
+            # An entry that is not pinned is never being restored, so its
+            # lock is free
+            entry.lock.acquire()
+            self._serial += 1
+            entry.filename = os.path.join(self._directory,
+                                          '%d.txi' % self._serial)
+            size = entry.size
+            self.size -= size
+            entry.size = 0
+            del self._recent[key]
+            self.evictions += 1
+            return key, entry, size
+
+        return None
+
+
+def spill(image, filename):
+    """ Moves the cells of an image, and its undo history if any, to files
+
+    The cells are spilled first. If the undo history can't be spilled, they
+    are brought back, so a failed spill leaves the image as it was.
+
+    Args:
+        image (TextImage): the image
+        filename (str): file of the cells
+    """
+    image.spill(filename)
+    if image.journal is None:
+        return
+
+    try:
+        image.journal.spill(filename + '.undo')
+    except Exception:
+        image.restore(filename)
+        os.remove(filename)
+        if os.path.exists(filename + '.undo'):
+            os.remove(filename + '.undo')
+        raise
+
+
+def restore(image, filename):
+    """ Brings back the cells and undo history moved to files by spill,
+    removing the files
+
+    Args:
+        image (TextImage): the image
+        filename (str): file of the cells
+    """
+    image.restore(filename)
+    if image.journal is not None:
+        image.journal.restore(filename + '.undo')
+    remove(image, filename)
+
+
+def remove(image, filename):
+    """ Removes the files of a spilled image """
+    os.remove(filename)
+    if image.journal is not None:
+        os.remove(filename + '.undo')
@@ -0,0 +1,326 @@
+# -*- coding: utf8 -*-
+"""Code for the Journal class that holds the undo and redo history
+
+This module holds the Journal class, a delta journal of the edits made on a
+text image. Each edit only records the previous values of the cells it is
+about to change, so undoing or redoing an edit costs as much as the edit
+itself and the image is never copied as a whole, unless the edit changes
+the whole image.
+"""
+import marshal
+import sys
+from collections import deque
+
+#
+# Default memory cap of a journal, in bytes
+DEFAULT_LIMIT = 64 << 20
+
+#
+# Approximate memory cost of a record besides its segments, in bytes
+RECORD_SIZE = 128
+
+
+class Entry(object):
+    """ The records of a single edit
+
+    Attributes:
+        records (list(tuple)): the records, in the order they were saved
+        size (int): approximate memory used by the records, in bytes
+    """
+
+    __slots__ = ('records', 'size')
+
+    def __init__(self, records=None, size=0):
+        self.records = records if records is not None else []
+        self.size = size
+
+
+class Journal(object):
+    """ Delta journal of the edits of a text image, for undo and redo
+
+    Each edit is an entry of records. A record holds the previous values of
+    a rectangle of cells:
+
+        ('cells', col_top, row_top, col_bottom, row_bottom, content)
+
+    The content is a single value if the whole rectangle had the same value,
+    otherwise a list with, for each row, either a single value if the row
+    segment had the same value, or the segment read from the image. An
+    initialization is recorded as the previous size and content:
+
+        ('image', cols, rows, cells_record)
+
+    The journal keeps the memory of its entries under a cap, evicting the
+    oldest entries first. An edit of more cells than the cap is never read:
+    it can't be undone, so the whole history is dropped instead.
+
+    Args:
+        limit (int): memory cap of the entries, in bytes
+
+    Attributes:
+        limit (int): memory cap of the entries, in bytes
+        size (int): approximate memory used by the entries, in bytes
+    """
+
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self.limit = limit
+        self.size = 0
+        self._undo = deque()
+        self._redo = deque()
+        self._entry = None
+
+    def start(self):
+        """ Starts the entry of a new edit
+
+        Any undone edit can't be redone after a new one.
+        """
+        self.size -= sum(entry.size for entry in self._redo)
+        self._redo.clear()
+        self._entry = Entry()
+        self._undo.append(self._entry)
+
+    def save(self, image, col_top, row_top, col_bottom, row_bottom):
+        """ Saves the values of a rectangle of cells about to be changed
+
+        Args:
+            image (TextImage): the image about to be changed
+            col_top (int): Top horizontal position of the rectangle
+            row_top (int): Top verticaal position of the rectangle
+            col_bottom (int): Bottom horizontal position of the rectangle
+            row_bottom (int): Bottom vertical position of the rectangle
+        """
+        if self._entry is None:
+            return
+
+        if not self._fits((col_bottom - col_top + 1) *
+                          (row_bottom - row_top + 1)):
+            return
+
+        record, size = self._capture(image, col_top, row_top,
+                                     col_bottom, row_bottom)
+        self._add(record, size)
+
+    def save_image(self, image):
+        """ Saves the size and values of an image about to be initialized
+
+        Args:
+            image (TextImage): the image about to be initialized
+        """
+        if self._entry is None:
+            return
+
+        if image.is_image_set() and not self._fits(image.cols * image.rows):
+            return
+
+        record, size = self._capture_image(image)
+        self._add(record, size)
+
+    def undo(self, image):
+        """ Undoes the last edit of an image
+
+        Args:
+            image (TextImage): the image the journal belongs to
+
+        Returns:
+            bool: False if there was no edit to undo
+        """
+        return self._move(image, self._undo, self._redo)
+
+    def redo(self, image):
+        """ Redoes the last undone edit of an image
+
+        Args:
+            image (TextImage): the image the journal belongs to
+
+        Returns:
+            bool: False if there was no edit to redo
+        """
+        return self._move(image, self._redo, self._undo)
+
+    def spill(self, filename):
+        """ Moves the edits to a file, until restore is called with it
+
+        Args:
+            filename (str): filename of the spilled edits
+        """
+        stacks = [[(entry.records, entry.size) for entry in stack]
+                  for stack in (self._undo, self._redo)]
+        with open(filename, 'wb') as f:
+            marshal.dump(stacks, f)
+
+        self.clear()
+
+    def restore(self, filename):
+        """ Brings back the edits moved to a file by spill
+
+        Args:
+            filename (str): filename of the spilled edits
+        """
+        with open(filename, 'rb') as f:
+            undo, redo = marshal.load(f)
+
+        self._undo = deque(Entry(records, size) for records, size in undo)
+        self._redo = deque(Entry(records, size) for records, size in redo)
+        self._entry = None
+        self.size = sum(entry.size for entry in self._undo) + \
+            sum(entry.size for entry in self._redo)
+
+    def checkpoint(self):
+        """ Takes the state of the history, to be brought back by rollback
+        if the next edit fails
+
+        Returns:
+            tuple: the state of the history
+        """
+        return list(self._undo), list(self._redo), self._entry, self.size
+
+    def rollback(self, checkpoint):
+        """ Brings the history back to a state taken by checkpoint
+
+        Args:
+            checkpoint (tuple): the state of the history
+        """
+        undo, redo, self._entry, self.size = checkpoint
+        self._undo = deque(undo)
+        self._redo = deque(redo)
+
+    def clear(self):
+        """ Forgets all the edits """
+        self._undo.clear()
+        self._redo.clear()
+        self._entry = None
+        self.size = 0
+
+    def _fits(self, cells):
+        """ Checks if a rectangle of cells may fit the memory cap before
+        it's read, dropping the whole history if it can't, since the edit
+        can't be undone
+
+        Returns:
+            bool: False if the history was dropped
+        """
+        if RECORD_SIZE + cells <= self.limit:
+            return True
+
+        self.clear()
+        return False
+
+    def _add(self, record, size):
+        """ Adds a record to the current entry, keeping the memory cap """
+        self._entry.records.append(record)
+        self._entry.size += size
+        self.size += size
+        self._evict()
+
+    def _evict(self):
+        """ Drops the oldest entries while the memory is over the cap """
+        while self.size > self.limit and self._undo:
+            entry = self._undo.popleft()
+            self.size -= entry.size
+
+            # The current edit alone is over the cap, so it can't be undone
+            # and the rest of its records are not saved
+            if entry is self._entry:
+                self._entry = None
+
+        while self.size > self.limit and self._redo:
+            self.size -= self._redo.popleft().size
+
+    def _move(self, image, source, target):
+        """ Applies the last entry of a stack and pushes its inverse into the
+        other stack """
+        if not source:
+            return False
+
+        entry = source.pop()
+        self.size -= entry.size
+        self._entry = None
+
+        # The journal is detached, so restoring does not record edits
+        image.journal = None
+        try:
+            inverse = Entry()
+            for record in reversed(entry.records):
+                record, size = self._restore(image, record)
+                inverse.records.append(record)
+                inverse.size += size
+            inverse.records.reverse()
+        finally:
+            image.journal = self
+
+        target.append(inverse)
+        self.size += inverse.size
+        self._evict()
+        return True
+
+    def _capture(self, image, col_top, row_top, col_bottom, row_bottom):
+        """ Reads the values of a rectangle of cells into a record
+
+        Returns:
+            tuple: the record and its approximate size in bytes
+        """
+        content = []
+        size = RECORD_SIZE
+        uniform = True
+
+        for row in range(row_top, row_bottom+1):
+            segment = image._read_segment(row, col_top, col_bottom)
+            if segment.count(segment[0]) == len(segment):
+                content.append(image._get_cell(col_top, row))
+            else:
+                content.append(segment)
+                size += sys.getsizeof(segment)
+                uniform = False
+
+        if uniform and content.count(content[0]) == len(content):
+            content = content[0]
+        else:
+            size += 8 * len(content)
+
+        record = ('cells', col_top, row_top, col_bottom, row_bottom, content)
+        return record, size
+
+    def _capture_image(self, image):
+        """ Reads the size and values of an image into a record
+
+        Returns:
+            tuple: the record and its approximate size in bytes
+        """
+        if not image.is_image_set():
+            return ('image', image.cols, image.rows, None), RECORD_SIZE
+
+        record, size = self._capture(image, 0, 0, image.cols-1, image.rows-1)
+        return ('image', image.cols, image.rows, record), size
+
+    def _restore(self, image, record):
+        """ Writes a record back into the image
+
+        Returns:
+            tuple: the record of the values it replaced and its size
+        """
+        if record[0] == 'image':
+            inverse = self._capture_image(image)
+            image.initialize_matrix(record[1], record[2])
+            if record[3] is not None:
+                self._restore(image, record[3])
+            return inverse
+
+        _, col_top, row_top, col_bottom, row_bottom, content = record
+        inverse = self._capture(image, col_top, row_top,
+                                col_bottom, row_bottom)
+
+        # The journal is detached, so this only tells the image which cells
+        # are about to change
+        image._edit(col_top, row_top, col_bottom, row_bottom)
+
+        if isinstance(content, str):
+            image._set_rect(col_top, row_top, col_bottom, row_bottom, content)
+            return inverse
+
+        for row, segment in enumerate(content, row_top):
+            if isinstance(segment, str):
+                image._set_horizontal(col_top, col_bottom, row, segment)
+            else:
+                image._write_segment(row, col_top, segment)
+
+        return inverse
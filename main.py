@@ -6,8 +6,72 @@ This module holds the main parsing of arguments and operations of the image
 matrix manipulation
 
 """
+import argparse
+import atexit
 import sys
+from collections import namedtuple
+from functools import partial
+from operator import attrgetter
+from time import perf_counter_ns
 from text_image import TextImage
+from row_image import RowMajorTextImage
+from numpy_image import NumpyTextImage, numpy
+from mapped_image import MappedTextImage
+from journal import Journal, DEFAULT_LIMIT
+from command_stats import CommandStats
+from script_optimizer import optimize
+
+#
+# User interaction error messages, by their flagged type
+#
+ERRORS = {'command': (" >  INVALID COMMAND\n"
+                     " >     This input is not a valid command\n"),
+          'syntax': (" >  INVALID COMMAND SYNTAX\n"
+                     " >     This command requires correct argument\n"
+                     " >     values to proceed\n"),
+          'empty': (" >  INVALID COMMAND\n"
+                    " >     This input is not a valid command\n"),
+          'value': (" > INVALID COMMAND INPUT\n"
+                    " >     The commands require integer values for image\n"
+                    " >     dimensions input and single character\n"
+                    " >     values\n"),
+          'bounds': (" > INVALID IMAGE BOUNDS\n"
+                     " >     The commands require integer values for\n"
+                     " >     image positions that are with the\n"
+                     " >     image size\n"),
+          'interval': (" > INVALID IMAGE POSITION INTERVAL\n"
+                       " >     The commands require integer values for\n"
+                       " >     image positions that required that the  \n"
+                       " >     first is greater than the second\n"),
+          'filename': (" > INVALID FILENAME FORMAT\n"
+                       " >     To save a file properly, input a file name\n"
+                       " >     with at least 3 letters\n"),
+          'file': (" > SYSTEM ERROR\n"
+                   " >     An error occured while trying to save or open\n"
+                   " >     a file. Check the file path and access\n"
+                   " >     permission\n"),
+          'format': (" > INVALID IMAGE FILE\n"
+                     " >     The file is not a saved image. Its rows must\n"
+                     " >     have the same width\n"),
+          'history': (" > NOTHING TO UNDO OR REDO\n"
+                      " >     There is no recorded edit to be undone or\n"
+                      " >     redone\n"),
+          'size': (" > IMAGE TOO LARGE\n"
+                   " >     The image has more cells than the server\n"
+                   " >     allows for a session\n"),
+          'other': (" >  AN ERROR OCCURRED\n"
+                    " >       Please, keep in mind to use the\n"
+                    " >       designated commands\n"),
+          }
+
+#
+# Buffer size used to read command scripts in batch mode
+BUFFER_SIZE = 1 << 20
+
+#
+# Timings of the commands run in this session, by command letter. Invalid
+# command letters are tallied as '?'
+STATS = CommandStats()
 
 
 def print_error(error_type):
@@ -25,38 +89,9 @@ def print_error(error_type):
 
     """
 
-    errors = {'command': (" >  INVALID COMMAND\n"
-                         " >     This input is not a valid command\n"),
-              'syntax': (" >  INVALID COMMAND SYNTAX\n"
-                         " >     This command requires correct argument\n"
-                         " >     values to proceed\n"),
-              'empty': (" >  INVALID COMMAND\n"
-                        " >     This input is not a valid command\n"),
-              'value': (" > INVALID COMMAND INPUT\n"
-                        " >     The commands require integer values for image\n"
-                        " >     dimensions input\n"),
-              'bounds': (" > INVALID IMAGE BOUNDS\n"
-                         " >     The commands require integer values for\n"
-                         " >     image positions that are with the\n"
-                         " >     image size\n"),
-              'interval': (" > INVALID IMAGE POSITION INTERVAL\n"
-                           " >     The commands require integer values for\n"
-                           " >     image positions that required that the  \n"
-                           " >     first is greater than the second\n"),
-              'filename': (" > INVALID FILENAME FORMAT\n"
-                           " >     To save a file properly, input a file name\n"
-                           " >     with at least 3 letters\n"),
-              'file': (" > SYSTEM ERROR\n"
-                       " >     An error occured while trying to save a file.\n"
-                       " >     Check the file path and access permission\n"),
-              'other': (" >  AN ERROR OCCURRED\n"
-                        " >       Please, keep in mind to use the\n"
-                        " >       designated commands\n"),
-        }
-
-    message = errors['other']
-    if error_type in errors:
-        message = errors[error_type]
+    message = ERRORS['other']
+    if error_type in ERRORS:
+        message = ERRORS[error_type]
 
     header = "----------------------    ERROR    -------------------------\n"
     footer = "------------------------------------------------------------\n\n"
@@ -64,14 +99,42 @@ def print_error(error_type):
     print(header + message + footer)
 
 
+def new_image():
+    """ Creates the text image the program works on
+
+    The NumPy engine is picked when NumPy is installed, since its operations
+    run as array slices. Otherwise, the pure Python row major image is used,
+    since the output is written row by row.
+
+    Returns:
+        TextImage: an empty text image
+    """
+    if numpy is not None:
+        return NumpyTextImage()
+
+    return RowMajorTextImage()
+
+
 def print_guide(initial=False):
     """ Prints the program guide to the user
 
+    Args:
+        initial (bool): Flag to add the program header to the output string
+    """
+    print(guide_text(initial))
+
+
+def guide_text(initial=False):
+    """ Formats the program guide
+
     This shows how the commands should be formated, so the user have some way
     to guide itself in the operations of the text manipulation.
 
     Args:
         initial (bool): Flag to add the program header to the output string
+
+    Returns:
+        str: the guide message
     """
 
     #
@@ -105,10 +168,38 @@ def print_guide(initial=False):
                "      Fills a region with value C. A region is defined by the\n"
                "      X,Y position with value C and neighbor zero valued (O)\n"
                "      positions, both horizontaly and verticaly.\n\n"
+               "    Y X1 Y1 X2 Y2 X Y:\n"
+               "      Copies the rectangular region with bounds (X1,Y1) for\n"
+               "      top-left corner and (X2,Y2) to bottom-right corner to\n"
+               "      the region with top-left corner (X,Y)\n\n"
+               "    M X1 Y1 X2 Y2 X Y:\n"
+               "      Moves the rectangular region with bounds (X1,Y1) for\n"
+               "      top-left corner and (X2,Y2) to bottom-right corner to\n"
+               "      the region with top-left corner (X,Y), leaving zero\n"
+               "      valued (O) positions behind\n\n"
                "    S 'filename':\n"
                "      Saves the matrix to a file with name 'filename'\n\n"
+               "    B 'filename':\n"
+               "      Saves the matrix to a compressed binary file with name\n"
+               "      'filename'\n\n"
+               "    O 'filename':\n"
+               "      Opens the matrix saved to a file with name 'filename',\n"
+               "      by S or B\n\n"
+               "    U:\n"
+               "      Undoes the last edit of the image\n\n"
+               "    R:\n"
+               "      Redoes the last undone edit of the image\n\n"
                "    P:\n"
                "      Prints the current state of the text image\n\n"
+               "    P X1 Y1 X2 Y2:\n"
+               "      Prints the rectangular region with bounds (X1,Y1)\n"
+               "      for top-left corner and (X2,Y2) to bottom-right\n"
+               "      corner\n\n"
+               "    W M N:\n"
+               "      Prints the image in pages of up to MxN ( colsXrows )\n"
+               "      values, each one after a line with its P bounds\n\n"
+               "    T:\n"
+               "      Prints the timings of the commands run so far\n\n"
                "    X:\n"
                "      Exits the program\n\n"
                "-----------------------------------------------------------\n\n"
@@ -118,64 +209,245 @@ def print_guide(initial=False):
     if initial:
         message = header + message
 
-    print(message)
+    return message
 
 
-def handle_user_input(image, user_input):
-    """ Handle the user input from the prompt
+def print_image(image, *window):
+    """ Prints the current state of the text image
 
-    The user can effectively make operations by calling the correct command
-    syntax described on the help guide. However, any user is prone to errors
-    while manipulating information from a program interface. This function
-    parses the user commands, warn she/he for the correct command syntax,
-    check value inputs and provide feedback on later processing stages.
+    Args:
+        image (TextImage) : Object representing the image matrix
+        window (tuple): the (col_top, row_top, col_bottom, row_bottom)
+            bounds of the rectangle to be printed, the whole image if empty
+    """
+    print(image_text(image, *window))
 
-    The commands are called from here.
+
+def image_text(image, *window):
+    """ Formats the current state of the text image, or of a rectangle of it
 
     Args:
-        user_input (str): String containing the user input from the command line
+        image (TextImage) : Object representing the image matrix
+        window (tuple): the (col_top, row_top, col_bottom, row_bottom)
+            bounds of the rectangle, the whole image if empty
 
+    Returns:
+        str: the rows of the image or of the rectangle
     """
+    if window:
+        return image.window_2_str(*window)
 
-    #
-    # List of valid commands
-    valid_commands = ['G', 'X', 'P', 'I', 'C', 'L', 'V', 'H', 'K', 'F', 'S']
+    return image.image_2_str()
 
 
-    #
-    # Command related operations
-    #
+def print_pages(image, width, height):
+    """ Prints the text image page by page, each page as soon as it's
+    formatted
 
-    # Splits the string. The arguments must be separated by spaces
-    # Commands argument counting and parsing are done ahead
-    command = user_input.split()
+    Args:
+        image (TextImage) : Object representing the image matrix
+        width (int): Number of columns of each page
+        height (int): Number of rows of each page
+    """
+    for text in page_texts(image, width, height):
+        print(text)
 
-    # User provided an empty string as input and pressed enter
-    if not command:
-        print_error('command')
-        return
 
-    # Gets the fist splited string, expected to be a valid command
-    # and get its related arguments
-    function = command[0]
-    args = command[1:]
+def page_texts(image, width, height):
+    """ Formats the text image in pages of up to width x height cells
 
-    # The input wasn't identified as any valid command
-    if function not in valid_commands:
-        print_error('command')
-        return
+    Each page starts with a header of its bounds, as the arguments of the
+    P command that prints it alone.
 
-    # Handle the parsing of the arguments
-    handle_function_calls(image, function, args)
+    Args:
+        image (TextImage) : Object representing the image matrix
+        width (int): Number of columns of each page
+        height (int): Number of rows of each page
 
+    Yields:
+        str: the header and rows of each page
+    """
+    for bounds, text in image.pages(width, height):
+        yield "-- %d %d %d %d --\n" % tuple(bound + 1 for bound in bounds) + \
+            text
+
+
+def load_image(image, filename):
+    """ Loads a saved image file into the text image
+
+    Args:
+        image (TextImage) : Object representing the image matrix
+        filename (str): filename of the saved image
+
+    Raises:
+        CommandError: The file is not a saved image
+    """
+    try:
+        image.load_matrix(filename)
+    except ValueError:
+        raise CommandError('format')
+
+
+def undo_edit(image):
+    """ Undoes the last edit of the text image
+
+    Args:
+        image (TextImage) : Object representing the image matrix
+
+    Raises:
+        CommandError: There is no edit to undo
+    """
+    if not image.undo():
+        raise CommandError('history')
 
-def handle_function_calls(image, command, args):
-    """ Handle the argument passing and objet call for command functions
 
-    The commands passed arguments needs to process each input to the
-    due function to be executed. This function figures if the method needs a
-    value, its number of arguments and so on. Basically, it maps, converts and
-    pass the arguments for each command to the TextImage due method
+def redo_edit(image):
+    """ Redoes the last undone edit of the text image
+
+    Args:
+        image (TextImage) : Object representing the image matrix
+
+    Raises:
+        CommandError: There is no edit to redo
+    """
+    if not image.redo():
+        raise CommandError('history')
+
+
+def print_stats(file=None):
+    """ Prints the timings of the commands run in this session
+
+    Args:
+        file (file): text stream to print to, the standard output by default
+    """
+    print(STATS.format(), file=file)
+
+
+def exit_program():
+    """ Says goodbye to the user and exits the program """
+    print("Goodbye :'( ")
+    sys.exit(0)
+
+
+#
+# Specification of each command. Each command has a similar way of calling
+# its function, such as row and columns position definitions and value
+# settings, but each one has a particularity, such as argument quantity
+# and dimension mapping:
+#
+#       args : the numbers of arguments that the function accepts. A None
+#              among them accepts any other number, ignoring the arguments
+#       has_value: specifies the need of a value to be inserted/processed
+#       map_dimension: flags if should map the passed position to due
+#                      zero valued bounds
+#       needs_image: flags if the command only works on initialized images
+#       bind: gets the function to be called with the processed arguments
+#             from the image the command runs on
+#
+Command = namedtuple('Command',
+                     'args has_value map_dimension needs_image bind')
+
+COMMANDS = {
+    'G': Command((0, None), False, False, False, lambda image: print_guide),
+    'X': Command((0, None), False, False, False,
+                 lambda image: exit_program),
+    'P': Command((0, 4, None), False, True, False,
+                 lambda image: partial(print_image, image)),
+    'W': Command((2,), False, False, True,
+                 lambda image: partial(print_pages, image)),
+    'I': Command((2,), False, False, False, attrgetter('initialize_matrix')),
+    'C': Command((0,), False, False, True, attrgetter('clear_matrix')),
+    'L': Command((3,), True, True, True, attrgetter('lay_value_at')),
+    'V': Command((4,), True, True, True, attrgetter('vertical_values')),
+    'H': Command((4,), True, True, True, attrgetter('horizontal_values')),
+    'K': Command((5,), True, True, True, attrgetter('key_in_rect')),
+    'F': Command((3,), True, True, True, attrgetter('fill_region')),
+    'Y': Command((6,), False, True, True, attrgetter('copy_region')),
+    'M': Command((6,), False, True, True, attrgetter('move_region')),
+    'S': Command((1,), True, False, True, attrgetter('save_matrix')),
+    'B': Command((1,), True, False, True, attrgetter('save_binary')),
+    'O': Command((1,), True, False, False,
+                 lambda image: partial(load_image, image)),
+    'U': Command((0,), False, False, False,
+                 lambda image: partial(undo_edit, image)),
+    'R': Command((0,), False, False, False,
+                 lambda image: partial(redo_edit, image)),
+    'T': Command((0,), False, False, False, lambda image: print_stats),
+    }
+
+
+class CommandError(Exception):
+    """ Raised when an user input can't be compiled into an operation
+
+    Args:
+        error_type (str): Error key of the invalid input, as used by
+            print_error
+    """
+
+    def __init__(self, error_type):
+        super(CommandError, self).__init__(error_type)
+        self.error_type = error_type
+
+
+class Operation(object):
+    """ A command compiled into a ready to run operation
+
+    The arguments are already converted and mapped to the zero indexed
+    positions of the image, and the function to be called is already bound
+    to the image, so running an operation is a single call.
+
+    Args:
+        command (str): The command letter
+        image (TextImage) : The image the operation runs on
+        function (function): The function to be called
+        args (tuple): The processed arguments of the function
+
+    Attributes:
+        command (str): The command letter
+        image (TextImage) : The image the operation runs on
+        function (function): The function to be called
+        args (tuple): The processed arguments of the function
+        needs_image (bool): Flags if the image must be initialized to run
+    """
+
+    __slots__ = ('command', 'image', 'function', 'args', 'needs_image')
+
+    def __init__(self, command, image, function, args):
+        self.command = command
+        self.image = image
+        self.function = function
+        self.args = args
+        self.needs_image = COMMANDS[command].needs_image
+
+    def __call__(self):
+        """ Runs the operation """
+        return self.function(*self.args)
+
+    def replace(self, command, args):
+        """ Creates an operation of a command on the same image
+
+        Args:
+            command (str): The command letter
+            args (tuple): The processed arguments of the function
+
+        Returns:
+            Operation: the new operation
+        """
+        return Operation(command, self.image,
+                         COMMANDS[command].bind(self.image), args)
+
+    def __repr__(self):
+        """ Representation of the operation """
+        return "Operation(%r, %r)" % (self.command, self.args)
+
+
+def compile_command(image, command, args):
+    """ Compiles a command and its arguments into an operation
+
+    This function figures if the command needs a value, its number of
+    arguments and so on. Basically, it maps and converts the arguments
+    and binds the function of the command to the image just once, so the
+    resulting operation can be run without any further parsing.
 
     Args:
         image (TextImage) : Object representing the image matrix and its
@@ -183,164 +455,383 @@ def handle_function_calls(image, command, args):
         command (str) : The command the user has input
         args (list(str)): a list of user input strings that should be the
             methods arguments
-    """
-
-    #
-    # Not image related operations
-    #
-
-    # Print the helping guide
-    if command == 'G':
-        print_guide()
-        return
 
-    # Exit the program
-    if command == 'X':
-        print("Goodbye :'( ")
-        sys.exit(0)
-        return
+    Returns:
+        Operation: the compiled operation
 
-    # Print the text image
-    if command == 'P':
-        print(image)
-        return
+    Raises:
+        CommandError: The command is not valid, has a wrong number of
+            arguments or has non integer positions
+    """
+    spec = COMMANDS.get(command)
 
-    #
-    # Most of the commands below are executed on filled images
-    # If the image wasn't initialized, the other commands
-    # will not work properly. So we block their calls if the
-    # image wasn't initialized
-    if not image.image and command != 'I':
-        print_error('empty')
-        return
+    # The input wasn't identified as any valid command
+    if spec is None:
+        raise CommandError('command')
 
-    # Handle matrix bound methods of the text image
-    # Each command has a similar way of calling the matrix methods,
-    # such as row and columns position definitions and value settings,
-    # but each one has a particularity, such as method call name, argument
-    # quantity and dimension mapping. So, the following dict handles each
-    # commmand in its particularities:
-    #
-    #       args : the number of arguments that the function requires
-    #       has_value: specifies the need of a value to be inserted/processed
-    #       map_dimension: flags if should map the passed position to due
-    #                      zero valued bounds
-    #       name: name of the TextImage method to be called with the processed
-    #             arguments
-    #
-    function = {
-        'C': {'args':0,
-              'has_value': False,
-              'map_dimension': False,
-              'name': 'clear_matrix'},
-        'I': {'args':2,
-              'has_value': False,
-              'map_dimension': False,
-              'name': 'initialize_matrix'
-              },
-        'L': {'args':3,
-              'has_value': True,
-              'map_dimension': True,
-              'name': 'lay_value_at'
-              },
-        'V': {'args':4,
-              'has_value': True,
-              'map_dimension': True,
-              'name': 'vertical_values'
-              },
-        'H': {'args':4,
-              'has_value': True,
-              'map_dimension': True,
-              'name': 'horizontal_values'
-              },
-        'K': {'args':5,
-              'has_value': True,
-              'map_dimension': True,
-              'name': 'key_in_rect'
-              },
-        'F': {'args':3,
-              'has_value': True,
-              'map_dimension': True,
-              'name': 'fill_region'
-              },
-        'S': {'args':1,
-              'has_value': True,
-              'map_dimension': False,
-              'name': 'save_matrix'
-              },
-        }
-
-    # Check if the number of arguments is correct
-    if len(args) != function[command]['args']:
-        print_error('syntax')
-        return
+    # Check if the number of arguments is correct. Some commands ignore
+    # any unexpected arguments, as the guide and exit always did
+    if len(args) not in spec.args:
+        if None not in spec.args:
+            raise CommandError('syntax')
+        args = []
 
     # Separate the value from the argument parsing
     # Although 'value' is a argument, it isn't manipulated
     # as the other args, so it is set apart from the list
-    value = ''
+    if spec.has_value:
+        numbers = args[:-1]
+    else:
+        numbers = args
 
-    # If the command requires value, it removes it from the current args list
-    if function[command]['has_value']:
-        value = args[-1]
-        args = args[:len(args)-1]
+    # This flags if it is necessary to do a subtraction operation before
+    # passing the argument, since matrix operations are zero indexed,
+    # while user interface operations aren't
+    offset = 1 if spec.map_dimension else 0
 
-    # Parse the arguments and pass it to the due function
     try:
-        # Convert the numeric arguments from strings
-        args = [int(arg) for arg in args]
+        converted = [int(arg) - offset for arg in numbers]
+    except ValueError:
+        raise CommandError('value')
+
+    # Reattach value to the argument list
+    if spec.has_value:
+        converted.append(args[-1])
 
-        # This flags if it is necessary to do a subtraction operation before
-        # passing the argument, since matrix operations are zero indexed,
-        # while user interface operations aren't
-        if function[command]['map_dimension']:
-            args = [arg - 1 for arg in args]
+    return Operation(command, image, spec.bind(image), tuple(converted))
 
-        # Get TextImage method to be executed with its due arguments
-        method = getattr(image,
-                         function[command]['name'])
 
-        # Reattach value to the argument list
-        if value:
-            args.append(value)
+def run_operation(operation, report=print_error):
+    """ Runs a compiled operation, reporting the errors of its execution
+
+    Args:
+        operation (Operation): The operation to be run
+        report (function): Called with the error key of an invalid command.
+            By default, the error message is printed to the user
+    """
+
+    #
+    # Most of the commands are executed on filled images
+    # If the image wasn't initialized, the other commands
+    # will not work properly. So we block their calls if the
+    # image wasn't initialized
+    if operation.needs_image and not operation.image.is_image_set():
+        report('empty')
+        return
+
+    try:
+        operation()
 
-        # Unpack the parsed arguments to the due command function
-        method(*args)
+    # Raised by the commands that can't be run on the current image
+    except CommandError as error:
+        report(error.error_type)
 
     # Handle expected exceptions raised from the TextImage class
     except ValueError:
-        # Raised when parsing string into integers
-        print_error('value')
-        return
+        # Raised when the value can't be stored in the image
+        report('value')
 
     except IndexError:
         # Raised while checing argument bounds in the image matrix
-        print_error('bounds')
-        return
+        report('bounds')
 
     except AttributeError:
         # Raised when the attribute matrix is not properly set into the image
-        print_error('empty')
-        return
+        report('empty')
+
     except OSError:
         # Raised when failed to save file due to system issues
-        print_error('file')
+        report('file')
+
+
+def handle_user_input(image, user_input, report=print_error):
+    """ Handle the user input from the prompt
+
+    The user can effectively make operations by calling the correct command
+    syntax described on the help guide. However, any user is prone to errors
+    while manipulating information from a program interface. This function
+    parses the user commands, warn she/he for the correct command syntax,
+    check value inputs and provide feedback on later processing stages.
+
+    The commands are called from here.
+
+    Args:
+        image (TextImage) : Object representing the image matrix and its
+            functions
+        user_input (str): String containing the user input from the command line
+        report (function): Called with the error key of an invalid command.
+            By default, the error message is printed to the user
+
+    """
+
+    # Splits the string. The arguments must be separated by spaces
+    # Commands argument counting and parsing are done ahead
+    command = user_input.split()
+
+    # User provided an empty string as input and pressed enter
+    if not command:
+        report('command')
+        return
+
+    # Gets the fist splited string, expected to be a valid command
+    # and get its related arguments
+    handle_function_calls(image, command[0], command[1:], report)
+
+
+def handle_function_calls(image, command, args, report=print_error):
+    """ Handle the argument passing and objet call for command functions
+
+    The command is compiled into an operation and then run. Any invalid
+    input or failed execution is reported. Both phases are timed in STATS.
+
+    Args:
+        image (TextImage) : Object representing the image matrix and its
+            functions
+        command (str) : The command the user has input
+        args (list(str)): a list of user input strings that should be the
+            methods arguments
+        report (function): Called with the error key of an invalid command.
+            By default, the error message is printed to the user
+    """
+    operation = compile_input(image, command, args, report)
+    if operation is None:
         return
 
+    start = perf_counter_ns()
+    run_operation(operation, report)
+    STATS.record(command, 'run', perf_counter_ns() - start)
+
+
+def compile_input(image, command, args, report=print_error):
+    """ Compiles a command input, timing it in STATS
+
+    Args:
+        image (TextImage) : Object representing the image matrix and its
+            functions
+        command (str) : The command the user has input
+        args (list(str)): a list of user input strings that should be the
+            methods arguments
+        report (function): Called with the error key of an invalid command.
+            By default, the error message is printed to the user
+
+    Returns:
+        Operation: the compiled operation, or None if the input is invalid
+    """
+    start = perf_counter_ns()
+    try:
+        operation = compile_command(image, command, args)
+    except CommandError as error:
+        STATS.record(command if command in COMMANDS else '?', 'parse',
+                     perf_counter_ns() - start)
+        report(error.error_type)
+        return None
+
+    STATS.record(command, 'parse', perf_counter_ns() - start)
+    return operation
+
 
-def event_loop():
+def event_loop(image=None):
     """ User interaction loop
 
     It keeps inside a loop until the user exits the program with a valid 'X'
     command.
 
+    Args:
+        image (TextImage) : Object representing the image matrix to work on.
+            By default, a new empty image
+
     """
     print_guide(initial=True)
-    image = TextImage()
+    if image is None:
+        image = new_image()
     while True:
         user_input = input("(press 'G' for guidance)> ")
         handle_user_input(image, user_input)
 
 
+def run_script(image, script, stop_on_error=False, optimized=False):
+    """ Runs a script of commands without user interaction
+
+    The script is read line by line from a buffered stream, with no prompt
+    and no guide. Blank lines and 'G' commands are skipped and an 'X' command
+    ends the script. Instead of the error banners, each invalid command is
+    reported to the standard error with its line number.
+
+    If optimized, the whole script is compiled first and rewritten by the
+    script optimizer, which drops the writes that are never seen and merges
+    the single cell ones, before it is run.
+
+    Args:
+        image (TextImage) : Object representing the image matrix and its
+            functions
+        script (file): Text stream with one command per line
+        stop_on_error (bool): Flag to stop the script on the first invalid
+            command
+        optimized (bool): Flag to optimize the script before running it
+
+    Returns:
+        int: number of invalid commands in the script
+    """
+    if optimized:
+        return run_optimized(image, script, stop_on_error)
+
+    failures = 0
+    errors = []
+
+    for number, line in enumerate(script_lines(script), 1):
+        if line is None:
+            continue
+        handle_user_input(image, line, errors.append)
+        if not errors:
+            continue
+
+        failures += report_errors(number, errors)
+        if stop_on_error:
+            break
+
+    return failures
+
+
+def run_optimized(image, script, stop_on_error=False):
+    """ Compiles a whole script, optimizes it and runs it
+
+    Args:
+        image (TextImage) : Object representing the image matrix and its
+            functions
+        script (file): Text stream with one command per line
+        stop_on_error (bool): Flag to stop the script on the first invalid
+            command
+
+    Returns:
+        int: number of invalid commands in the script
+    """
+    entries = []
+    invalid = {}
+    for number, line in enumerate(script_lines(script), 1):
+        if line is None:
+            continue
+        command = line.split()
+        errors = []
+        operation = compile_input(image, command[0], command[1:],
+                                  errors.append)
+        entries.append((number, operation))
+        if errors:
+            invalid[number] = errors
+            if stop_on_error:
+                break
+
+    size = (image.cols, image.rows) if image.is_image_set() else None
+    failures = 0
+    errors = []
+
+    for number, operation in optimize(entries, size):
+        if operation is None:
+            errors.extend(invalid[number])
+        else:
+            start = perf_counter_ns()
+            run_operation(operation, errors.append)
+            STATS.record(operation.command, 'run', perf_counter_ns() - start)
+        if not errors:
+            continue
+
+        failures += report_errors(number, errors)
+        if stop_on_error:
+            break
+
+    return failures
+
+
+def script_lines(script):
+    """ Yields the lines of a script to be run, up to an 'X' command
+
+    Blank lines and 'G' commands are yielded as None, so the lines keep
+    their numbers.
+
+    Args:
+        script (file): Text stream with one command per line
+    """
+    for line in script:
+        command = line.split()
+        if command and command[0] == 'X':
+            return
+
+        yield line if command and command[0] != 'G' else None
+
+
+def report_errors(number, errors):
+    """ Reports the errors of a script line to the standard error
+
+    Args:
+        number (int): the line number
+        errors (list(str)): the error keys, emptied once reported
+
+    Returns:
+        int: number of errors
+    """
+    for error_type in errors:
+        title = ERRORS.get(error_type, ERRORS['other']).split('\n')[0]
+        sys.stderr.write("line %d: %s\n" % (number, title.strip(' >')))
+
+    count = len(errors)
+    del errors[:]
+    return count
+
+
+def main(argv=None):
+    """ Program entry point
+
+    Without arguments the program runs the interactive event loop. Given a
+    script file, or '-' for the standard input, it runs in batch mode. Both
+    modes work on a memory mapped file if one is given.
+
+    Args:
+        argv (list(str)): command line arguments, sys.argv by default
+
+    Returns:
+        int: exit status, non zero if a script command was invalid
+    """
+    parser = argparse.ArgumentParser(description="Text images processing")
+    parser.add_argument('script', nargs='?',
+                        type=argparse.FileType('r', bufsize=BUFFER_SIZE),
+                        help="file of commands to run in batch mode, "
+                             "or - for the standard input")
+    parser.add_argument('--stop-on-error', action='store_true',
+                        help="stop the script on the first invalid command")
+    parser.add_argument('--map', metavar='FILENAME',
+                        help="edit the image in place on a memory mapped "
+                             "file, which is opened if it exists")
+    parser.add_argument('--stats', action='store_true',
+                        help="print the timings of the commands to the "
+                             "standard error at exit")
+    parser.add_argument('--undo-limit', metavar='BYTES', type=int,
+                        default=0,
+                        help="turn on the undo history with this memory "
+                             "cap, such as %d (64 MiB)" % DEFAULT_LIMIT)
+    parser.add_argument('--optimize', action='store_true',
+                        help="drop the writes of the script that are never "
+                             "seen and merge the single cell ones")
+    args = parser.parse_args(argv)
+
+    try:
+        image = MappedTextImage(args.map) if args.map else new_image()
+    except (OSError, ValueError):
+        parser.error("can't map '%s' as a text image" % args.map)
+
+    if args.undo_limit > 0:
+        image.journal = Journal(args.undo_limit)
+
+    if args.stats:
+        atexit.register(print_stats, sys.stderr)
+
+    if args.script is None:
+        event_loop(image)
+
+    with args.script:
+        failures = run_script(image, args.script, args.stop_on_error,
+                              args.optimize)
+
+    return 1 if failures else 0
+
+
 if __name__ == '__main__':
-    event_loop()
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# -*- coding: utf8 -*-
+"""Code for the MappedTextImage class, a text image mapped from a file
+
+This module holds the MappedTextImage class, a CompactTextImage whose cells
+are a memory map of a file in the same text layout written by save_matrix:
+each row followed by a newline byte. Every operation writes straight into
+the file pages, so images larger than the memory can be edited in place,
+opening a saved image doesn't read it and saving it is just a flush.
+"""
+import mmap
+import os
+from text_image import BUFFER_SIZE
+from compact_image import CompactTextImage, ZERO, parse_rows
+
+
+class MappedTextImage(CompactTextImage):
+    """ Text image edited in place on a memory mapped file
+
+    The file holds the rows of the image, each one followed by a newline, so
+    the cell (col, row) is the byte at row * (cols + 1) + col. If the file
+    exists and no size is given, the image is opened from it, reading only
+    its first row to find the number of columns. Otherwise, the file is
+    created by initialize_matrix.
+
+    Args:
+        filename (str): name of the file that holds the image
+        cols (int): number of columns to create a empty image
+        rows (int): number of rows to create a empty image
+
+    Attributes:
+        filename (str): name of the file that holds the image
+        image (mmap.mmap): the map of the file, or None if no image is set
+        cols (int): number of columns of the image matrix
+        rows (int): number of rows of the image matrix
+        stride (int): number of bytes of a row and its newline
+
+    Raises:
+        OSError: The file can't be opened or created
+        ValueError: The file is not a saved text image
+    """
+
+    def __init__(self, filename, cols=0, rows=0):
+        self.filename = filename
+        self.image = None
+        self.cols = cols
+        self.rows = rows
+        self.stride = cols + 1
+
+        if cols or rows or not os.path.exists(filename):
+            self.initialize_matrix(cols, rows)
+            return
+
+        self._map()
+        if self.image is None:
+            return
+
+        # Only the first row is read to find the image dimensions
+        self.cols = self.image.find(b'\n')
+        self.stride = self.cols + 1
+        if self.cols < 1 or len(self.image) % self.stride:
+            self.close()
+            raise ValueError
+        self.rows = len(self.image) // self.stride
+
+    def _allocate(self, cols, rows):
+        """ (Re)Create the image file with an empty cols x rows matrix """
+        self.close()
+        self.stride = cols + 1
+
+        # The file is written in blocks of empty rows
+        line = ZERO * cols + b'\n'
+        block = max(1, BUFFER_SIZE // self.stride)
+        with open(self.filename, 'wb', buffering=BUFFER_SIZE) as f:
+            if cols > 0:
+                for start in range(0, rows, block):
+                    f.write(line * min(block, rows - start))
+
+        self._map()
+
+    @classmethod
+    def from_file(cls, filename):
+        """ Maps the image of a file written by save_matrix
+
+        Args:
+            filename (str): filename of the saved image
+
+        Returns:
+            MappedTextImage: the image mapped from the file
+
+        Raises:
+            OSError: The file can't be opened
+            ValueError: The file is not a saved image
+        """
+        return cls(filename)
+
+    def image_2_str(self):
+        """ Format the image matrix to a human readable format
+
+        Returns:
+            str: Human readable format of the image matrix
+        """
+        if not self.is_image_set():
+            return ''
+
+        # The map already is in the human readable format
+        return self.image[:].decode('ascii')
+
+    def save_matrix(self, filename):
+        """ Saves the image matrix to a file
+
+        Saving to the mapped file only flushes the changed pages. Any other
+        file is written as a copy of the mapped file.
+
+        Args:
+            filename (str): filename to be used in the saving
+
+        Raises:
+            OSError: The operation was not possible due some system related,
+            error such as permissions, full disk, invalid filename and so on
+        """
+        if self.is_image_set() and os.path.exists(filename) and \
+                os.path.samefile(filename, self.filename):
+            self.image.flush()
+            return
+
+        super(MappedTextImage, self).save_matrix(filename)
+
+    def write_matrix(self, f):
+        """ Writes the image matrix to a binary file, a block at a time
+
+        Args:
+            f (file): binary file opened for writing
+
+        Returns:
+            bool: Flags if every row was written with one byte per cell
+        """
+        if not self.is_image_set():
+            return False
+
+        view = memoryview(self.image)
+        for start in range(0, len(view), BUFFER_SIZE):
+            f.write(view[start:start+BUFFER_SIZE])
+        view.release()
+
+        return True
+
+    def close(self):
+        """ Flushes the changes and unmaps the image file """
+        if self.image is not None:
+            self.image.flush()
+            self.image.close()
+            self.image = None
+
+    def memory_size(self):
+        """ Estimates the memory held by the cells of the image
+
+        The cells are pages of the mapped file, which the system writes back
+        and reclaims on its own, so they are not counted.
+
+        Returns:
+            int: always 0
+        """
+        return 0
+
+    def _map(self):
+        """ Maps the image file for reading and writing """
+        with open(self.filename, 'r+b') as f:
+            if os.fstat(f.fileno()).st_size:
+                self.image = mmap.mmap(f.fileno(), 0)
+
+    #
+    # Storage kernels
+    #
+
+    def _parse(self, data):
+        """ Check the content of a saved image file, which is copied as is
+        to the image file """
+        data, cols, rows = parse_rows(data)
+        return cols, rows, data
+
+    def _assign(self, image):
+        """ Write the image file with the content returned by _parse """
+        self.close()
+        self.stride = self.cols + 1
+        with open(self.filename, 'wb', buffering=BUFFER_SIZE) as f:
+            f.write(image)
+
+        self._map()
+
+    def _clear(self):
+        """ Set every cell of the image to 'O', keeping the newlines
+
+        The file must always hold the cells, so the map is never cleared
+        lazily.
+        """
+        stride = self.stride
+        line = ZERO * self.cols + b'\n'
+        block = max(1, BUFFER_SIZE // stride)
+        for start in range(0, self.rows, block):
+            count = min(block, self.rows - start)
+            self.image[start*stride:(start+count)*stride] = line * count
@@ -0,0 +1,211 @@
+# -*- coding: utf8 -*-
+"""Code for the NumpyTextImage class, a NumPy backed text image
+
+This module holds the NumpyTextImage class, a TextImage that keeps its
+matrix as a 2d NumPy array of bytes. Every line and rectangle operation is a
+single slice assignment, executed by NumPy instead of Python loops.
+
+NumPy is an optional dependency. If it is not installed, the module can still
+be imported, but instantiating the class raises ImportError.
+"""
+from text_image import TextImage
+from compact_image import (ZERO, pack_columns, pack_segment, parse_rows,
+                           to_byte, zero_runs)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NEWLINE = ord('\n')
+
+
+class NumpyTextImage(TextImage):
+    """ Text image stored in a 2d NumPy array
+
+    This class has the same interface of the TextImage class, but the image
+    attribute is a uint8 NumPy array with shape (rows, cols), one byte per
+    cell. Keep in mind that the array is indexed as [row, col], while the
+    methods keep the (col, row) order of the TextImage class.
+
+    Since each cell is one byte, the values must be single ASCII characters.
+    Any other value raises ValueError.
+
+    Clearing the image, or initializing it again with the same size, only
+    marks its rows as stale, so it takes constant time. A stale row reads as
+    'O' and is zeroed when it's first used again.
+
+    Args:
+        image (list(list)): a 2d list (columns of rows) to instantiate
+        cols (int): number of columns to instantiate a empty image
+        rows (int): number of rows to instantiate a empty image
+
+    Attributes:
+        image (numpy.ndarray): the cells of the image, indexed as [row, col]
+        cols (int): number of columns of the image matrix
+        rows (int): number of rows of the image matrix
+
+    Raises:
+        ImportError: NumPy is not installed
+    """
+
+    def __init__(self, image=[], cols=0, rows=0):
+
+        if numpy is None:
+            raise ImportError("NumpyTextImage requires numpy")
+
+        #
+        # If a image was passed, pack it row by row
+        if image:
+            self.cols = len(image)
+            self.rows = len(image[0])
+            data = numpy.frombuffer(pack_columns(image), dtype=numpy.uint8)
+            self.image = data.reshape(self.rows, self.cols).copy()
+            return
+
+        self.cols = cols
+        self.rows = rows
+        self.initialize_matrix(cols, rows)
+
+    def is_image_set(self):
+        """Check if the class attribute image is setted with values
+
+        Returns:
+            bool: flag of emtpy image attribute
+        """
+        return self.image is not None and self.image.size > 0
+
+    def memory_size(self):
+        """ Estimates the memory held by the cells of the image
+
+        Returns:
+            int: approximate size of the image attribute, in bytes
+        """
+        return int(self.image.nbytes)
+
+    def image_2_str(self):
+        """ Format the image matrix to a human readable format
+
+        Returns:
+            str: Human readable format of the image matrix
+        """
+        if not self.is_image_set():
+            return ''
+
+        # The rows and their newlines are laid in a single buffer
+        self._refresh(0, self.rows - 1)
+        output = numpy.empty((self.rows, self.cols + 1), dtype=numpy.uint8)
+        output[:, :self.cols] = self.image
+        output[:, self.cols] = NEWLINE
+
+        return output.tobytes().decode('ascii')
+
+    #
+    # Storage kernels
+    #
+
+    def _allocate(self, cols, rows):
+        """ Set the image attribute with an empty cols x rows matrix """
+
+        # The array of an image of the same size is cleared lazily
+        image = getattr(self, 'image', None)
+        if image is not None and image.shape == (rows, cols):
+            self._expire()
+            return
+
+        self.image = numpy.full((rows, cols), ZERO[0], dtype=numpy.uint8)
+
+    def _parse(self, data):
+        """ Convert the content of a saved image file to an image attribute,
+        without touching the image """
+        data, cols, rows = parse_rows(data)
+        lines = numpy.frombuffer(data, dtype=numpy.uint8)
+
+        # The newline column is dropped from the rows
+        return cols, rows, lines.reshape(rows, cols + 1)[:, :cols].copy()
+
+    def _check_value(self, value):
+        """ Checks if a value can be stored in a cell, raising ValueError
+        if not """
+        to_byte(value)
+
+    def _convert_segment(self, segment):
+        """ Converts a segment read by the _read_segment of any storage to
+        bytes, raising ValueError if some value can't be stored """
+        return pack_segment(segment)
+
+    def _clear(self):
+        """ Set every cell of the image to 'O' """
+        self._expire()
+
+    def _zero_row(self, row):
+        """ Set every cell of a row to 'O' """
+        self.image[row] = ZERO[0]
+
+    def _get_cell(self, col, row):
+        """ Get the value of the cell at (col, row) """
+        self._refresh(row, row)
+        return chr(self.image[row, col])
+
+    def _set_cell(self, col, row, value):
+        """ Set the value of the cell at (col, row) """
+        self._refresh(row, row)
+        self.image[row, col] = to_byte(value)[0]
+
+    def _set_vertical(self, col, row_up, row_down, value):
+        """ Set the cells (col, row_up-row_down) with value """
+        self._refresh(row_up, row_down)
+        self.image[row_up:row_down+1, col] = to_byte(value)[0]
+
+    def _set_horizontal(self, col_left, col_right, row, value):
+        """ Set the cells (col_left-col_right, row) with value """
+        self._refresh(row, row)
+        self.image[row, col_left:col_right+1] = to_byte(value)[0]
+
+    def _set_rect(self, col_top, row_top, col_bottom, row_bottom, value):
+        """ Set the rectangle from (col_top, row_top) to
+        (col_bottom, row_bottom) with value """
+        self._refresh(row_top, row_bottom)
+        self.image[row_top:row_bottom+1, col_top:col_bottom+1] = (
+            to_byte(value)[0])
+
+    def _read_segment(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) as bytes """
+        self._refresh(row, row)
+        return self.image[row, col_left:col_right+1].tobytes()
+
+    def _write_segment(self, row, col_left, segment):
+        """ Set the cells from (col_left, row) on with a segment of bytes """
+        self._refresh(row, row)
+        self.image[row, col_left:col_left+len(segment)] = (
+            numpy.frombuffer(segment, dtype=numpy.uint8))
+
+    def _zero_runs(self, row, left, right):
+        """ Find the runs of 'O' cells of a row that touch an interval
+
+        Args:
+            row (int): Vertical position of the runs
+            left (int): Initial horizontal position of the interval
+            right (int): Final horizontal position of the interval
+        Returns:
+            list(tuple): first and last horizontal positions of each run
+        """
+        self._refresh(row, row)
+        return zero_runs(memoryview(self.image[row]), 0, self.cols,
+                         left, right)
+
+    def _segment_str(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) joined as
+        a string """
+        self._refresh(row, row)
+        return self.image[row, col_left:col_right+1].tobytes().decode('ascii')
+
+    def _row_str(self, row):
+        """ Get the values of a row joined as a string, without newline """
+        self._refresh(row, row)
+        return self.image[row].tobytes().decode('ascii')
+
+    def _row_bytes(self, row):
+        """ Get the values of a row encoded as bytes, without newline """
+        self._refresh(row, row)
+        return memoryview(self.image[row])
@@ -0,0 +1,223 @@
+# -*- coding: utf8 -*-
+"""Code for the RegionIndex class, an index of the zero valued regions
+
+This module holds the RegionIndex class, an index of the connected regions
+of 'O' cells of a text image, the regions filled by fill_region. The regions
+are labeled once, a run at a time, and kept as lists of horizontal spans, so
+a fill recolors a known region without searching it and the size of a region
+is a lookup. The writes to the image only drop the regions they may have
+split or merged, which are found again when needed.
+"""
+from bisect import bisect_right
+
+
+class Component(object):
+    """ A connected region of 'O' cells
+
+    Attributes:
+        spans (list(tuple)): the (row, left, right) maximal runs of 'O'
+            cells of the region
+        size (int): number of cells of the region
+    """
+
+    __slots__ = ('spans', 'size')
+
+    def __init__(self, spans):
+        self.spans = spans
+        self.size = sum(right - left + 1 for _, left, right in spans)
+
+
+def find_component(image, col, row):
+    """ Finds the region of 'O' cells holding a cell, run by run
+
+    Args:
+        image (TextImage): the image to search
+        col (int): Horizontal position of a 'O' cell of the region
+        row (int): Vertical position of a 'O' cell of the region
+
+    Returns:
+        Component: the region holding the cell
+    """
+    spans = []
+    seen = set()
+    stack = [(row, left, right)
+             for left, right in image._zero_runs(row, col, col)]
+
+    # The runs are maximal, so a run is identified by its first cell
+    while stack:
+        row, left, right = stack.pop()
+        if (row, left) in seen:
+            continue
+        seen.add((row, left))
+        spans.append((row, left, right))
+
+        for next_row in (row - 1, row + 1):
+            if 0 <= next_row < image.rows:
+                for run in image._zero_runs(next_row, left, right):
+                    if (next_row, run[0]) not in seen:
+                        stack.append((next_row,) + run)
+
+    return Component(spans)
+
+
+class RegionIndex(object):
+    """ Index of the regions of 'O' cells of a text image
+
+    The index is built the first time it is queried, labeling every run of
+    'O' cells of the image in a single pass. For each row, it keeps the first
+    columns of the indexed runs and the runs themselves, sorted, so the
+    region holding a cell is a binary search away.
+
+    The image tells the index about every rectangle it is about to write.
+    The regions crossing the rectangle may be split, so they are dropped,
+    and so are the regions around it when 'O' cells may be written, since
+    they may be merged. A cell whose region was dropped has it found again
+    on the next query.
+    """
+
+    def __init__(self):
+        self._image = None
+        self._rows = None
+
+    def component(self, image, col, row):
+        """ Gets the region of 'O' cells holding a cell
+
+        Args:
+            image (TextImage): the image the index belongs to
+            col (int): Horizontal position of the cell
+            row (int): Vertical position of the cell
+
+        Returns:
+            Component: the region holding the cell, or None if the cell is
+                not 'O'
+        """
+        if self._rows is None or self._image is not image.image:
+            self._label(image)
+
+        lefts, spans = self._rows[row]
+        index = bisect_right(lefts, col) - 1
+        if index >= 0 and spans[index][1] >= col:
+            return spans[index][2]
+
+        if image._get_cell(col, row) != 'O':
+            return None
+
+        component = find_component(image, col, row)
+        self._add(component)
+        return component
+
+    def invalidate(self, image, col_top, row_top, col_bottom, row_bottom,
+                   zero=True):
+        """ Drops the regions a write to a rectangle of cells may change
+
+        Args:
+            image (TextImage): the image the index belongs to
+            col_top (int): Top horizontal position of the rectangle
+            row_top (int): Top verticaal position of the rectangle
+            col_bottom (int): Bottom horizontal position of the rectangle
+            row_bottom (int): Bottom vertical position of the rectangle
+            zero (bool): flags if 'O' cells may be written, merging the
+                regions around the rectangle
+        """
+        if self._rows is None:
+            return
+
+        if col_top == 0 and row_top == 0 and \
+                col_bottom == image.cols - 1 and row_bottom == image.rows - 1:
+            self.clear()
+            return
+
+        if zero:
+            col_top -= 1
+            col_bottom += 1
+            row_top = max(0, row_top - 1)
+            row_bottom = min(len(self._rows) - 1, row_bottom + 1)
+
+        dropped = set()
+        for row in range(row_top, row_bottom+1):
+            lefts, spans = self._rows[row]
+            index = max(0, bisect_right(lefts, col_top) - 1)
+            while index < len(spans) and spans[index][0] <= col_bottom:
+                left, right, component = spans[index]
+                if right >= col_top:
+                    dropped.add(component)
+                index += 1
+
+        for component in dropped:
+            self.discard(component)
+
+    def discard(self, component):
+        """ Drops a region from the index
+
+        Args:
+            component (Component): the region to drop
+        """
+        for row, left, _ in component.spans:
+            lefts, spans = self._rows[row]
+            index = bisect_right(lefts, left) - 1
+            if index >= 0 and spans[index][2] is component:
+                del lefts[index]
+                del spans[index]
+
+    def clear(self):
+        """ Drops every region, so the image is labeled again """
+        self._image = None
+        self._rows = None
+
+    def _add(self, component):
+        """ Indexes the runs of a region """
+        for row, left, right in component.spans:
+            lefts, spans = self._rows[row]
+            index = bisect_right(lefts, left)
+            lefts.insert(index, left)
+            spans.insert(index, (left, right, component))
+
+    def _label(self, image):
+        """ Labels every region of the image, joining the overlapping runs
+        of consecutive rows with a union-find of run indexes """
+        parent = []
+        runs = []
+
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        previous = []
+        for row in range(image.rows):
+            current = []
+            for left, right in image._zero_runs(row, 0, image.cols - 1):
+                node = len(runs)
+                runs.append((row, left, right))
+                parent.append(node)
+                current.append(node)
+
+            # Both rows are sorted, so the overlaps are found by a merge
+            above = 0
+            for node in current:
+                _, left, right = runs[node]
+                while above < len(previous) and \
+                        runs[previous[above]][2] < left:
+                    above += 1
+                scan = above
+                while scan < len(previous) and \
+                        runs[previous[scan]][1] <= right:
+                    root, other = find(node), find(previous[scan])
+                    if root != other:
+                        parent[root] = other
+                    scan += 1
+            previous = current
+
+        groups = {}
+        for node, run in enumerate(runs):
+            groups.setdefault(find(node), []).append(run)
+        components = dict((root, Component(spans))
+                          for root, spans in groups.items())
+
+        # The runs are in reading order, so each row is kept sorted
+        self._image = image.image
+        self._rows = [([], []) for _ in range(image.rows)]
+        for node, (row, left, right) in enumerate(runs):
+            self._rows[row][0].append(left)
+            self._rows[row][1].append((left, right, components[find(node)]))
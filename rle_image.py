@@ -0,0 +1,254 @@
+# -*- coding: utf8 -*-
+"""Code for the RunLengthTextImage class, a run-length encoded text image
+
+This module holds the RunLengthTextImage class, a TextImage that keeps each
+row as a sorted list of runs of equal values. Lines, rectangles and fills
+split and merge runs instead of touching every cell, so their cost follows
+the number of runs instead of the number of cells.
+"""
+import re
+import sys
+from bisect import bisect_right
+from itertools import groupby
+from text_image import TextImage
+from compact_image import ZERO, pack_segment, parse_rows, to_byte
+
+RUN = re.compile(b'(.)\\1*', re.DOTALL)
+
+
+class RunLengthTextImage(TextImage):
+    """ Text image stored as run-length encoded rows
+
+    Each row of the image attribute is a pair of lists (starts, values):
+    the run i begins at the column starts[i] with the byte values[i] and
+    ends right before the next run, or at the last column. The first run
+    always starts at column zero and two adjacent runs never have the same
+    value, so each run is as long as possible.
+
+    Since each run value is one byte, the values must be single ASCII
+    characters. Any other value raises ValueError.
+
+    Args:
+        image (list(list)): a 2d list (columns of rows) to instantiate
+        cols (int): number of columns to instantiate a empty image
+        rows (int): number of rows to instantiate a empty image
+
+    Attributes:
+        image (list(tuple)): the (starts, values) runs of each row
+        cols (int): number of columns of the image matrix
+        rows (int): number of rows of the image matrix
+    """
+
+    def __init__(self, image=[], cols=0, rows=0):
+
+        #
+        # If a image was passed, encode the runs of each of its rows
+        if image:
+            self.cols = len(image)
+            self.rows = len(image[0])
+            self.image = []
+            for row in range(self.rows):
+                starts = []
+                values = []
+                col = 0
+                for value, run in groupby(column[row] for column in image):
+                    starts.append(col)
+                    values.append(to_byte(value))
+                    col += len(list(run))
+                self.image.append((starts, values))
+            return
+
+        self.initialize_matrix(cols, rows)
+
+    def is_image_set(self):
+        """Check if the class attribute image is setted with values
+
+        Returns:
+            bool: flag of emtpy image attribute
+        """
+        return bool(self.image) and self.cols > 0
+
+    def memory_size(self):
+        """ Estimates the memory held by the cells of the image
+
+        Returns:
+            int: approximate size of the runs of every row, in bytes
+        """
+        size = sys.getsizeof(self.image)
+        for row in self.image:
+            starts, values = row
+            size += (sys.getsizeof(row) + sys.getsizeof(starts) +
+                     sys.getsizeof(values))
+
+        return size
+
+    def _paint(self, row, left, right, value):
+        """ Set the cells (left-right, row) with a byte, as a single run
+
+        The runs overlapped by the new run are replaced, the ones cut by it
+        are split and the new run is merged with its neighbors of same value.
+
+        Args:
+            row (int): Vertical position of the run
+            left (int): Initial horizontal position of the run
+            right (int): Final horizontal position of the run
+            value (bytes): byte of the run
+        """
+        starts, values = self.image[row]
+        first = bisect_right(starts, left) - 1
+        last = bisect_right(starts, right) - 1
+        stop = right + 1
+
+        new_starts = [left]
+        new_values = [value]
+        index = first
+
+        # The run cut by the left end keeps its beginning
+        if starts[first] < left:
+            new_starts.insert(0, starts[first])
+            new_values.insert(0, values[first])
+            index += 1
+
+        # The run cut by the right end keeps its ending
+        if stop < self.cols and (last + 1 == len(starts) or
+                                 starts[last+1] != stop):
+            new_starts.append(stop)
+            new_values.append(values[last])
+
+        starts[first:last+1] = new_starts
+        values[first:last+1] = new_values
+
+        # Merge the new run with its neighbors of same value
+        if index + 1 < len(starts) and values[index+1] == value:
+            del starts[index+1]
+            del values[index+1]
+
+        if index > 0 and values[index-1] == value:
+            del starts[index]
+            del values[index]
+
+    #
+    # Storage kernels
+    #
+
+    def _allocate(self, cols, rows):
+        """ Set the image attribute with an empty cols x rows matrix """
+        self.image = [([0], [ZERO]) for _ in range(rows)]
+
+    def _parse(self, data):
+        """ Convert the content of a saved image file to an image attribute,
+        without touching the image """
+        data, cols, rows = parse_rows(data)
+        image = []
+
+        for start in range(0, rows * (cols + 1), cols + 1):
+            starts = []
+            values = []
+            for match in RUN.finditer(data, start, start + cols):
+                starts.append(match.start() - start)
+                values.append(match.group(1))
+            image.append((starts, values))
+
+        return cols, rows, image
+
+    def _check_value(self, value):
+        """ Checks if a value can be stored in a cell, raising ValueError
+        if not """
+        to_byte(value)
+
+    def _convert_segment(self, segment):
+        """ Converts a segment read by the _read_segment of any storage to
+        bytes, raising ValueError if some value can't be stored """
+        return pack_segment(segment)
+
+    def _clear(self):
+        """ Set every cell of the image to 'O' """
+        for starts, values in self.image:
+            starts[:] = [0]
+            values[:] = [ZERO]
+
+    def _get_cell(self, col, row):
+        """ Get the value of the cell at (col, row) """
+        starts, values = self.image[row]
+        return values[bisect_right(starts, col) - 1].decode('ascii')
+
+    def _set_cell(self, col, row, value):
+        """ Set the value of the cell at (col, row) """
+        self._paint(row, col, col, to_byte(value))
+
+    def _set_vertical(self, col, row_up, row_down, value):
+        """ Set the cells (col, row_up-row_down) with value """
+        byte = to_byte(value)
+        for row in range(row_up, row_down+1):
+            self._paint(row, col, col, byte)
+
+    def _set_horizontal(self, col_left, col_right, row, value):
+        """ Set the cells (col_left-col_right, row) with value """
+        self._paint(row, col_left, col_right, to_byte(value))
+
+    def _set_rect(self, col_top, row_top, col_bottom, row_bottom, value):
+        """ Set the rectangle from (col_top, row_top) to
+        (col_bottom, row_bottom) with value """
+        byte = to_byte(value)
+        for row in range(row_top, row_bottom+1):
+            self._paint(row, col_top, col_bottom, byte)
+
+    def _read_segment(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) as bytes
+
+        Only the runs of the segment are read, so its cost follows the
+        number of those runs, not the row length.
+        """
+        starts, values = self.image[row]
+        first = bisect_right(starts, col_left) - 1
+        last = bisect_right(starts, col_right)
+        bounds = [col_left] + starts[first+1:last] + [col_right + 1]
+        return b''.join([value * (end - start) for start, end, value in
+                         zip(bounds, bounds[1:], values[first:last])])
+
+    def _write_segment(self, row, col_left, segment):
+        """ Set the cells from (col_left, row) on with a segment of bytes """
+        col = col_left
+        for value, run in groupby(segment):
+            length = len(list(run))
+            self._paint(row, col, col + length - 1, bytes((value,)))
+            col += length
+
+    def _zero_runs(self, row, left, right):
+        """ Find the runs of 'O' cells of a row that touch an interval
+
+        Args:
+            row (int): Vertical position of the runs
+            left (int): Initial horizontal position of the interval
+            right (int): Final horizontal position of the interval
+        Returns:
+            list(tuple): first and last horizontal positions of each run
+        """
+        starts, values = self.image[row]
+        runs = []
+
+        index = bisect_right(starts, left) - 1
+        while index < len(starts) and starts[index] <= right:
+            if values[index] == ZERO:
+                end = starts[index+1] - 1 if index + 1 < len(starts) \
+                    else self.cols - 1
+                runs.append((starts[index], end))
+            index += 1
+
+        return runs
+
+    def _segment_str(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) joined as
+        a string """
+        return self._read_segment(row, col_left, col_right).decode('ascii')
+
+    def _row_str(self, row):
+        """ Get the values of a row joined as a string, without newline """
+        return self._row_bytes(row).decode('ascii')
+
+    def _row_bytes(self, row):
+        """ Get the values of a row encoded as bytes, without newline """
+        starts, values = self.image[row]
+        ends = starts[1:] + [self.cols]
+        return b''.join([value * (end - start)
+                         for start, end, value in zip(starts, ends, values)])
@@ -0,0 +1,165 @@
+# -*- coding: utf8 -*-
+"""Code for the RowMajorTextImage class, a text image stored row by row
+
+This module holds the RowMajorTextImage class, a TextImage that keeps its
+matrix as a list of rows instead of a list of columns. The output is written
+row by row, so rendering a row is a single join of its list, and horizontal
+lines and rectangles are slice assignments of whole row segments. The public
+methods keep the (col, row) order of the TextImage class.
+"""
+from text_image import TextImage, split_lines
+
+
+class RowMajorTextImage(TextImage):
+    """ Text image stored as a list of rows
+
+    This class has the same interface and accepts the same values of the
+    TextImage class, but the image attribute is a 2d list of rows of
+    columns, so the cell (col, row) is image[row][col].
+
+    Clearing the image, or initializing it again with the same size, only
+    marks its rows as stale, so it takes constant time. A stale row reads as
+    'O' and is replaced by an empty row when it's first used again.
+
+    Args:
+        image (list(list)): a 2d list (columns of rows) to instantiate
+        cols (int): number of columns to instantiate a empty image
+        rows (int): number of rows to instantiate a empty image
+
+    Attributes:
+        image (list(list)): the cells of the image, indexed as [row][col]
+        cols (int): number of columns of the image matrix
+        rows (int): number of rows of the image matrix
+    """
+
+    def __init__(self, image=[], cols=0, rows=0):
+
+        #
+        # If a image was passed, transpose its columns into rows
+        if image:
+            self.cols = len(image)
+            self.rows = len(image[0])
+            self.image = [list(row) for row in zip(*image)]
+            return
+
+        self.initialize_matrix(cols, rows)
+
+    def is_image_set(self):
+        """Check if the class attribute image is setted with values
+
+        Returns:
+            bool: flag of emtpy image attribute
+        """
+        return bool(self.image) and self.cols > 0
+
+    #
+    # Storage kernels
+    #
+
+    def _allocate(self, cols, rows):
+        """ Set the image attribute with an empty cols x rows matrix """
+
+        # The rows of an image of the same size are cleared lazily
+        image = getattr(self, 'image', None)
+        if image and len(image) == rows and len(image[0]) == cols:
+            self._expire()
+            return
+
+        self.image = [['O'] * cols for _ in range(rows)]
+
+    def _parse(self, data):
+        """ Convert the content of a saved image file to an image attribute,
+        without touching the image """
+        cols, lines = split_lines(data)
+        return cols, len(lines), [list(line) for line in lines]
+
+    def _clear(self):
+        """ Set every cell of the image to 'O' """
+        self._expire()
+
+    def _zero_row(self, row):
+        """ Set every cell of a row to 'O' """
+        self.image[row] = ['O'] * self.cols
+
+    def _get_cell(self, col, row):
+        """ Get the value of the cell at (col, row) """
+        self._refresh(row, row)
+        return self.image[row][col]
+
+    def _set_cell(self, col, row, value):
+        """ Set the value of the cell at (col, row) """
+        self._refresh(row, row)
+        self.image[row][col] = value
+
+    def _set_vertical(self, col, row_up, row_down, value):
+        """ Set the cells (col, row_up-row_down) with value """
+        self._refresh(row_up, row_down)
+        for row in self.image[row_up:row_down+1]:
+            row[col] = value
+
+    def _set_horizontal(self, col_left, col_right, row, value):
+        """ Set the cells (col_left-col_right, row) with value """
+        self._refresh(row, row)
+        self.image[row][col_left:col_right+1] = (
+            [value] * (col_right - col_left + 1))
+
+    def _set_rect(self, col_top, row_top, col_bottom, row_bottom, value):
+        """ Set the rectangle from (col_top, row_top) to
+        (col_bottom, row_bottom) with value """
+        self._refresh(row_top, row_bottom)
+        line = [value] * (col_bottom - col_top + 1)
+        for row in self.image[row_top:row_bottom+1]:
+            row[col_top:col_bottom+1] = line
+
+    def _read_segment(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) as a list """
+        self._refresh(row, row)
+        return self.image[row][col_left:col_right+1]
+
+    def _write_segment(self, row, col_left, segment):
+        """ Set the cells from (col_left, row) on with a list of values """
+        self._refresh(row, row)
+        self.image[row][col_left:col_left+len(segment)] = segment
+
+    def _zero_runs(self, row, left, right):
+        """ Find the runs of 'O' cells of a row that touch an interval
+
+        Each run is returned whole, even if it goes beyond the interval.
+
+        Args:
+            row (int): Vertical position of the runs
+            left (int): Initial horizontal position of the interval
+            right (int): Final horizontal position of the interval
+        Returns:
+            list(tuple): first and last horizontal positions of each run
+        """
+        self._refresh(row, row)
+        line = self.image[row]
+        runs = []
+
+        col = left
+        while col > 0 and line[col] == 'O' and line[col-1] == 'O':
+            col -= 1
+
+        while col <= right:
+            if line[col] != 'O':
+                col += 1
+                continue
+
+            start = col
+            while col < self.cols and line[col] == 'O':
+                col += 1
+            runs.append((start, col - 1))
+
+        return runs
+
+    def _segment_str(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) joined as
+        a string """
+        self._refresh(row, row)
+        return ''.join(self.image[row][col_left:col_right+1])
+
+    def _row_str(self, row):
+        """ Get the values of a row joined as a string, without newline """
+        self._refresh(row, row)
+        return ''.join(self.image[row])
@@ -0,0 +1,219 @@
+# -*- coding: utf8 -*-
+"""Optimizer of the compiled command scripts
+
+This module rewrites a script of compiled operations into a shorter one that
+leaves the image, and every file saved from it, exactly the same. The script
+is split in segments of drawing operations by the barriers, the operations
+that read the image or whose effect can't be known beforehand: printing,
+saving, loading, filling, copying and moving, undoing and redoing, and any
+invalid operation.
+Within each segment:
+
+    - an initialization drops every write before it;
+    - a write that the later writes overwrite entirely is dropped, as found
+      by the coverage of the batches of operations;
+    - consecutive L writes are merged into H, V and K writes of the same
+      cells and values.
+
+Only writes known to be valid are rewritten, so the optimized script reports
+the same errors as the original one. Since undoing depends on how the writes
+were split in edits, nothing before the last U or R is rewritten.
+"""
+from batch import Coverage, to_rect
+
+#
+# Commands that neither read nor write the image
+NEUTRAL = set('GT')
+
+
+def optimize(entries, size=None):
+    """ Optimizes a script of compiled operations
+
+    Args:
+        entries (list(tuple)): the (tag, operation) pairs of the script,
+            where the tag, such as a line number, is kept along with its
+            operation. None operations, such as invalid inputs, are kept as
+            barriers
+        size (tuple): the (cols, rows) of the image before the script, or
+            None if it's not set
+
+    Returns:
+        list(tuple): the (tag, operation) pairs of the optimized script.
+            A merged operation gets the tag of the first one it replaces
+    """
+    history = max([index for index, (_, operation) in enumerate(entries)
+                   if operation is not None and operation.command in 'UR'],
+                  default=-1)
+
+    optimized = []
+    segment = []
+    for index, (tag, operation) in enumerate(entries):
+        rect = None
+        if index > history:
+            rect = write_rect(operation, size)
+
+        if rect is not None or (operation is not None and
+                                operation.command in NEUTRAL):
+            segment.append((tag, operation, rect))
+            continue
+
+        # An initialization drops the writes before it, nothing else does
+        if operation is not None and index > history and \
+                operation.command == 'I':
+            segment = [entry for entry in segment if entry[2] is None]
+        optimized.extend(eliminate(segment))
+        optimized.append((tag, operation))
+        segment = []
+
+        if operation is None:
+            continue
+        if operation.command == 'I':
+            cols, rows = operation.args
+            size = (cols, rows) if cols > 0 and rows > 0 else None
+        elif operation.command in 'OUR':
+            size = None
+
+    optimized.extend(eliminate(segment))
+    return optimized
+
+
+def write_rect(operation, size):
+    """ Finds the rectangle of cells written by a valid write
+
+    Args:
+        operation (Operation): the operation
+        size (tuple): the (cols, rows) of the image, or None if it's unknown
+
+    Returns:
+        tuple: the (col_top, row_top, col_bottom, row_bottom, value)
+            rectangle, or None if the operation is not a write known to be
+            valid
+    """
+    if operation is None or size is None:
+        return None
+
+    cols, rows = size
+    if operation.command == 'C':
+        return 0, 0, cols - 1, rows - 1, 'O'
+
+    if operation.command not in 'LVHK':
+        return None
+
+    col_top, row_top, col_bottom, row_bottom, value = to_rect(
+        (operation.command,) + operation.args)
+    if not (0 <= col_top <= col_bottom < cols and
+            0 <= row_top <= row_bottom < rows):
+        return None
+
+    try:
+        operation.image._check_value(value)
+    except ValueError:
+        return None
+
+    return col_top, row_top, col_bottom, row_bottom, value
+
+
+def eliminate(segment):
+    """ Drops the overwritten writes of a segment and merges its L writes
+
+    Args:
+        segment (list(tuple)): the (tag, operation, rect) entries of the
+            segment, with a None rect if the operation is not a write
+
+    Returns:
+        list(tuple): the (tag, operation) pairs of the segment
+    """
+    rects = [entry[2] for entry in segment if entry[2] is not None]
+    if not rects:
+        return [(tag, operation) for tag, operation, _ in segment]
+
+    # The segment is swept backwards, so a write is dropped if no cell it
+    # writes is left to be seen
+    coverage = Coverage(min(rect[1] for rect in rects),
+                        max(rect[3] for rect in rects))
+    visible = []
+    for tag, operation, rect in reversed(segment):
+        if rect is None or coverage.paint(*rect[:4]):
+            visible.append((tag, operation))
+    visible.reverse()
+
+    # The L writes left are all on different cells, so consecutive ones can
+    # be written in any order
+    optimized = []
+    run = []
+    for tag, operation in visible + [(None, None)]:
+        if operation is not None and operation.command == 'L':
+            run.append((tag, operation))
+            continue
+
+        if len(run) > 1:
+            optimized.extend(merge_cells(run))
+        else:
+            optimized.extend(run)
+        run = []
+        if operation is not None:
+            optimized.append((tag, operation))
+
+    return optimized
+
+
+def merge_cells(run):
+    """ Merges L writes of different cells into runs of cells
+
+    The cells of each value are split in horizontal runs, and the runs of
+    the same columns on consecutive rows are joined in rectangles.
+
+    Args:
+        run (list(tuple)): the (tag, operation) pairs of the L writes
+
+    Returns:
+        list(tuple): the (tag, operation) pairs of the L, H, V and K writes
+            of the same cells
+    """
+    tag, first = run[0]
+    values = {}
+    for _, operation in run:
+        col, row, value = operation.args
+        values.setdefault(value, []).append((row, col))
+
+    merged = []
+    for value, cells in values.items():
+        cells.sort()
+
+        # Horizontal runs, row by row
+        runs = []
+        for row, col in cells:
+            if runs and runs[-1][0] == row and runs[-1][2] == col - 1:
+                runs[-1][2] = col
+            else:
+                runs.append([row, col, col])
+
+        # Runs of the same columns on consecutive rows are joined, growing
+        # the rectangle of the last one
+        last = {}
+        for row, left, right in runs:
+            rect = last.get((left, right))
+            if rect is not None and rect[3] == row - 1:
+                rect[3] = row
+            else:
+                rect = last[(left, right)] = [left, row, right, row, value]
+                merged.append(rect)
+
+    return [(tag, first.replace(*to_operation(*rect))) for rect in merged]
+
+
+def to_operation(col_top, row_top, col_bottom, row_bottom, value):
+    """ Converts a rectangle of cells to the write of its shape
+
+    Returns:
+        tuple: the command letter and the arguments of the write
+    """
+    if row_top == row_bottom:
+        if col_top == col_bottom:
+            return 'L', (col_top, row_top, value)
+        return 'H', (col_top, col_bottom, row_top, value)
+
+    if col_top == col_bottom:
+        return 'V', (col_top, row_top, row_bottom, value)
+
+    return 'K', (col_top, row_top, col_bottom, row_bottom, value)
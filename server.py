@@ -0,0 +1,395 @@
+# -*- coding: utf8 -*-
+"""Network server of text image sessions
+
+This module serves the text image commands over TCP or a Unix socket with
+asyncio, so a single process serves many users at once. Each connection is a
+session with its own image, which accepts the same commands of the program
+prompt, one per line.
+
+Each command is answered with a status line followed by its output:
+
+    OK <size>\\n<output>
+    ERROR <error type> <size>\\n<error message>
+
+where size is the number of bytes of the UTF-8 output or message that
+follow. An 'X' command closes the session. The files saved and opened by
+the sessions are confined to a data directory, and the images to a maximum
+number of cells. Every command that reads or changes an image runs in a
+thread pool, so it never blocks the other sessions. The images of the
+sessions are kept in an ImageStore, so the idle ones are spilled to disk
+when the resident images exceed the memory budget.
+
+Usage:
+    python server.py --port 8765
+    python server.py --unix /tmp/text_image.sock
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter_ns
+import main
+from journal import Journal, DEFAULT_LIMIT
+from image_store import ImageStore, DEFAULT_BUDGET
+
+#
+# Commands that run on the event loop, since they don't touch the image. The
+# others run in the thread pool
+INLINE = set('GT')
+
+#
+# Default maximum number of cells of the image of a session
+DEFAULT_MAX_CELLS = 1 << 25
+
+#
+# Commands whose argument is a filename, resolved in the data directory
+FILE_COMMANDS = set('SBO')
+
+
+class ImageServer(object):
+    """ Asyncio server of text image sessions
+
+    Args:
+        workers (int): number of threads that run the commands, by
+            default as many as the executor picks
+        undo_limit (int): memory cap of the undo history of each session,
+            0 disables undo
+        budget (int): memory cap of the resident images of the sessions
+        directory (str): directory of the spilled images, a temporary one
+            by default
+        data_dir (str): directory of the files saved and opened by the
+            sessions, the current one by default
+        max_cells (int): maximum number of cells of the image of a session
+
+    Attributes:
+        sessions (int): number of open sessions
+        store (ImageStore): the images of the sessions, by session number
+    """
+
+    def __init__(self, workers=None, undo_limit=DEFAULT_LIMIT,
+                 budget=DEFAULT_BUDGET, directory=None, data_dir='.',
+                 max_cells=DEFAULT_MAX_CELLS):
+        self.undo_limit = undo_limit
+        self.max_cells = max_cells
+        self.data_dir = os.path.realpath(data_dir)
+        self.sessions = 0
+        self.store = ImageStore(self.new_session, budget, directory)
+        self._pool = ThreadPoolExecutor(workers)
+        self._serial = 0
+
+    async def start(self, host='127.0.0.1', port=None, path=None):
+        """ Starts accepting connections on TCP, or on a Unix socket if a
+        path is given
+
+        Args:
+            host (str): TCP host, the loopback interface by default
+            port (int): TCP port, 0 picks a free one
+            path (str): Unix socket path
+
+        Returns:
+            asyncio.AbstractServer: the listening server
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path=path)
+
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        """ Waits the running commands, stops the thread pool and drops
+        the images of the sessions """
+        self._pool.shutdown()
+        self.store.close()
+
+    def new_session(self):
+        """ Creates the image of a new session
+
+        Returns:
+            TextImage: an empty text image
+        """
+        image = main.new_image()
+        if self.undo_limit > 0:
+            image.journal = Journal(self.undo_limit)
+
+        return image
+
+    async def handle(self, reader, writer):
+        """ Serves a connection, one command line at a time
+
+        Args:
+            reader (asyncio.StreamReader): stream of the command lines
+            writer (asyncio.StreamWriter): stream of the answers
+        """
+        self._serial += 1
+        key = self._serial
+        self.sessions += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                reply = await self.run_line(key, line.decode('utf8',
+                                                             'replace'))
+                if reply is None:
+                    break
+
+                writer.write(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.sessions -= 1
+            await self.in_pool(self.store.discard, key)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def run_line(self, key, line):
+        """ Runs a command line on the image of a session
+
+        Args:
+            key (int): the number of the session
+            line (str): The command line
+
+        Returns:
+            bytes: the answer of the command, or None if it closes the
+                session
+        """
+        command = line.split()
+        if not command:
+            return answer('command')
+
+        if command[0] == 'X':
+            return None
+
+        # Acquiring may restore the image and releasing may spill others,
+        # so both run in the thread pool
+        errors = []
+        try:
+            image = await self.in_pool(self.store.acquire, key)
+        except (OSError, ValueError):
+            return answer('file')
+
+        try:
+            output = await self.run_command(image, command, errors)
+        finally:
+            try:
+                await self.in_pool(self.store.release, key)
+            except OSError:
+                errors.append('file')
+
+        if errors:
+            return answer(errors[0])
+
+        return answer(None, output)
+
+    async def run_command(self, image, command, errors):
+        """ Compiles and runs a command on an image
+
+        Args:
+            image (TextImage) : The image of the session
+            command (list(str)): The command and its arguments
+            errors (list(str)): Gets the error key of an invalid command
+
+        Returns:
+            str: the output of the command
+        """
+        operation = main.compile_input(image, command[0], command[1:],
+                                       errors.append)
+        if operation is None:
+            return ''
+
+        if command[0] in FILE_COMMANDS:
+            filename = self.resolve(operation.args[0])
+            if filename is None:
+                errors.append('filename')
+                return ''
+            operation = operation.replace(command[0], (filename,))
+
+        if command[0] == 'I':
+            cols, rows = operation.args
+            if max(cols, 0) * max(rows, 0) > self.max_cells:
+                errors.append('size')
+                return ''
+
+        start = perf_counter_ns()
+        try:
+            if command[0] in INLINE:
+                output = execute(operation, errors.append)
+            else:
+                output = await self.in_pool(execute, operation, errors.append)
+        except Exception:
+            errors.append('other')
+            return ''
+        finally:
+            main.STATS.record(command[0], 'run', perf_counter_ns() - start)
+
+        if command[0] == 'T':
+            output += self.store.format()
+
+        return output
+
+    async def in_pool(self, function, *args):
+        """ Runs a function in the thread pool
+
+        Returns:
+            object: the value returned by the function
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, function, *args)
+
+    def resolve(self, filename):
+        """ Finds the path of a file of a session in the data directory
+
+        Args:
+            filename (str): the filename given to the command
+
+        Returns:
+            str: the path of the file, or None if it's absolute, goes up
+                with '..' or leads out of the data directory
+        """
+        if os.path.isabs(filename) or '..' in re.split(r'[\\/]', filename):
+            return None
+
+        path = os.path.realpath(os.path.join(self.data_dir, filename))
+        if os.path.commonpath([path, self.data_dir]) != self.data_dir:
+            return None
+
+        return path
+
+
+def execute(operation, report):
+    """ Runs an operation, returning its output instead of printing it
+
+    Args:
+        operation (Operation): The operation to be run
+        report (function): Called with the error key of an invalid command
+
+    Returns:
+        str: the output of the command
+    """
+    command = operation.command
+    if command == 'G':
+        return main.guide_text()
+
+    if command == 'T':
+        return main.STATS.format()
+
+    if command == 'P':
+        return capture(operation, main.image_text, report)
+
+    if command == 'W':
+        return capture(operation, lambda image, width, height: ''.join(
+            main.page_texts(image, width, height)), report)
+
+    main.run_operation(operation, report)
+    return ''
+
+
+def capture(operation, formatter, report):
+    """ Runs a printing operation with a function that formats its output
+
+    Args:
+        operation (Operation): The operation to be run
+        formatter (function): Called with the image and the arguments of the
+            operation, returns its output
+        report (function): Called with the error key of an invalid command
+
+    Returns:
+        str: the output of the command, empty if it's invalid
+    """
+    output = []
+    image = operation.image
+    main.run_operation(main.Operation(
+        operation.command, image,
+        lambda *args: output.append(formatter(image, *args)), operation.args),
+        report)
+
+    return ''.join(output)
+
+
+def answer(error_type, output=''):
+    """ Formats the answer of a command
+
+    Args:
+        error_type (str): Error key of an invalid command, or None
+        output (str): the output of a valid command
+
+    Returns:
+        bytes: the status line followed by the output or error message
+    """
+    if error_type is not None:
+        status = 'ERROR %s' % error_type
+        output = main.ERRORS.get(error_type, main.ERRORS['other'])
+    else:
+        status = 'OK'
+
+    data = output.encode('utf8')
+    return ('%s %d\n' % (status, len(data))).encode('utf8') + data
+
+
+async def serve(server, host, port, path):
+    """ Runs the server until it is cancelled """
+    listener = await server.start(host, port, path)
+    for socket in listener.sockets:
+        sys.stderr.write("serving on %s\n" % (socket.getsockname(),))
+
+    async with listener:
+        await listener.serve_forever()
+
+
+def main_server(argv=None):
+    """ Server entry point
+
+    Args:
+        argv (list(str)): command line arguments, sys.argv by default
+
+    Returns:
+        int: exit status
+    """
+    parser = argparse.ArgumentParser(description="Text images server")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="TCP host, the loopback interface by default")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port")
+    parser.add_argument('--unix', metavar='PATH',
+                        help="serve on a Unix socket instead of TCP")
+    parser.add_argument('--workers', type=int,
+                        help="threads that run the commands")
+    parser.add_argument('--undo-limit', metavar='BYTES', type=int,
+                        default=DEFAULT_LIMIT,
+                        help="memory cap of the undo history of each "
+                             "session, 0 disables undo")
+    parser.add_argument('--budget', metavar='BYTES', type=int,
+                        default=DEFAULT_BUDGET,
+                        help="memory cap of the resident images, the idle "
+                             "ones are spilled to disk over it")
+    parser.add_argument('--spill-dir', metavar='PATH',
+                        help="directory of the spilled images, a temporary "
+                             "one by default")
+    parser.add_argument('--data-dir', metavar='PATH', default='.',
+                        help="directory of the files saved and opened by "
+                             "the sessions, the current one by default")
+    parser.add_argument('--max-cells', metavar='CELLS', type=int,
+                        default=DEFAULT_MAX_CELLS,
+                        help="maximum number of cells of the image of a "
+                             "session")
+    args = parser.parse_args(argv)
+
+    server = ImageServer(args.workers, args.undo_limit, args.budget,
+                         args.spill_dir, args.data_dir, args.max_cells)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_server())
@@ -7,8 +7,30 @@ function testing will result in better reliability of the image matrices
 manipulations.
 """
 
+import asyncio
+import io
+import os
+import random
+import tempfile
+import threading
 import unittest as ut
+from contextlib import redirect_stderr, redirect_stdout
+import main
 from text_image import TextImage
+from compact_image import CompactTextImage
+from numpy_image import NumpyTextImage, numpy
+from mapped_image import MappedTextImage
+from tiled_image import TiledTextImage, TILE
+from rle_image import RunLengthTextImage
+from row_image import RowMajorTextImage
+from journal import Journal
+from region_index import RegionIndex
+from batch import Coverage, to_rect, visible_rects
+import benchmark
+from command_stats import CommandStats
+from image_store import ImageStore
+from server import ImageServer
+from client import ImageClient, ServerError, run_lines
 
 
 class TestTextImgManipulations(ut.TestCase):
@@ -108,6 +130,35 @@ class TestTextImgManipulations(ut.TestCase):
         self.assertTrue(self.image.cols == cols)
         self.assertTrue(self.image.rows == rows)
 
+    def test_is_image_set(self):
+        self.assertTrue(self.image.is_image_set())
+
+        # The flag follows the replaced image attribute
+        self.image.image = []
+        self.assertFalse(self.image.is_image_set())
+        self.image.image = [[], []]
+        self.assertFalse(self.image.is_image_set())
+
+        # And the columns or rows removed in place
+        self.image.image = [['O'], ['O']]
+        self.assertTrue(self.image.is_image_set())
+        self.image.image[1].clear()
+        self.image.image[0].clear()
+        self.assertFalse(self.image.is_image_set())
+        self.image.image = [['O']]
+        self.assertTrue(self.image.is_image_set())
+        self.image.image.clear()
+        self.assertFalse(self.image.is_image_set())
+        self.image.initialize_matrix(3, 2)
+        self.assertTrue(self.image.is_image_set())
+
+        with self.assertRaises(IndexError):
+            self.image.key_in_rect(0, 1, 2, 0, 'K')
+        with self.assertRaises(IndexError):
+            self.image.vertical_values(3, 0, 1, 'V')
+        with self.assertRaises(IndexError):
+            self.image.lay_value_at(-1, 0, 'L')
+
     def test_clear_matrix(self):
         # Test cleaning a filled matrix
         self.image.clear_matrix()
@@ -403,6 +454,77 @@ class TestTextImgManipulations(ut.TestCase):
                                    pos[1],
                                    'C')
 
+    def test_fill_large_region(self):
+
+        # A region much bigger than the recursion limit
+        self.image.initialize_matrix(300, 200)
+        self.image.vertical_values(150, 0, 198, 'W')
+        self.image.fill_region(0, 0, 'C')
+
+        output = str(self.image).split('\n')
+        self.assertTrue(output[0] == 'C' * 150 + 'W' + 'C' * 149)
+        self.assertTrue(output[199] == 'C' * 300)
+
+        # Filling with zeros changes nothing
+        self.image.initialize_matrix(3, 3)
+        self.image.fill_region(1, 1, 'O')
+        self.assertTrue(self.image.image == [['O'] * 3] * 3)
+
+    def test_save_matrix(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'one.bmp')
+            self.image.save_matrix(filename)
+            with open(filename) as f:
+                self.assertTrue(f.read() == 'AZOQQ\nQABQT\nEGGZP\nOIEER\n')
+
+            # A failed save keeps the previous file and leaves no temporary
+            def broken_row(row):
+                raise OSError
+
+            self.image._row_bytes = broken_row
+            self.image.clear_matrix()
+            with self.assertRaises(OSError):
+                self.image.save_matrix(filename)
+
+            self.assertTrue(os.listdir(directory) == ['one.bmp'])
+            with open(filename) as f:
+                self.assertTrue(f.read() == 'AZOQQ\nQABQT\nEGGZP\nOIEER\n')
+
+    def test_save_changed_rows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'one.bmp')
+            self.image.save_matrix(filename)
+            inode = os.stat(filename).st_ino
+
+            # Saving again only rewrites the changed rows of the same file
+            self.image.lay_value_at(1, 2, 'X')
+            self.image.save_matrix(filename)
+            self.assertTrue(os.stat(filename).st_ino == inode)
+            with open(filename) as f:
+                self.assertTrue(f.read() == 'AZOQQ\nQABQT\nEXGZP\nOIEER\n')
+
+            # A file changed by someone else is written again as a whole
+            with open(filename, 'w') as f:
+                f.write('other\n')
+            self.image.lay_value_at(0, 0, 'Y')
+            self.image.save_matrix(filename)
+            with open(filename) as f:
+                self.assertTrue(f.read() == 'YZOQQ\nQABQT\nEXGZP\nOIEER\n')
+
+    def test_save_binary(self):
+        self.image.lay_value_at(0, 0, '\u00e7')
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'one.bin')
+            self.image.save_binary(filename, 'rle')
+            image = TextImage.from_file(filename)
+            self.assertTrue(str(image) ==
+                            '\u00e7ZOQQ\nQABQT\nEGGZP\nOIEER\n')
+
+            # The format holds single character values only
+            self.image.lay_value_at(0, 0, 'AB')
+            with self.assertRaises(ValueError):
+                self.image.save_binary(filename)
+
     def test_matrix_2_str(self):
         converted = ('AZOQQ\n'
                      'QABQT\n'
@@ -411,6 +533,1462 @@ class TestTextImgManipulations(ut.TestCase):
         output = self.image.image_2_str()
         self.assertTrue(converted == output)
 
+    def test_touch(self):
+        self.image.image_2_str()
+
+        # Cells changed in place are rendered again after touch
+        self.image.image[0][0] = 'Z'
+        self.image.touch()
+        self.assertTrue(self.image.image_2_str().startswith('ZZOQQ\n'))
+
+        self.image.regions = RegionIndex()
+        self.image.fill_region(2, 0, 'F')
+        self.image.image[2][1] = 'O'
+        self.image.touch()
+        self.image.fill_region(2, 1, 'G')
+        self.assertTrue(self.image.image[2][1] == 'G')
+
+
+
+class TestCompactTextImage(ut.TestCase):
+    """ Test case for the bytearray backed text image
+
+    The compact image must behave exactly as the list backed image, so each
+    test applies the same operations to both and compares their outputs.
+
+    Attributes:
+        storage (type): TextImage subclass under test
+        filled_img (list(list)): A filled 2d list for functions manipulations
+        image (TextImage): list backed image built from filled_img
+        compact (TextImage): storage image built from filled_img
+    """
+
+    storage = CompactTextImage
+
+    def setUp(self):
+
+        self.filled_img = [['A', 'Q', 'E', 'O'],
+                           ['Z', 'A', 'G', 'I'],
+                           ['O', 'B', 'G', 'E'],
+                           ['Q', 'Q', 'Z', 'E'],
+                           ['Q', 'T', 'P', 'R']]
+
+        self.image = TextImage([list(col) for col in self.filled_img])
+        self.compact = self.storage(self.filled_img)
+
+    def assertSameImage(self):
+        self.assertTrue(str(self.image) == str(self.compact))
+
+    def test_packing(self):
+        self.assertTrue(self.compact.cols == 5)
+        self.assertTrue(self.compact.rows == 4)
+        self.assertTrue(bytes(self.compact.image) == (b'AZOQQ'
+                                                       b'QABQT'
+                                                       b'EGGZP'
+                                                       b'OIEER'))
+        self.assertSameImage()
+
+    def test_initialize_and_clear(self):
+        self.compact.clear_matrix()
+        self.assertTrue(str(self.compact) == 'OOOOO\n' * 4)
+
+        self.compact.initialize_matrix(3, 2)
+        self.assertTrue(str(self.compact) == 'OOO\nOOO\n')
+
+        # A non positive dimension leaves an empty image
+        for cols, rows in [(-1, 5), (4, 0)]:
+            self.compact.initialize_matrix(cols, rows)
+            self.assertFalse(self.compact.is_image_set())
+            self.assertTrue(self.compact.cols == self.compact.rows == 0)
+            self.assertTrue(str(self.compact) == '')
+            with self.assertRaises(AttributeError):
+                self.compact.lay_value_at(0, 0, 'A')
+
+        self.compact.initialize_matrix(3, 2)
+        self.assertTrue(str(self.compact) == 'OOO\nOOO\n')
+
+        with self.assertRaises(AttributeError):
+            self.storage().clear_matrix()
+
+    def test_clear_and_draw(self):
+        for image in (self.image, self.compact):
+            image.clear_matrix()
+            image.horizontal_values(1, 3, 2, 'H')
+            image.initialize_matrix(5, 4)
+            image.vertical_values(2, 0, 3, 'V')
+            image.fill_region(0, 0, 'F')
+            image.clear_matrix()
+            image.key_in_rect(1, 1, 2, 2, 'K')
+        self.assertSameImage()
+
+    def test_load_matrix(self):
+        rand = random.Random(3)
+        self.image.initialize_matrix(150, 130)
+        for _ in range(50):
+            col, row = rand.randrange(150), rand.randrange(130)
+            self.image.key_in_rect(col, row, min(col + 20, 149),
+                                   min(row + 20, 129), rand.choice('OXY'))
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'one.bmp')
+            self.image.save_matrix(filename)
+            self.compact = self.storage.from_file(filename)
+            self.assertSameImage()
+
+            # The loaded image works as any other
+            for image in (self.image, self.compact):
+                image.fill_region(0, 0, 'F')
+                image.lay_value_at(149, 129, 'L')
+            self.assertSameImage()
+
+            # Invalid files leave the image as it is
+            for content in (b'OOO\nOO\n', b'OO\n\nOO\n', b'\nOO\n'):
+                with open(filename, 'wb') as f:
+                    f.write(content)
+                with self.assertRaises(ValueError):
+                    self.compact.load_matrix(filename)
+                self.assertSameImage()
+
+            with self.assertRaises(OSError):
+                self.compact.load_matrix(os.path.join(directory, 'no.bmp'))
+
+    def test_save_binary(self):
+        self.image.initialize_matrix(300, 200)
+        self.image.key_in_rect(10, 10, 250, 150, 'X')
+        self.image.horizontal_values(0, 299, 199, 'Y')
+        self.compact = self.storage(cols=1, rows=1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            text = os.path.join(directory, 'one.bmp')
+            binary = os.path.join(directory, 'one.bin')
+            self.image.save_matrix(text)
+
+            for compression in ('none', 'rle', 'zlib'):
+                self.image.save_binary(binary, compression)
+                self.compact.load_matrix(binary)
+                self.assertSameImage()
+
+                # The loaded image saves the same binary file
+                with open(binary, 'rb') as f:
+                    data = f.read()
+                self.compact.save_binary(binary, compression)
+                with open(binary, 'rb') as f:
+                    self.assertTrue(f.read() == data)
+
+            self.assertTrue(os.path.getsize(binary) * 100 <
+                            os.path.getsize(text))
+
+            with open(binary, 'wb') as f:
+                f.write(data[:-5])
+            with self.assertRaises(ValueError):
+                self.compact.load_matrix(binary)
+            self.assertSameImage()
+
+            with self.assertRaises(ValueError):
+                self.compact.save_binary(binary, 'lzma')
+
+    def test_operations(self):
+        for image in (self.image, self.compact):
+            image.lay_value_at(2, 1, 'C')
+            image.vertical_values(3, 0, 2, 'V')
+            image.horizontal_values(1, 4, 3, 'H')
+            image.key_in_rect(0, 0, 1, 2, 'K')
+            image.key_in_rect(0, 2, 4, 2, 'W')
+            image.fill_region(4, 0, 'F')
+        self.assertSameImage()
+
+    def test_fill_region(self):
+
+        def reference_fill(image, col, row, value):
+            # Plain 4-connected flood fill over a column list
+            pending = [(col, row)]
+            while pending:
+                col, row = pending.pop()
+                if not (0 <= col < len(image) and 0 <= row < len(image[0])):
+                    continue
+                if image[col][row] != 'O':
+                    continue
+                image[col][row] = value
+                pending.extend([(col-1, row), (col+1, row),
+                                (col, row-1), (col, row+1)])
+
+        rand = random.Random(7)
+        for _ in range(20):
+            cols, rows = rand.randint(1, 30), rand.randint(1, 30)
+            pattern = [[rand.choice('OOOX') for _ in range(rows)]
+                       for _ in range(cols)]
+            col, row = rand.randrange(cols), rand.randrange(rows)
+
+            compact = self.storage(pattern)
+            image = TextImage([list(column) for column in pattern])
+            reference_fill(pattern, col, row, 'F')
+            image.fill_region(col, row, 'F')
+            compact.fill_region(col, row, 'F')
+
+            self.assertTrue(image.image == pattern)
+            self.assertTrue(str(compact) == str(image))
+
+    def test_long_zero_runs(self):
+        rand = random.Random(11)
+        cols = 700
+        pattern = [['O'] * 2 for _ in range(cols)]
+        for _ in range(6):
+            pattern[rand.randrange(cols)][1] = 'X'
+        compact = self.storage(pattern)
+        image = TextImage([list(column) for column in pattern])
+
+        # Runs longer than the search blocks are followed both ways
+        for _ in range(200):
+            row = rand.randrange(2)
+            left = rand.randrange(cols)
+            right = rand.randrange(left, min(left + 3, cols))
+            self.assertTrue(compact._zero_runs(row, left, right) ==
+                            image._zero_runs(row, left, right))
+
+    def test_random_operations(self):
+        rand = random.Random(11)
+        self.image.initialize_matrix(150, 130)
+        self.compact.initialize_matrix(150, 130)
+
+        for _ in range(200):
+            col, row = rand.randrange(150), rand.randrange(130)
+            right, down = rand.randrange(col, 150), rand.randrange(row, 130)
+            value = rand.choice('OXYZ')
+            call = rand.choice([('lay_value_at', (col, row, value)),
+                                ('vertical_values', (col, row, down, value)),
+                                ('horizontal_values', (col, right, row, value)),
+                                ('key_in_rect', (col, row, right, down, value)),
+                                ('fill_region', (col, row, value))])
+            for image in (self.image, self.compact):
+                getattr(image, call[0])(*call[1])
+
+        self.assertSameImage()
+
+    def test_draw_batch(self):
+        rand = random.Random(5)
+        self.image.initialize_matrix(90, 70)
+        self.compact.initialize_matrix(90, 70)
+        self.compact.journal = Journal()
+
+        batch = []
+        for _ in range(300):
+            col, row = rand.randrange(90), rand.randrange(70)
+            right, down = rand.randrange(col, 90), rand.randrange(row, 70)
+            batch.append(rand.choice([('L', col, row, 'L'),
+                                      ('V', col, row, down, 'V'),
+                                      ('H', col, right, row, 'H'),
+                                      ('K', col, row, right, down, 'K'),
+                                      ('K', col, row, right, down, 'O')]))
+
+        methods = {'L': 'lay_value_at', 'V': 'vertical_values',
+                   'H': 'horizontal_values', 'K': 'key_in_rect'}
+        for operation in batch:
+            getattr(self.image, methods[operation[0]])(*operation[1:])
+
+        # Every cell is drawn once at most, and the batch is a single edit
+        self.assertTrue(self.compact.draw_batch(batch) <= 90 * 70)
+        self.assertSameImage()
+        self.assertTrue(self.compact.undo())
+        self.assertTrue(str(self.compact) == ('O' * 90 + '\n') * 70)
+
+        # An invalid operation leaves the image untouched
+        for invalid in [('K', 0, 0, 90, 1, 'A'), ('H', 5, 4, 0, 'A'),
+                        ('F', 0, 0, 'A'), ('L', 0, 0)]:
+            with self.assertRaises((IndexError, ValueError)):
+                self.compact.draw_batch([('K', 0, 0, 89, 69, 'A'), invalid])
+            self.assertTrue(str(self.compact) == ('O' * 90 + '\n') * 70)
+
+        with self.assertRaises(AttributeError):
+            self.storage().draw_batch([('L', 0, 0, 'A')])
+
+    def test_copy_region(self):
+        rand = random.Random(8)
+        self.image.initialize_matrix(90, 40)
+        self.compact.initialize_matrix(90, 40)
+        self.compact.journal = Journal()
+        for _ in range(30):
+            col, row = rand.randrange(90), rand.randrange(40)
+            right, down = rand.randrange(col, 90), rand.randrange(row, 40)
+            value = rand.choice('XYZ')
+            for image in (self.image, self.compact):
+                image.key_in_rect(col, row, right, down, value)
+        drawn = str(self.compact)
+
+        # Overlapping copies and moves, checked against a copy of the cells
+        # through a buffer
+        for _ in range(60):
+            width, height = rand.randrange(1, 30), rand.randrange(1, 15)
+            col, row = rand.randrange(90 - width), rand.randrange(40 - height)
+            to_col = min(max(col + rand.randrange(-5, 6), 0), 90 - width)
+            to_row = min(max(row + rand.randrange(-3, 4), 0), 40 - height)
+            args = (col, row, col + width - 1, row + height - 1, to_col,
+                    to_row)
+
+            rows = str(self.image).splitlines()
+            expected = [list(line) for line in rows]
+            method = rand.choice(['copy_region', 'move_region'])
+            if method == 'move_region':
+                for line in expected[row:row+height]:
+                    line[col:col+width] = 'O' * width
+            for line in range(height):
+                expected[to_row+line][to_col:to_col+width] = \
+                    rows[row+line][col:col+width]
+
+            for image in (self.image, self.compact):
+                getattr(image, method)(*args)
+            self.assertTrue(str(self.image) == ''.join(
+                ''.join(line) + '\n' for line in expected))
+            self.assertSameImage()
+
+        # Each copy or move is a single edit
+        for _ in range(60):
+            self.assertTrue(self.compact.undo())
+        self.assertTrue(str(self.compact) == drawn)
+
+        # Between images, with the values converted to the storage
+        source = TextImage([['A', 'B'], ['C', 'D'], ['E', '\u00e7']])
+        self.compact.initialize_matrix(4, 3)
+        self.compact.copy_region(0, 0, 2, 0, 1, 2, source)
+        self.assertTrue(str(self.compact) == 'OOOO\nOOOO\nOACE\n')
+        cells = self.image.window_2_str(0, 2, 2, 2)
+        self.compact.move_region(0, 2, 2, 2, 0, 0, self.image)
+        self.assertTrue(self.compact.window_2_str(0, 0, 2, 0) == cells)
+        self.assertTrue(self.image.window_2_str(0, 2, 2, 2) == 'OOO\n')
+
+        with self.assertRaises(IndexError):
+            self.compact.copy_region(0, 0, 1, 1, 3, 0)
+        with self.assertRaises(IndexError):
+            self.compact.move_region(0, 0, 1, 2, 0, 0, source)
+        with self.assertRaises(AttributeError):
+            self.storage().copy_region(0, 0, 0, 0, 0, 0)
+
+    def test_window_2_str(self):
+        rand = random.Random(3)
+        self.image.initialize_matrix(150, 20)
+        self.compact.initialize_matrix(150, 20)
+        for _ in range(40):
+            col, row = rand.randrange(150), rand.randrange(20)
+            right, down = rand.randrange(col, 150), rand.randrange(row, 20)
+            value = rand.choice('OXYZ')
+            for image in (self.image, self.compact):
+                image.key_in_rect(col, row, right, down, value)
+
+        rows = str(self.image).splitlines()
+        for col, row, right, down in [(0, 0, 149, 19), (60, 3, 130, 9),
+                                      (63, 0, 64, 0), (149, 19, 149, 19)]:
+            window = ''.join(line[col:right+1] + '\n'
+                             for line in rows[row:down+1])
+            self.assertTrue(self.compact.window_2_str(col, row, right,
+                                                      down) == window)
+
+        # The pages cover the image, left to right and top to bottom
+        pages = list(self.compact.pages(64, 8))
+        self.assertTrue([bounds for bounds, _ in pages[:4]] ==
+                        [(0, 0, 63, 7), (64, 0, 127, 7), (128, 0, 149, 7),
+                         (0, 8, 63, 15)])
+        self.assertTrue(len(pages) == 9)
+        for bounds, text in pages:
+            self.assertTrue(text == self.image.window_2_str(*bounds))
+
+        with self.assertRaises(IndexError):
+            self.compact.window_2_str(0, 0, 150, 19)
+        with self.assertRaises(IndexError):
+            self.compact.window_2_str(5, 0, 4, 19)
+        with self.assertRaises(ValueError):
+            next(self.compact.pages(0, 8))
+        with self.assertRaises(AttributeError):
+            self.storage().window_2_str(0, 0, 0, 0)
+
+    def test_invalid_calls(self):
+        with self.assertRaises(IndexError):
+            self.compact.lay_value_at(5, 0, 'C')
+
+        with self.assertRaises(IndexError):
+            self.compact.horizontal_values(3, 1, 0, 'C')
+
+        with self.assertRaises(ValueError):
+            self.compact.lay_value_at(0, 0, 'CC')
+
+        with self.assertRaises(ValueError):
+            self.compact.key_in_rect(0, 0, 1, 1, '\u00e7')
+
+        # A copy from a list is converted before any cell is written
+        source = TextImage([['A', 'B'], ['C', '\u00e7']])
+        with self.assertRaises(ValueError):
+            self.compact.copy_region(0, 0, 1, 1, 0, 0, source)
+        self.assertSameImage()
+
+
+
+@ut.skipIf(numpy is None, "NumPy is not installed")
+class TestNumpyTextImage(TestCompactTextImage):
+    """ Test case for the NumPy backed text image
+
+    It runs the same checks of the compact image test case.
+    """
+
+    storage = NumpyTextImage
+
+    def test_lazy_clear(self):
+        array = self.compact.image
+        self.compact.clear_matrix()
+
+        # The array is kept, and its rows are zeroed when used again
+        self.assertTrue(self.compact.image is array)
+        self.assertTrue(bytes(array[3]) == b'OIEER')
+        self.assertTrue(self.compact.image_2_str() == 'OOOOO\n' * 4)
+
+        self.compact.lay_value_at(0, 3, 'A')
+        self.compact.initialize_matrix(5, 4)
+        self.assertTrue(self.compact.image is array)
+        self.assertTrue(self.compact._get_cell(0, 3) == 'O')
+        self.compact.lay_value_at(1, 2, 'B')
+        self.assertTrue(str(self.compact) == 'OOOOO\nOOOOO\nOBOOO\nOOOOO\n')
+
+        self.compact.initialize_matrix(4, 5)
+        self.assertTrue(self.compact.image is not array)
+
+
+class TestMappedTextImage(ut.TestCase):
+    """ Test case for the text image mapped from a file
+
+    Attributes:
+        directory (TemporaryDirectory): directory of the mapped files
+        filename (str): name of the mapped file
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'mapped.bmp')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_file(self):
+        with open(self.filename) as f:
+            return f.read()
+
+    def test_operations(self):
+        image = TextImage(cols=6, rows=4)
+        mapped = MappedTextImage(self.filename, 6, 4)
+        self.assertTrue(self.read_file() == 'OOOOOO\n' * 4)
+
+        for each in (image, mapped):
+            each.key_in_rect(1, 1, 5, 2, 'X')
+            each.vertical_values(0, 0, 3, 'V')
+            each.horizontal_values(0, 5, 3, 'W')
+            each.lay_value_at(3, 0, 'L')
+            each.fill_region(5, 0, 'F')
+
+        # The operations write straight into the file
+        mapped.save_matrix(self.filename)
+        self.assertTrue(self.read_file() == str(image))
+        self.assertTrue(str(mapped) == str(image))
+
+        mapped.clear_matrix()
+        mapped.close()
+        self.assertTrue(self.read_file() == 'OOOOOO\n' * 4)
+
+    def test_empty_dimensions(self):
+        image = MappedTextImage(self.filename, 2, 2)
+        image.initialize_matrix(-1, 5)
+        self.assertFalse(image.is_image_set())
+        image.initialize_matrix(3, 1)
+        self.assertTrue(str(image) == 'OOO\n')
+        image.close()
+
+    def test_open(self):
+        image = TextImage(cols=3, rows=2)
+        image.lay_value_at(2, 1, 'A')
+        image.save_matrix(self.filename)
+
+        mapped = MappedTextImage(self.filename)
+        self.assertTrue(mapped.cols == 3)
+        self.assertTrue(mapped.rows == 2)
+        self.assertTrue(str(mapped) == 'OOO\nOOA\n')
+        mapped.close()
+
+        with open(self.filename, 'w') as f:
+            f.write('OOO\nOO')
+        with self.assertRaises(ValueError):
+            MappedTextImage(self.filename)
+
+    def test_load_matrix(self):
+        other = os.path.join(self.directory.name, 'other.bmp')
+        with open(other, 'w') as f:
+            f.write('AB\nCD\nEF')
+
+        # The loaded image is copied into the mapped file
+        mapped = MappedTextImage(self.filename, 3, 3)
+        mapped.load_matrix(other)
+        self.assertTrue((mapped.cols, mapped.rows) == (2, 3))
+        mapped.lay_value_at(0, 0, 'X')
+        mapped.close()
+        self.assertTrue(self.read_file() == 'XB\nCD\nEF\n')
+
+        mapped = MappedTextImage.from_file(self.filename)
+        self.assertTrue(str(mapped) == 'XB\nCD\nEF\n')
+        mapped.close()
+
+
+class TestJournal(ut.TestCase):
+    """ Test case for the undo and redo of the image edits """
+
+    storages = (TextImage, CompactTextImage, TiledTextImage,
+                RunLengthTextImage, RowMajorTextImage)
+
+    def edit(self, image):
+        # Returns the image output after each edit
+        outputs = [str(image)]
+        edits = [('initialize_matrix', (6, 5)),
+                 ('key_in_rect', (1, 1, 4, 3, 'A')),
+                 ('lay_value_at', (2, 2, 'B')),
+                 ('vertical_values', (0, 0, 4, 'V')),
+                 ('fill_region', (5, 0, 'F')),
+                 ('horizontal_values', (0, 5, 4, 'H')),
+                 ('clear_matrix', ())]
+        for name, args in edits:
+            getattr(image, name)(*args)
+            outputs.append(str(image))
+
+        return outputs
+
+    def test_undo_redo(self):
+        for storage in self.storages:
+            image = storage()
+            image.journal = Journal()
+            outputs = self.edit(image)
+
+            for output in reversed(outputs[:-1]):
+                self.assertTrue(image.undo())
+                self.assertTrue(str(image) == output)
+            self.assertFalse(image.undo())
+
+            for output in outputs[1:]:
+                self.assertTrue(image.redo())
+                self.assertTrue(str(image) == output)
+            self.assertFalse(image.redo())
+
+            # A new edit drops the undone ones
+            image.undo()
+            image.lay_value_at(0, 0, 'Z')
+            self.assertFalse(image.redo())
+
+    def test_compact_records(self):
+        image = CompactTextImage(cols=1000, rows=1000)
+        image.journal = Journal()
+
+        # Uniform cells are recorded as a single value
+        image.key_in_rect(0, 0, 999, 999, 'A')
+        self.assertTrue(image.journal.size < 1000)
+
+    def test_memory_cap(self):
+        image = CompactTextImage(cols=100, rows=100)
+        image.journal = Journal(limit=3000)
+
+        for col in range(0, 100, 2):
+            image.vertical_values(col, 0, 99, 'A')
+
+        # Only the newest edits are kept
+        image.key_in_rect(0, 0, 9, 9, 'B')
+        self.assertTrue(image.journal.size <= 3000)
+        self.assertTrue(image.undo())
+        self.assertTrue(str(image).startswith('AOAO'))
+        while image.undo():
+            pass
+        self.assertTrue(str(image).startswith('AOAO'))
+        self.assertTrue(str(image).endswith('OOOO\n'))
+
+    def test_uncapturable_edit(self):
+        image = CompactTextImage(cols=100, rows=100)
+        image.journal = Journal(limit=3000)
+        image.vertical_values(0, 0, 99, 'A')
+
+        # An edit of more cells than the cap drops the history unread
+        reads = []
+        read_segment = image._read_segment
+        image._read_segment = lambda *args: reads.append(args) or \
+            read_segment(*args)
+        image.clear_matrix()
+        self.assertTrue(reads == [])
+        self.assertTrue(image.journal.size == 0)
+        self.assertFalse(image.undo())
+
+        image.initialize_matrix(100, 100)
+        self.assertTrue(reads == [])
+        self.assertFalse(image.undo())
+
+        # The next edits are recorded again
+        image.lay_value_at(0, 0, 'B')
+        self.assertTrue(image.undo())
+        self.assertTrue(str(image) == ('O' * 100 + '\n') * 100)
+
+
+    def test_failed_edit(self):
+        edits = [('lay_value_at', (0, 0, 'AB')),
+                 ('vertical_values', (0, 0, 1, 'AB')),
+                 ('horizontal_values', (0, 1, 0, 'AB')),
+                 ('key_in_rect', (0, 0, 1, 1, 'AB')),
+                 ('fill_region', (1, 1, 'AB'))]
+        image = CompactTextImage(cols=2, rows=2)
+        image.journal = Journal()
+        image.lay_value_at(0, 0, 'A')
+        image.lay_value_at(1, 0, 'B')
+        image.undo()
+
+        # A value the storage can't hold leaves the history untouched
+        for name, args in edits:
+            self.assertRaises(ValueError, getattr(image, name), *args)
+        self.assertTrue(image.journal.size > 0)
+
+        def fail(cols, rows):
+            raise MemoryError
+
+        image._allocate = fail
+        self.assertRaises(MemoryError, image.initialize_matrix, 3, 3)
+        self.assertTrue(image.cols == 2 and image.rows == 2)
+
+        self.assertTrue(image.redo())
+        self.assertTrue(str(image) == 'AB\nOO\n')
+        self.assertFalse(image.redo())
+        for _ in range(2):
+            self.assertTrue(image.undo())
+        self.assertTrue(str(image) == 'OO\nOO\n')
+        self.assertFalse(image.undo())
+
+
+class TestCommandCompiler(ut.TestCase):
+    """ Test case for compiling user commands into operations """
+
+    def setUp(self):
+        self.image = TextImage(cols=5, rows=4)
+
+    def test_compile_command(self):
+        operation = main.compile_command(self.image, 'K', ['1', '2', '3', '4',
+                                                           'E'])
+        self.assertTrue(operation.args == (0, 1, 2, 3, 'E'))
+        self.assertTrue(operation.function == self.image.key_in_rect)
+        self.assertTrue(operation.needs_image)
+
+        operation()
+        self.assertTrue(self.image.image[2] == ['O', 'E', 'E', 'E'])
+
+        operation = main.compile_command(self.image, 'I', ['3', '2'])
+        self.assertTrue(operation.args == (3, 2))
+        self.assertFalse(operation.needs_image)
+
+    def test_compile_errors(self):
+        invalid = [('Q', [], 'command'),
+                   ('L', ['1', '1'], 'syntax'),
+                   ('L', ['1', 'a', 'C'], 'value')]
+
+        for command, args, error_type in invalid:
+            with self.assertRaises(main.CommandError) as context:
+                main.compile_command(self.image, command, args)
+            self.assertTrue(context.exception.error_type == error_type)
+
+    def test_ignored_arguments(self):
+        for command, args in [('G', ['2', '3', 'J']), ('X', ['1']),
+                              ('P', ['1', '2']), ('P', ['1', '1', '2', '2', '3'])]:
+            operation = main.compile_command(self.image, command, args)
+            self.assertTrue(operation.args == ())
+
+        operation = main.compile_command(self.image, 'P', ['1', '1', '2', '2'])
+        self.assertTrue(operation.args == (0, 0, 1, 1))
+        with self.assertRaises(main.CommandError):
+            main.compile_command(self.image, 'C', ['1'])
+
+
+class TestBatchMode(ut.TestCase):
+    """ Test case for running command scripts without user interaction """
+
+    script = ('I 5 3\n'
+              'G\n'
+              '\n'
+              'L 9 9 A\n'
+              'K 1 1 2 2 E\n'
+              'Q\n'
+              'P\n'
+              'X\n'
+              'P\n')
+
+    def run_script(self, stop_on_error=False):
+        image = TextImage()
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            failures = main.run_script(image,
+                                       io.StringIO(self.script),
+                                       stop_on_error)
+        return failures, stdout.getvalue(), stderr.getvalue()
+
+    def test_run_script(self):
+        failures, stdout, stderr = self.run_script()
+        self.assertTrue(failures == 2)
+        self.assertTrue(stdout == 'EEOOO\nEEOOO\nOOOOO\n\n')
+        self.assertTrue(stderr == ('line 4: INVALID IMAGE BOUNDS\n'
+                                   'line 6: INVALID COMMAND\n'))
+
+    def test_stop_on_error(self):
+        failures, stdout, stderr = self.run_script(stop_on_error=True)
+        self.assertTrue(failures == 1)
+        self.assertTrue(stdout == '')
+        self.assertTrue(stderr == 'line 4: INVALID IMAGE BOUNDS\n')
+
+    def test_load_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'one.bmp')
+            with open(filename, 'w') as f:
+                f.write('ABC\nDEF\n')
+
+            image = TextImage()
+            image.journal = Journal()
+            stdout = io.StringIO()
+            stderr = io.StringIO()
+            script = 'O %s\nL 1 1 X\nP\nU\nU\nP\nO missing.bmp\n' % filename
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                failures = main.run_script(image, io.StringIO(script))
+
+            self.assertTrue(failures == 1)
+            self.assertTrue(stdout.getvalue() == 'XBC\nDEF\n\n\n')
+            self.assertTrue(stderr.getvalue() == 'line 7: SYSTEM ERROR\n')
+
+    def test_sample_inputs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            one = os.path.join(directory, 'one.bmp')
+            two = os.path.join(directory, 'two.bmp')
+            script = ('I 5 6\nL 2 3 A\nS %s\nG 2 3 J\nV 2 3 4 W\nH 3 4 2 Z\n'
+                      'F 3 3 J\nS %s\nX 1\nP\n' % (one, two))
+            stdout = io.StringIO()
+            with redirect_stdout(stdout):
+                failures = main.run_script(TextImage(), io.StringIO(script))
+
+            # The guide and exit ignore their arguments
+            self.assertTrue(failures == 0)
+            self.assertTrue(stdout.getvalue() == '')
+            with open(two) as f:
+                self.assertTrue(f.read() == ('JJJJJ\nJJZZJ\nJWJJJ\nJWJJJ\n'
+                                             'JJJJJ\nJJJJJ\n'))
+
+    def test_copy_commands(self):
+        image = TextImage()
+        image.journal = Journal()
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        script = ('I 5 3\nH 1 3 1 A\nY 1 1 3 1 2 2\nP\nM 2 2 4 2 3 3\nP\n'
+                  'U\nP\nY 1 1 3 1 4 1\nM 1 1 2\n')
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            failures = main.run_script(image, io.StringIO(script))
+
+        self.assertTrue(failures == 2)
+        self.assertTrue(stdout.getvalue() == ('AAAOO\nOAAAO\nOOOOO\n\n'
+                                              'AAAOO\nOOOOO\nOOAAA\n\n'
+                                              'AAAOO\nOAAAO\nOOOOO\n\n'))
+        self.assertTrue(stderr.getvalue() == ('line 9: INVALID IMAGE BOUNDS\n'
+                                              'line 10: INVALID COMMAND '
+                                              'SYNTAX\n'))
+
+    def test_window_commands(self):
+        image = TextImage()
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        script = 'I 5 3\nK 2 1 4 2 E\nP 2 2 3 3\nW 3 2\nP 1 1 6 1\nW 0 2\n'
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            failures = main.run_script(image, io.StringIO(script))
+
+        self.assertTrue(failures == 2)
+        self.assertTrue(stdout.getvalue() == ('EE\nOO\n\n'
+                                              '-- 1 1 3 2 --\nOEE\nOEE\n\n'
+                                              '-- 4 1 5 2 --\nEO\nEO\n\n'
+                                              '-- 1 3 3 3 --\nOOO\n\n'
+                                              '-- 4 3 5 3 --\nOO\n\n'))
+        self.assertTrue(stderr.getvalue() == ('line 5: INVALID IMAGE BOUNDS\n'
+                                              'line 6: INVALID COMMAND INPUT\n'))
+
+
+
+class TestScriptOptimizer(ut.TestCase):
+    """ Test case for the optimization of the command scripts """
+
+    def compile(self, image, lines):
+        entries = []
+        for number, line in enumerate(lines, 1):
+            command = line.split()
+            try:
+                operation = main.compile_command(image, command[0],
+                                                  command[1:])
+            except main.CommandError:
+                operation = None
+            entries.append((number, operation))
+        return entries
+
+    def test_optimize(self):
+        image = TextImage()
+        lines = ['I 6 4', 'K 1 1 3 3 A', 'L 9 9 B', 'L 2 2 C', 'K 1 1 4 4 D',
+                 'L 1 1 E', 'L 2 1 E', 'L 1 2 E', 'L 2 2 E', 'L 6 4 F',
+                 'P', 'L 5 1 G', 'C', 'L 1 1 H', 'V 1 1 2 H', 'I 3 3',
+                 'K 1 1 3 3 J', 'L 1 1 K', 'H 1 3 1 M', 'Q']
+        optimized = main.optimize(self.compile(image, lines))
+
+        self.assertTrue([(number, repr(operation))
+                         for number, operation in optimized] == [
+            (1, "Operation('I', (6, 4))"),
+            (2, "Operation('K', (0, 0, 2, 2, 'A'))"),
+            (3, "Operation('L', (8, 8, 'B'))"),
+            (5, "Operation('K', (0, 0, 3, 3, 'D'))"),
+            (6, "Operation('K', (0, 0, 1, 1, 'E'))"),
+            (6, "Operation('L', (5, 3, 'F'))"),
+            (11, "Operation('P', ())"),
+            (16, "Operation('I', (3, 3))"),
+            (17, "Operation('K', (0, 0, 2, 2, 'J'))"),
+            (19, "Operation('H', (0, 2, 0, 'M'))"),
+            (20, 'None')])
+
+        # Nothing before an undo is rewritten
+        entries = self.compile(image, lines + ['U'])
+        self.assertTrue(main.optimize(entries) == entries)
+
+    def test_saved_files(self):
+        rand = random.Random(3)
+        lines = benchmark.make_script(30, 20, 400, seed=3)
+        for index in sorted(rand.sample(range(1, len(lines)), 12)):
+            lines.insert(index, rand.choice(['S %d.bmp' % index,
+                                             'L 40 1 A', 'L 1 1 AB']))
+        lines.append('S last.bmp')
+
+        with tempfile.TemporaryDirectory() as directory:
+            outputs = []
+            for optimized in (False, True):
+                folder = os.path.join(directory, str(optimized))
+                os.mkdir(folder)
+                script = '\n'.join(line if not line.startswith('S ') else
+                                   'S ' + os.path.join(folder, line[2:])
+                                   for line in lines)
+                stdout = io.StringIO()
+                stderr = io.StringIO()
+                with redirect_stdout(stdout), redirect_stderr(stderr):
+                    failures = main.run_script(CompactTextImage(),
+                                               io.StringIO(script),
+                                               optimized=optimized)
+
+                files = {}
+                for name in os.listdir(folder):
+                    with open(os.path.join(folder, name), 'rb') as f:
+                        files[name] = f.read()
+                outputs.append((failures, stdout.getvalue(),
+                                stderr.getvalue(), files))
+
+        self.assertTrue(outputs[0][0] > 0)
+        self.assertTrue(len(outputs[0][3]) > 1)
+        self.assertTrue(outputs[0] == outputs[1])
+
+
+class TestTiledTextImage(TestCompactTextImage):
+    """ Test case for the sparse tiled text image
+
+    It runs the same checks of the compact image test case, besides checking
+    that only the drawn tiles are allocated.
+    """
+
+    storage = TiledTextImage
+
+    def test_packing(self):
+        self.assertTrue(self.compact.cols == 5)
+        self.assertTrue(self.compact.rows == 4)
+        self.assertSameImage()
+
+    def test_sparse_tiles(self):
+        image = TiledTextImage(cols=1000, rows=1000)
+        self.assertTrue(image.image == {})
+
+        # Only the touched tile is allocated
+        image.lay_value_at(70, 5, 'A')
+        self.assertTrue(list(image.image) == [(1, 0)])
+        self.assertTrue(len(image.image[(1, 0)]) == TILE * TILE)
+
+        # Covered tiles collapse to a single value
+        image.key_in_rect(0, 0, 999, 127, 'B')
+        self.assertTrue(all(tile == b'B' for tile in image.image.values()))
+        self.assertTrue(len(image.image) == 16 * 2)
+
+        # A tile left all 'O' is dropped
+        image.lay_value_at(999, 999, 'C')
+        image.lay_value_at(999, 999, 'O')
+        self.assertTrue(len(image.image) == 16 * 2)
+
+        image.clear_matrix()
+        self.assertTrue(image.image == {})
+
+    def test_zero_runs(self):
+        rand = random.Random(4)
+        cols = 5 * TILE + 7
+        self.compact.initialize_matrix(cols, 2)
+        reference = CompactTextImage(cols=cols, rows=2)
+        for _ in range(12):
+            col = rand.randrange(cols)
+            right = min(col + rand.randrange(3), cols - 1)
+            for image in (self.compact, reference):
+                image.horizontal_values(col, right, 1, 'X')
+
+        # The runs are followed across the tiles, as far as they go
+        for _ in range(300):
+            row = rand.randrange(2)
+            left = rand.randrange(cols)
+            right = rand.randrange(left, cols)
+            self.assertTrue(self.compact._zero_runs(row, left, right) ==
+                            reference._zero_runs(row, left, right))
+
+
+class TestRowMajorTextImage(TestCompactTextImage):
+    """ Test case for the row major text image
+
+    It runs the same checks of the compact image test case, but the row
+    major image accepts any value, as the list backed image does.
+    """
+
+    storage = RowMajorTextImage
+
+    def test_packing(self):
+        self.assertTrue(self.compact.image == [['A', 'Z', 'O', 'Q', 'Q'],
+                                               ['Q', 'A', 'B', 'Q', 'T'],
+                                               ['E', 'G', 'G', 'Z', 'P'],
+                                               ['O', 'I', 'E', 'E', 'R']])
+        self.assertSameImage()
+
+    def test_lazy_clear(self):
+        rows = self.compact.image
+        last = rows[3]
+        self.compact.clear_matrix()
+
+        # The rows are kept until they are used again
+        self.assertTrue(self.compact.image is rows and rows[3] is last)
+        self.assertTrue(self.compact.image_2_str() == 'OOOOO\n' * 4)
+
+        self.compact.lay_value_at(0, 3, 'A')
+        self.compact.initialize_matrix(5, 4)
+        self.assertTrue(self.compact.image is rows)
+        self.assertTrue(self.compact._get_cell(0, 3) == 'O')
+
+    def test_invalid_calls(self):
+        with self.assertRaises(IndexError):
+            self.compact.lay_value_at(5, 0, 'C')
+
+        with self.assertRaises(IndexError):
+            self.compact.horizontal_values(3, 1, 0, 'C')
+
+        for image in (self.image, self.compact):
+            image.lay_value_at(0, 0, 'CC')
+        self.assertSameImage()
+
+
+class TestRunLengthTextImage(TestCompactTextImage):
+    """ Test case for the run-length encoded text image
+
+    It runs the same checks of the compact image test case, besides checking
+    that the runs are split and merged.
+    """
+
+    storage = RunLengthTextImage
+
+    def test_packing(self):
+        self.assertTrue(self.compact.image[2] == ([0, 1, 3, 4],
+                                                  [b'E', b'G', b'Z', b'P']))
+        self.assertTrue(self.compact.image[3] == ([0, 1, 2, 4],
+                                                  [b'O', b'I', b'E', b'R']))
+        self.assertSameImage()
+
+    def test_runs(self):
+        image = RunLengthTextImage(cols=1000, rows=3)
+        image.horizontal_values(10, 19, 1, 'A')
+        self.assertTrue(image.image[1] == ([0, 10, 20], [b'O', b'A', b'O']))
+
+        # Splitting a run
+        image.lay_value_at(15, 1, 'B')
+        self.assertTrue(image.image[1] == ([0, 10, 15, 16, 20],
+                                           [b'O', b'A', b'B', b'A', b'O']))
+
+        # Merging the runs back
+        image.lay_value_at(15, 1, 'A')
+        self.assertTrue(image.image[1] == ([0, 10, 20], [b'O', b'A', b'O']))
+
+        image.key_in_rect(0, 0, 999, 2, 'O')
+        self.assertTrue(image.image == [([0], [b'O'])] * 3)
+
+
+class TestRegionIndex(ut.TestCase):
+    """ Test case for the index of the 'O' regions
+
+    An indexed image must behave exactly as an image that searches its
+    regions, while its writes drop and find again the indexed regions.
+    """
+
+    storages = (TextImage, CompactTextImage, RowMajorTextImage)
+
+    def test_region_size(self):
+        image = TextImage(cols=6, rows=5)
+        image.regions = RegionIndex()
+        image.vertical_values(2, 0, 4, 'X')
+        self.assertTrue(image.region_size(0, 0) == 10)
+        self.assertTrue(image.region_size(5, 4) == 15)
+        self.assertTrue(image.region_size(2, 1) == 0)
+
+        # Opening the wall merges the regions
+        image.lay_value_at(2, 3, 'O')
+        self.assertTrue(image.region_size(0, 0) == 26)
+        self.assertTrue(TextImage([list(column) for column in image.image])
+                        .region_size(5, 0) == 26)
+
+        with self.assertRaises(IndexError):
+            image.region_size(6, 0)
+
+    def test_random_operations(self):
+        rand = random.Random(5)
+        for storage in self.storages:
+            image = storage(cols=40, rows=30)
+            indexed = storage(cols=40, rows=30)
+            indexed.regions = RegionIndex()
+            indexed.journal = Journal()
+
+            for _ in range(300):
+                col, row = rand.randrange(40), rand.randrange(30)
+                right, down = rand.randrange(col, 40), rand.randrange(row, 30)
+                value = rand.choice('OOXF')
+                call = rand.choice([
+                    ('lay_value_at', (col, row, value)),
+                    ('vertical_values', (col, row, down, value)),
+                    ('horizontal_values', (col, right, row, value)),
+                    ('key_in_rect', (col, row, col + 2, row + 2, value)
+                     if col < 38 and row < 28 else (col, row, col, row,
+                                                    value)),
+                    ('fill_region', (col, row, value)),
+                    ('region_size', (col, row))])
+                results = [getattr(target, call[0])(*call[1])
+                           for target in (image, indexed)]
+                self.assertTrue(results[0] == results[1])
+
+            self.assertTrue(str(image) == str(indexed))
+
+            # Undoing writes through the index as well
+            for _ in range(10):
+                indexed.undo()
+            plain = storage([list(column) for column in
+                             zip(*[line for line in str(indexed).split()])])
+            for col, row in ((0, 0), (39, 29), (20, 15)):
+                self.assertTrue(indexed.region_size(col, row) ==
+                                plain.region_size(col, row))
+
+
+class TestBenchmark(ut.TestCase):
+    """ Test case for the benchmarks of the image operations """
+
+    def test_run_benchmarks(self):
+        results = benchmark.run_benchmarks(['compact', 'list'], [(8, 6)],
+                                           ['fill_region_worst', 'script'],
+                                           repeat=1)
+        self.assertTrue(len(results) == 4)
+        for result in results:
+            self.assertTrue(result['seconds'] >= 0)
+            self.assertTrue(result['peak_bytes'] >= 0)
+
+        # A result slower than its baseline by the threshold regressed
+        baseline = [dict(result, seconds=1.0) for result in results]
+        slower = [dict(result, seconds=2.0) for result in results]
+        self.assertTrue(benchmark.compare(results, baseline, 1.5) == [])
+        self.assertTrue(len(benchmark.compare(slower, baseline, 1.5)) == 4)
+
+
+class TestCommandStats(ut.TestCase):
+    """ Test case for the timings of the commands """
+
+    def setUp(self):
+        main.STATS.clear()
+
+    def test_timing(self):
+        stats = CommandStats()
+        for elapsed in range(1, 101):
+            stats.record('F', 'run', elapsed * 1000)
+
+        timing = stats.timings[('F', 'run')]
+        self.assertTrue(timing.count == 100)
+        self.assertTrue(timing.total == 5050000)
+        self.assertTrue((timing.minimum, timing.maximum) == (1000, 100000))
+
+        # The percentiles are estimated within a bucket
+        self.assertTrue(50000 <= timing.percentile(0.5) <= 50000 * 1.19)
+        self.assertTrue(99000 <= timing.percentile(0.99) <= 100000)
+        self.assertTrue(stats.format().split('\n')[1].startswith('F'))
+
+    def test_stats_command(self):
+        image = TextImage()
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            for line in ('I 5 4', 'F 1 1 A', 'F 1 1 B', 'Q', 'L 9 9 A', 'T'):
+                main.handle_user_input(image, line, lambda error: None)
+
+        counts = dict((key, timing.count)
+                      for key, timing in main.STATS.timings.items())
+        self.assertTrue(counts[('F', 'parse')] == 2)
+        self.assertTrue(counts[('F', 'run')] == 2)
+        self.assertTrue(counts[('L', 'run')] == 1)
+        self.assertTrue(counts[('?', 'parse')] == 1)
+        self.assertTrue(('?', 'run') not in counts)
+
+        lines = stdout.getvalue().split('\n')
+        self.assertTrue(lines[0].split()[:3] == ['command', 'phase', 'count'])
+        self.assertTrue(lines[1].split()[:3] == ['?', 'parse', '1'])
+
+
+class TestBatch(ut.TestCase):
+    """ Test case for the coalescing of the batches of operations """
+
+    def test_coverage(self):
+        coverage = Coverage(0, 9)
+        self.assertTrue(coverage.paint(2, 0, 4, 9) == [(2, 0, 4, 9)])
+        self.assertTrue(coverage.paint(0, 3, 9, 5) ==
+                        [(0, 3, 1, 5), (5, 3, 9, 5)])
+        self.assertTrue(coverage.paint(0, 0, 9, 9) ==
+                        [(0, 0, 1, 2), (5, 0, 9, 2),
+                         (0, 6, 1, 9), (5, 6, 9, 9)])
+        self.assertTrue(coverage.paint(3, 1, 6, 8) == [])
+
+        # The bands drawn alike are merged back
+        self.assertTrue(coverage._tops == [0])
+
+    def test_visible_rects(self):
+        # A frame of nested rectangles only draws the visible rings
+        rects = [(level, level, 99 - level, 99 - level, 'ABCD'[level % 4])
+                 for level in range(50)]
+        visible = visible_rects(rects)
+        self.assertTrue(sum((right - left + 1) * (bottom - top + 1)
+                            for left, top, right, bottom, _ in visible)
+                        == 100 * 100)
+
+        # Fully overwritten rectangles are dropped
+        rects = [(0, 0, 3, 3, 'A'), (1, 1, 2, 2, 'B'), (0, 0, 3, 3, 'C')]
+        self.assertTrue(visible_rects(rects) == [(0, 0, 3, 3, 'C')])
+
+        with self.assertRaises(ValueError):
+            to_rect(('Q', 1, 1, 'A'))
+
+
+class TestImageStore(ut.TestCase):
+    """ Test case for the memory bounded store of images """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_spill_and_restore(self):
+        storages = [TextImage, RowMajorTextImage, CompactTextImage,
+                    TiledTextImage, RunLengthTextImage]
+        if numpy is not None:
+            storages.append(NumpyTextImage)
+
+        filename = os.path.join(self.directory.name, 'spilled.txi')
+        for storage in storages:
+            image = storage(cols=6, rows=4)
+            image.journal = Journal()
+            image.key_in_rect(1, 1, 3, 2, 'K')
+            image.lay_value_at(5, 3, 'L')
+            expected = image.image_2_str()
+            self.assertTrue(image.memory_size() > 0)
+
+            image.spill(filename)
+            self.assertTrue(image.image is None)
+            self.assertFalse(image.is_image_set())
+            image.restore(filename)
+            self.assertTrue(image.image_2_str() == expected)
+
+            # The restore is not an edit, so the edits are still undone
+            self.assertTrue(image.undo())
+            self.assertTrue(image.undo())
+            self.assertTrue(image.image_2_str() == 'OOOOOO\n' * 4)
+
+    def test_eviction(self):
+        image = CompactTextImage(cols=100, rows=100)
+        store = ImageStore(lambda: CompactTextImage(cols=100, rows=100),
+                           int(image.memory_size() * 2.5),
+                           self.directory.name)
+
+        for key in 'abc':
+            store.acquire(key).lay_value_at(0, 0, key.upper())
+            store.release(key)
+        self.assertTrue(store.misses == 3 and store.hits == 0)
+        self.assertTrue(store.evictions == 1)
+        self.assertTrue(store.size <= store.budget)
+        self.assertTrue(len(os.listdir(self.directory.name)) == 1)
+
+        # The least recently used image was spilled and is restored
+        self.assertTrue(store.acquire('a')._get_cell(0, 0) == 'A')
+        store.release('a')
+        self.assertTrue(store.misses == 4 and store.evictions == 2)
+
+        # An image in use is not spilled, so 'c' goes instead of 'a'
+        store.acquire('a')
+        store.acquire('c')
+        store.release('c')
+        store.acquire('b')
+        store.release('b')
+        self.assertTrue(store.hits == 2 and store.evictions == 3)
+        self.assertTrue(store.size <= store.budget)
+        store.release('a')
+        self.assertTrue(store.acquire('c')._get_cell(0, 0) == 'C')
+        store.release('c')
+        self.assertTrue(store.misses == 6)
+
+        store.close()
+        self.assertTrue(len(store) == 0 and store.size == 0)
+        self.assertTrue(os.listdir(self.directory.name) == [])
+
+    def test_spilled_journal(self):
+        def factory():
+            image = CompactTextImage(cols=100, rows=100)
+            image.journal = Journal()
+            return image
+
+        store = ImageStore(factory, 20000, self.directory.name)
+        image = store.acquire('a')
+        for col in range(0, 100, 2):
+            image.vertical_values(col, 0, 99, 'A')
+        store.release('a')
+
+        # The undo history counts in the budget, so 'b' doesn't fit along
+        # with 'a', which is spilled along with its undo history
+        self.assertTrue(image.journal.size > 0)
+        self.assertTrue(store.size == image.memory_size() +
+                        image.journal.size)
+        store.acquire('b')
+        store.release('b')
+        self.assertTrue(store.evictions == 1 and image.journal.size == 0)
+        self.assertTrue(sorted(os.listdir(self.directory.name)) ==
+                        ['1.txi', '1.txi.undo'])
+
+        image = store.acquire('a')
+        self.assertTrue(image.journal.size > 0)
+        self.assertTrue(image.undo())
+        self.assertTrue(image._get_cell(98, 0) == 'O')
+        self.assertTrue(image._get_cell(96, 0) == 'A')
+        store.release('a')
+        store.close()
+
+    def test_failed_spill(self):
+        def factory():
+            image = CompactTextImage(cols=100, rows=100)
+            image.journal = Journal()
+            return image
+
+        def fail(filename):
+            raise OSError
+
+        store = ImageStore(factory, 20000, self.directory.name)
+        image = store.acquire('a')
+        image.lay_value_at(0, 0, 'A')
+        image.journal.spill = fail
+        store.release('a')
+        size = store.size
+
+        # The cells are brought back when the undo history can't be spilled
+        other = store.acquire('b')
+        with self.assertRaises(OSError):
+            store.release('b')
+        self.assertTrue(store.size == size + other.memory_size())
+        self.assertTrue(image._get_cell(0, 0) == 'A')
+        self.assertTrue(image.journal.size > 0)
+        self.assertTrue(os.listdir(self.directory.name) == [])
+
+        # An image discarded while spilled is not counted again
+        def discard(filename):
+            thread = threading.Thread(target=store.discard, args=('a',))
+            thread.start()
+            while 'a' in store:
+                pass
+            raise OSError
+
+        image.journal.spill = discard
+        store.acquire('b')
+        with self.assertRaises(OSError):
+            store.release('b')
+        self.assertTrue('a' not in store)
+        self.assertTrue(store.size == other.memory_size())
+        store.close()
+
+    def test_concurrent_use(self):
+        store = ImageStore(lambda: CompactTextImage(cols=50, rows=50),
+                           6000, self.directory.name)
+
+        def use(key):
+            for turn in range(20):
+                image = store.acquire(key)
+                self.assertTrue(image._get_cell(0, 0) ==
+                                (key if turn else 'O'))
+                image.lay_value_at(0, 0, key)
+                store.release(key)
+
+        threads = [threading.Thread(target=use, args=(key,))
+                   for key in 'ABCDEF']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(store.hits + store.misses == 120)
+        self.assertTrue(store.size <= store.budget)
+        self.assertTrue(len(os.listdir(self.directory.name)) ==
+                        len(store) - len(store._recent))
+        store.close()
+
+
+class TestServer(ut.TestCase):
+    """ Test case for the sessions served over sockets """
+
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.data_dir.cleanup()
+
+    def serve(self, session, budget=1 << 20, max_cells=1 << 20):
+        """ Runs a coroutine with a server listening on a free port """
+        async def run():
+            server = ImageServer(workers=2, budget=budget,
+                                 data_dir=self.data_dir.name,
+                                 max_cells=max_cells)
+            listener = await server.start(port=0)
+            port = listener.sockets[0].getsockname()[1]
+            try:
+                return await session(server, port)
+            finally:
+                listener.close()
+                await listener.wait_closed()
+                server.close()
+
+        return asyncio.run(run())
+
+    def test_session(self):
+        async def session(server, port):
+            client = await ImageClient.connect('127.0.0.1', port)
+            self.assertTrue(await client.send('I 5 3') == '')
+            await client.send('L 2 2 A')
+            self.assertTrue(await client.send('P') == 'OOOOO\nOAOOO\nOOOOO\n')
+
+            await client.send('F 1 1 B')
+            await client.send('U')
+            self.assertTrue(await client.send('P') == 'OOOOO\nOAOOO\nOOOOO\n')
+            self.assertTrue(await client.send('P 2 1 3 2') == 'OO\nAO\n')
+            self.assertTrue(await client.send('W 3 3') == (
+                '-- 1 1 3 3 --\nOOO\nOAO\nOOO\n'
+                '-- 4 1 5 3 --\nOO\nOO\nOO\n'))
+
+            with self.assertRaises(ServerError) as raised:
+                await client.send('P 2 1 6 2')
+            self.assertTrue(raised.exception.error_type == 'bounds')
+            with self.assertRaises(ServerError) as raised:
+                await client.send('L 9 9 A')
+            self.assertTrue(raised.exception.error_type == 'bounds')
+            with self.assertRaises(ServerError) as raised:
+                await client.send('Q')
+            self.assertTrue(raised.exception.error_type == 'command')
+
+            self.assertTrue((await client.send('T')).startswith('command'))
+            await client.close()
+
+        self.serve(session)
+
+    def test_max_cells(self):
+        async def session(server, port):
+            client = await ImageClient.connect('127.0.0.1', port)
+            await client.send('I 10 10')
+            await client.send('L 1 1 A')
+
+            # A larger image is rejected, and the session keeps its image
+            with self.assertRaises(ServerError) as raised:
+                await client.send('I 11 10')
+            self.assertTrue(raised.exception.error_type == 'size')
+            self.assertTrue((await client.send('P')).startswith('AOO'))
+
+            self.assertTrue(await client.send('I 0 1000') == '')
+            await client.close()
+
+        self.serve(session, max_cells=100)
+
+    def test_data_dir(self):
+        async def session(server, port):
+            self.assertTrue(server.data_dir ==
+                            os.path.realpath(self.data_dir.name))
+            client = await ImageClient.connect('127.0.0.1', port)
+            await client.send('I 3 1')
+            await client.send('S one.bmp')
+            await client.send('L 1 1 A')
+            await client.send('O one.bmp')
+            self.assertTrue(await client.send('P') == 'OOO\n')
+
+            outside = os.path.join(os.path.dirname(self.data_dir.name),
+                                   'two.bmp')
+            for filename in [outside, '../two.bmp', 'sub/../../two.bmp']:
+                for command in 'SBO':
+                    with self.assertRaises(ServerError) as raised:
+                        await client.send('%s %s' % (command, filename))
+                    self.assertTrue(raised.exception.error_type == 'filename')
+            await client.close()
+
+        self.serve(session)
+        self.assertTrue(os.listdir(self.data_dir.name) == ['one.bmp'])
+
+    def test_concurrent_sessions(self):
+        async def session(server, port):
+            async def draw(value):
+                client = await ImageClient.connect('127.0.0.1', port)
+                await client.send('I 4 2')
+                await client.send('F 1 1 %s' % value)
+                image = await client.send('P')
+                await client.close()
+                return image
+
+            images = await asyncio.gather(*[draw(value) for value in 'ABC'])
+            self.assertTrue(images == ['AAAA\nAAAA\n', 'BBBB\nBBBB\n',
+                                       'CCCC\nCCCC\n'])
+
+        self.serve(session)
+
+    def test_spilled_sessions(self):
+        async def session(server, port):
+            clients = []
+            for value in 'ABC':
+                client = await ImageClient.connect('127.0.0.1', port)
+                await client.send('I 50 50')
+                await client.send('L 1 1 %s' % value)
+                clients.append(client)
+            self.assertTrue(server.store.evictions >= 2)
+
+            for client, value in zip(clients, 'ABC'):
+                image = await client.send('P')
+                self.assertTrue(image[0] == value)
+                await client.send('U')
+                self.assertTrue((await client.send('P'))[0] == 'O')
+
+            stats = await clients[0].send('T')
+            self.assertTrue(stats.split('\n')[-2].startswith('store:'))
+            for client in clients:
+                await client.close()
+
+        # The budget only fits one image, the others are spilled
+        self.serve(session, budget=3000)
+
+    def test_run_lines(self):
+        async def session(server, port):
+            client = await ImageClient.connect('127.0.0.1', port)
+            output, errors = io.StringIO(), io.StringIO()
+            failed = await run_lines(client, ['I 3 1', '', 'L 5 5 A',
+                                              'H 1 3 1 Z', 'P', 'X', 'P'],
+                                     output, errors)
+            await client.close()
+            return failed, output.getvalue(), errors.getvalue()
+
+        failed, output, errors = self.serve(session)
+        self.assertTrue(failed == 1)
+        self.assertTrue(output == 'ZZZ\n')
+        self.assertTrue(errors == 'line 3: INVALID IMAGE BOUNDS\n')
+
 
 if __name__ == '__main__':
     ut.main()
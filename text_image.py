@@ -7,6 +7,60 @@ Any manipulation will need a image matrix, so holding an object to attach
 operations to a matrix reference will simplify coding and avoid bad practices
 such as globals variables declarations.
 """
+import os
+import sys
+import uuid
+import binary_format
+from batch import to_rect, visible_rects
+from region_index import find_component
+
+#
+# Buffer size of the files written by the image
+BUFFER_SIZE = 1 << 20
+
+
+def file_signature(filename):
+    """ Gets what identifies a version of a file, if it exists
+
+    Args:
+        filename (str): name of the file
+
+    Returns:
+        tuple: the inode, size and modification time of the file, or None
+            if the file does not exist
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def split_lines(data):
+    """ Splits the content of a saved image file in its rows
+
+    Args:
+        data (bytes): content of the file, encoded as UTF-8
+
+    Returns:
+        tuple: the number of columns and the list of rows, as strings
+
+    Raises:
+        ValueError: The content is not valid UTF-8 or its rows have
+            different widths
+    """
+    lines = data.decode('utf8').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+
+    if not lines:
+        return 0, lines
+
+    if not lines[0] or len(set(map(len, lines))) != 1:
+        raise ValueError
+
+    return len(lines[0]), lines
 
 
 class TextImage(object):
@@ -36,13 +90,36 @@ class TextImage(object):
         cols (int): number of columns to instantiate a empty image
         rows (int): number of rows to instantiate a empty image
 
+    The image attribute may be replaced by another matrix at any time, but
+    its cells should only be changed through the methods, which keep the
+    rendered rows, the saving state and the region index up to date. After
+    changing them in place, call touch before using the image again.
+
     Attributes:
         image (list(list)): a 2d list (matrix) representing the image
         cols (int): number of columns of the image matrix
         rows (int): number of rows of the image matrix
+        journal (Journal): journal that records the edits for undo and
+            redo, or None to not record them
+        regions (RegionIndex): index of the 'O' regions used to fill them
+            and count their cells, or None to search them every time
 
     """
 
+    journal = None
+    regions = None
+
+    #
+    # Rendered rows, rows changed since the last save and the last saved
+    # file, kept by the edit bookkeeping below for the tracked image
+    _row_cache = None
+    _unsaved = None
+    _saved = None
+    _tracked = None
+    _checked = None
+    _checked_size = None
+    _valid = False
+
     def __init__(self, image=[], cols=0, rows=0):
 
         #
@@ -62,30 +139,63 @@ class TextImage(object):
     def is_image_set(self):
         """Check if the class attribute image is setted with values
 
-        If there is not an emtpy image, if flags to true. False, otherwise
+        If there is not an emtpy image, if flags to true. False, otherwise.
+        The flag is kept until the image attribute is replaced or its
+        number of columns, or rows of the first column, changes, so the
+        columns are only checked once per image. Any other change in place
+        must be followed by a call to touch.
 
         Returns:
             bool: flag of emtpy image attribute
         """
-        if not self.image:
-            return False
+        image = self.image
+        size = (len(image), len(image[0])) if image else None
+        if self._checked is not image or self._checked_size != size:
+            self._valid = bool(image) and all(image)
+            self._checked = image
+            self._checked_size = size
+
+        return self._valid
+
+    def touch(self):
+        """ Tells the image that its cells were changed in place, out of the
+        methods, so everything kept about them is dropped
 
-        if self.image:
-            return all(self.image)
+        The change is not recorded in the journal.
+        """
+        if self.regions is not None:
+            self.regions.clear()
+
+        self._tracked = None
+        self._checked = None
 
     def initialize_matrix(self, cols, rows):
         """ (Re)Initialize the image attribute with an empty matrix
 
+        A non positive dimension leaves an empty image, with no cells.
+
         Args:
             cols (int): number of columns to instantiate a empty image
             rows (int): number of rows to instantiate a empty image
         """
+        if cols <= 0 or rows <= 0:
+            cols = rows = 0
+
+        # A failed allocation leaves the image and its history as they were
+        checkpoint = self.journal.checkpoint() \
+            if self.journal is not None else None
+        previous = getattr(self, 'cols', 0), getattr(self, 'rows', 0), \
+            self._stale
+        self._replace()
         self.cols = cols
         self.rows = rows
-        self.image = []
-        for _ in range(cols):
-            row = ['O' for _ in range(rows)]
-            self.image.append(row)
+        try:
+            self._allocate(cols, rows)
+        except Exception:
+            self.cols, self.rows, self._stale = previous
+            if checkpoint is not None:
+                self.journal.rollback(checkpoint)
+            raise
 
     def clear_matrix(self):
         """ Set the image matrix to a zero valued ('O') attribute
@@ -98,9 +208,8 @@ class TextImage(object):
         if not self.is_image_set():
             raise AttributeError
 
-        for i in range(self.cols):
-            for j in range(self.rows):
-                self.image[i][j] = 'O'
+        self._edit(0, 0, self.cols-1, self.rows-1)
+        self._clear()
 
     def lay_value_at(self, col, row, value):
         """ Input a value in a matrix position
@@ -112,15 +221,13 @@ class TextImage(object):
         Raises:
             AttributeError: The operation is not possible due to an empty
                 image of the class
+            ValueError: The value can't be held by the storage
         """
 
-        if not self.is_image_set():
-            raise AttributeError
-
-        if not self.check_bounds(col, row):
-            raise IndexError
-
-        self.image[col][row] = value
+        self._validate(col, row, col, row)
+        self._check_value(value)
+        self._edit(col, row, col, row, value)
+        self._set_cell(col, row, value)
 
     def vertical_values(self, col, row_up, row_down, value):
         """ Insert a vertical line of values from a row to another
@@ -135,25 +242,13 @@ class TextImage(object):
                 image of the class
             IndexError: The operation is not possible due invalid indexes
                 or intervals (row_down less than or equal to row_up)
+            ValueError: The value can't be held by the storage
         """
 
-        if not self.is_image_set():
-            raise AttributeError
-
-        if row_up > row_down:
-            raise IndexError
-
-        if not self.check_horizontal_bounds(col):
-            raise IndexError
-
-        if not self.check_vertical_bounds(row_up):
-            raise IndexError
-
-        if not self.check_vertical_bounds(row_down):
-            raise IndexError
-
-        for pos in range(row_up, row_down+1):
-            self.image[col][pos] = value
+        self._validate(col, row_up, col, row_down)
+        self._check_value(value)
+        self._edit(col, row_up, col, row_down, value)
+        self._set_vertical(col, row_up, row_down, value)
 
     def horizontal_values(self, col_left, col_right, row, value):
         """ Insert a horizontal line of values from a column to another
@@ -168,25 +263,13 @@ class TextImage(object):
                 image of the class
             IndexError: The operation is not possible due invalid indexes
                 or intervals (col_right less than or equal to col_left)
+            ValueError: The value can't be held by the storage
         """
 
-        if not self.is_image_set():
-            raise AttributeError
-
-        if col_left > col_right:
-            raise IndexError
-
-        if not self.check_horizontal_bounds(col_left):
-            raise IndexError
-
-        if not self.check_horizontal_bounds(col_right):
-            raise IndexError
-
-        if not self.check_vertical_bounds(row):
-            raise IndexError
-
-        for pos in range(col_left, col_right+1):
-            self.image[pos][row] = value
+        self._validate(col_left, row, col_right, row)
+        self._check_value(value)
+        self._edit(col_left, row, col_right, row, value)
+        self._set_horizontal(col_left, col_right, row, value)
 
     def key_in_rect(self, col_top, row_top, col_bottom, row_bottom, value):
         """ Insert a rectangle from top-left to bottom-right positions
@@ -203,30 +286,208 @@ class TextImage(object):
                 image of the class
             IndexError: The operation is not possible due invalid indexes
                 or intervals (row_down less than or equal to row_up)
+            ValueError: The value can't be held by the storage
         """
 
+        self._validate(col_top, row_top, col_bottom, row_bottom)
+        self._check_value(value)
+        self._edit(col_top, row_top, col_bottom, row_bottom, value)
+        self._set_rect(col_top, row_top, col_bottom, row_bottom, value)
+
+    def draw_batch(self, operations):
+        """ Draws a batch of L, V, H and K operations as a single edit
+
+        The whole batch is checked before any cell is drawn, so an invalid
+        operation leaves the image untouched. The parts of the operations
+        overwritten by later ones in the batch are dropped, and each
+        remaining part is drawn with the kernel of its shape.
+
+        Args:
+            operations (iterable(tuple)): the operations, each one its
+                command letter followed by the arguments of its method, such
+                as ('K', col_top, row_top, col_bottom, row_bottom, value)
+
+        Returns:
+            int: number of cells drawn
+
+        Raises:
+            AttributeError: The operation is not possible due to an empty
+                image of the class
+            IndexError: The operation is not possible due invalid indexes
+                or intervals in some operation
+            ValueError: Some operation is not L, V, H or K, has a wrong
+                number of arguments or a value the storage can't hold
+        """
         if not self.is_image_set():
             raise AttributeError
 
-        if col_top > col_bottom:
-            raise IndexError
+        rects = [to_rect(operation) for operation in operations]
+        for rect in rects:
+            self._validate(*rect[:4])
+
+        for value in set(rect[4] for rect in rects):
+            self._check_value(value)
+
+        drawn = 0
+        new = True
+        for col_top, row_top, col_bottom, row_bottom, value in \
+                visible_rects(rects):
+            self._edit(col_top, row_top, col_bottom, row_bottom, value, new)
+            new = False
+
+            if row_top == row_bottom:
+                if col_top == col_bottom:
+                    self._set_cell(col_top, row_top, value)
+                else:
+                    self._set_horizontal(col_top, col_bottom, row_top, value)
+            elif col_top == col_bottom:
+                self._set_vertical(col_top, row_top, row_bottom, value)
+            else:
+                self._set_rect(col_top, row_top, col_bottom, row_bottom,
+                               value)
+
+            drawn += (col_bottom - col_top + 1) * (row_bottom - row_top + 1)
+
+        return drawn
+
+    def copy_region(self, col_top, row_top, col_bottom, row_bottom, col, row,
+                    source=None):
+        """ Copies a rectangle of cells to the rectangle with top-left
+        corner (col, row)
+
+        The cells are copied a row segment at a time. Within the same image,
+        the rows are copied in the order that reads each source row before
+        it's overwritten, as memmove does, so overlapping rectangles are
+        copied as if through a buffer.
 
-        if row_top > row_bottom:
-            raise IndexError
+        Args:
+            col_top (int): Top horizontal position of the source rectangle
+            row_top (int): Top vertical position of the source rectangle
+            col_bottom (int): Bottom horizontal position of the source
+                rectangle
+            row_bottom (int): Bottom vertical position of the source
+                rectangle
+            col (int): Top horizontal position of the copy
+            row (int): Top vertical position of the copy
+            source (TextImage): image the cells are copied from, this one
+                by default
 
-        if not self.check_bounds(col_top, row_top):
-            raise IndexError
+        Raises:
+            AttributeError: The operation is not possible due to an empty
+                image of the class
+            IndexError: The operation is not possible due invalid indexes
+                or intervals of either rectangle
+            ValueError: Some value of the source can't be stored in this
+                image
+        """
+        source = self if source is None else source
+        segments = self._check_copy(col_top, row_top, col_bottom, row_bottom,
+                                    col, row, source)
 
-        if not self.check_bounds(col_bottom, row_bottom):
-            raise IndexError
+        self._edit(col, row, col + col_bottom - col_top,
+                   row + row_bottom - row_top)
+        self._copy_rows(col_top, row_top, col_bottom, row_bottom, col, row,
+                        segments)
 
-        for col in range(col_top, col_bottom+1):
-            for row in range(row_top, row_bottom+1):
-                self.image[col][row] = value
+    def move_region(self, col_top, row_top, col_bottom, row_bottom, col, row,
+                    source=None):
+        """ Moves a rectangle of cells to the rectangle with top-left corner
+        (col, row), leaving 'O' cells behind
+
+        The cells are copied as copy_region does, then the source cells out
+        of the copy are set to 'O'. Within the same image, both are a single
+        edit. From another image, the source is cleared by an edit of its own.
+
+        Args:
+            col_top (int): Top horizontal position of the source rectangle
+            row_top (int): Top vertical position of the source rectangle
+            col_bottom (int): Bottom horizontal position of the source
+                rectangle
+            row_bottom (int): Bottom vertical position of the source
+                rectangle
+            col (int): Top horizontal position of the moved cells
+            row (int): Top vertical position of the moved cells
+            source (TextImage): image the cells are moved from, this one by
+                default
+
+        Raises:
+            AttributeError: The operation is not possible due to an empty
+                image of the class
+            IndexError: The operation is not possible due invalid indexes
+                or intervals of either rectangle
+            ValueError: Some value of the source can't be stored in this
+                image
+        """
+        source = self if source is None else source
+        segments = self._check_copy(col_top, row_top, col_bottom, row_bottom,
+                                    col, row, source)
+        target = (col, row, col + col_bottom - col_top,
+                  row + row_bottom - row_top)
+
+        # The source cells left behind are the source rectangle minus the
+        # copy, if they are in the same image
+        cleared = [(col_top, row_top, col_bottom, row_bottom, 'O')]
+        if source is self:
+            cleared = [rect for rect in visible_rects(cleared +
+                                                      [target + (None,)])
+                       if rect[4] == 'O']
+
+        self._edit(*target)
+        for rect in cleared:
+            source._edit(*rect, new=source is not self)
+
+        self._copy_rows(col_top, row_top, col_bottom, row_bottom, col, row,
+                        segments)
+        for rect in cleared:
+            source._set_rect(*rect)
+
+    def _check_copy(self, col_top, row_top, col_bottom, row_bottom, col, row,
+                    source):
+        """ Checks both rectangles of a copy before any cell is changed
+
+        Returns:
+            list: the source segments converted to this storage, read ahead
+                since converting them may fail, or None if the source is
+                this image, whose segments are read as they are copied
+        """
+        source._validate(col_top, row_top, col_bottom, row_bottom)
+        self._validate(col, row, col + col_bottom - col_top,
+                       row + row_bottom - row_top)
+
+        if source is self:
+            return None
+
+        return [self._convert_segment(source._read_segment(line, col_top,
+                                                           col_bottom))
+                for line in range(row_top, row_bottom+1)]
+
+    def _copy_rows(self, col_top, row_top, col_bottom, row_bottom, col, row,
+                   segments):
+        """ Writes the rows of a copy checked by _check_copy """
+        if segments is not None:
+            for line, segment in enumerate(segments, row):
+                self._write_segment(line, col, segment)
+            return
+
+        # Copying down, the last rows must be read before they are
+        # overwritten, so the rows are copied from the bottom up
+        lines = range(row_top, row_bottom+1)
+        if row > row_top:
+            lines = reversed(lines)
+
+        for line in lines:
+            self._write_segment(line + row - row_top, col,
+                                self._read_segment(line, col_top, col_bottom))
 
     def fill_region(self, col, row, value):
         """ Fills an empty ('O' valued) region of the image
 
+        The region is filled one horizontal run of 'O' cells at a time. The
+        runs touching a filled run on the rows above and below are kept in
+        an explicit stack, so the fill does not depend on the interpreter
+        recursion limit and its memory is bounded by the pending runs, not
+        by the region size.
+
         Args:
             col (int): Initial horizontal position of the fill
             row (int): Initial vertical position of the fill
@@ -237,30 +498,114 @@ class TextImage(object):
                 image of the class
             IndexError: The operation is not possible due invalid indexes
                 or intervals (row_down less than or equal to row_up)
+            ValueError: The value can't be held by the storage
         """
 
-        if not self.is_image_set():
-            raise AttributeError
+        self._validate(col, row, col, row)
+        self._check_value(value)
 
-        if not self.check_bounds(col, row):
-            raise IndexError
+        # Filling with 'O' would leave the region as it is
+        if value == 'O' or self._get_cell(col, row) != 'O':
+            return
 
-        if self.image[col][row] != 'O':
+        # An indexed region is recolored by its runs, without searching it
+        if self.regions is not None:
+            component = self.regions.component(self, col, row)
+            self.regions.discard(component)
+            new = True
+            for row, left, right in component.spans:
+                self._edit(left, row, right, row, value, new)
+                self._set_horizontal(left, right, row, value)
+                new = False
             return
 
-        self.image[col][row] = value
+        new = True
+        stack = [(row, left, right)
+                 for left, right in self._zero_runs(row, col, col)]
+
+        while stack:
+            row, left, right = stack.pop()
 
-        if col > 0:
-            self.fill_region(col-1, row, value)
+            # The same run may be pushed by its upper and lower neighbors,
+            # so it may be already filled
+            if self._get_cell(left, row) != 'O':
+                continue
 
-        if row > 0:
-            self.fill_region(col, row-1, value)
+            # All the filled runs are part of the same edit
+            self._edit(left, row, right, row, value, new)
+            self._set_horizontal(left, right, row, value)
+            new = False
 
-        if col < self.cols - 1:
-            self.fill_region(col+1, row, value)
+            for next_row in (row - 1, row + 1):
+                if 0 <= next_row < self.rows:
+                    for run in self._zero_runs(next_row, left, right):
+                        stack.append((next_row,) + run)
 
-        if row < self.rows - 1:
-            self.fill_region(col, row+1, value)
+    def region_size(self, col, row):
+        """ Counts the cells of the empty ('O' valued) region holding a cell
+
+        Args:
+            col (int): Horizontal position of the cell
+            row (int): Vertical position of the cell
+
+        Returns:
+            int: number of cells of the region, or zero if the cell is not 'O'
+
+        Raises:
+            AttributeError: The operation is not possible due to an empty
+                image of the class
+            IndexError: The operation is not possible due invalid indexes
+        """
+
+        self._validate(col, row, col, row)
+
+        if self.regions is not None:
+            component = self.regions.component(self, col, row)
+        elif self._get_cell(col, row) == 'O':
+            component = find_component(self, col, row)
+        else:
+            component = None
+
+        return component.size if component is not None else 0
+
+    def undo(self):
+        """ Undoes the last edit recorded in the journal
+
+        Returns:
+            bool: False if there is no journal or no edit to undo
+        """
+        if self.journal is None:
+            return False
+
+        return self.journal.undo(self)
+
+    def redo(self):
+        """ Redoes the last edit undone from the journal
+
+        Returns:
+            bool: False if there is no journal or no edit to redo
+        """
+        if self.journal is None:
+            return False
+
+        return self.journal.redo(self)
+
+    def _validate(self, col_top, row_top, col_bottom, row_bottom):
+        """ Checks a rectangle of cells before it's passed to the kernels
+
+        This is the only check of the public methods, a single call instead
+        of a check per position, so the kernels never check again.
+
+        Raises:
+            AttributeError: The image is empty
+            IndexError: The rectangle is inverted or out of the image bounds
+        """
+        if not self.is_image_set():
+            raise AttributeError
+
+        if not (0 <= col_top <= col_bottom < self.cols and
+                0 <= row_top <= row_bottom < self.rows):
+            raise IndexError
 
     def check_bounds(self, col, row):
         """ Checks if the given position is in the image bounds
@@ -316,32 +661,582 @@ class TextImage(object):
         """
         if not self.is_image_set():
             return ''
-        output = []
 
-        for j in range(self.rows):
-            out = ''
-            for i in range(self.cols):
-                out += self.image[i][j]
-            out += '\n'
-            output.append(out)
+        # Only the rows changed since the last call are rendered again
+        self._track()
+        cache = self._row_cache
+        if cache is None:
+            cache = self._row_cache = [None] * self.rows
+
+        if None in cache:
+            for row, line in enumerate(cache):
+                if line is None:
+                    cache[row] = self._row_str(row)
+
+        cache.append('')
+        output = '\n'.join(cache)
+        cache.pop()
+
+        return output
+
+    def window_2_str(self, col_top, row_top, col_bottom, row_bottom):
+        """ Format a rectangle of the image matrix to a human readable format
+
+        Only the cells of the rectangle are read, so its cost follows the
+        rectangle size, not the image size.
+
+        Args:
+            col_top (int): Top horizontal position of the rectangle
+            row_top (int): Top vertical position of the rectangle
+            col_bottom (int): Bottom horizontal position of the rectangle
+            row_bottom (int): Bottom vertical position of the rectangle
+        Returns:
+            str: Human readable format of the rectangle
+        """
+        self._validate(col_top, row_top, col_bottom, row_bottom)
+
+        lines = [self._segment_str(row, col_top, col_bottom)
+                 for row in range(row_top, row_bottom+1)]
+        lines.append('')
+
+        return '\n'.join(lines)
+
+    def pages(self, width, height):
+        """ Split the image matrix in windows of up to width x height cells,
+        from left to right and top to bottom
 
-        return ''.join(output)
+        Each window is formatted only when the generator gets to it, so the
+        whole image is never held as a single string.
+
+        Args:
+            width (int): Number of columns of each window
+            height (int): Number of rows of each window
+        Yields:
+            tuple: the (col_top, row_top, col_bottom, row_bottom) bounds of
+                the window and its human readable format
+        """
+        if not self.is_image_set():
+            raise AttributeError
+
+        if width <= 0 or height <= 0:
+            raise ValueError
+
+        for row_top in range(0, self.rows, height):
+            row_bottom = min(row_top + height, self.rows) - 1
+            for col_top in range(0, self.cols, width):
+                col_bottom = min(col_top + width, self.cols) - 1
+                bounds = (col_top, row_top, col_bottom, row_bottom)
+                yield bounds, self.window_2_str(*bounds)
 
     def save_matrix(self, filename):
         """ Saves the string representation of the image matrix to a file
 
+        The rows are streamed to a temporary file that replaces filename
+        when complete, so a failed save never leaves a truncated file.
+
+        Saving again to the same file, if it wasn't changed by anyone else,
+        only rewrites the rows changed since the last save. Those rows are
+        rendered before the file is opened, so a failed rendering leaves the
+        file untouched.
+
+        Args:
+            filename (str): filename to be used in the saving
+
+        Raises:
+            OSError: The operation was not possible due some system related,
+            error such as permissions, full disk, invalid filename and so on
+        """
+
+        self._track()
+        if self._rewrite_rows(filename):
+            return
+
+        self._saved = None
+        fixed_width = self._write_file(filename, self.write_matrix)
+
+        # Rows can only be rewritten in place if all have the same length
+        if fixed_width:
+            self._unsaved = bytearray(self.rows)
+            self._saved = (os.path.abspath(filename),
+                           file_signature(filename))
+
+    def save_binary(self, filename, compression='zlib'):
+        """ Saves the image matrix to a file in the binary format
+
+        The file holds the image size, its palette of values and the cells
+        as palette indexes, compressed as given. Like save_matrix, it
+        replaces filename only when complete. load_matrix loads both
+        formats.
+
         Args:
             filename (str): filename to be used in the saving
+            compression (str): how the cells are compressed: 'none', 'rle'
+                or 'zlib'
+
+        Raises:
+            OSError: The operation was not possible due some system related,
+            error such as permissions, full disk, invalid filename and so on
+            ValueError: The compression is unknown, some value is not a
+            single character or the image has more than 256 values
+        """
+        cols = rows = 0
+        cells = ''
+        if self.is_image_set():
+            cols = self.cols
+            rows = self.rows
+            cells = ''.join([self._row_str(row) for row in range(rows)])
+
+        data = binary_format.encode(cols, rows, cells, compression)
+        self._write_file(filename, lambda f: f.write(data))
+
+    def _write_file(self, filename, write):
+        """ Writes a file through a temporary file that replaces it only
+        after a complete write
+
+        Args:
+            filename (str): filename to be written
+            write (function): called with the temporary file, opened for
+                binary writing
+
+        Returns:
+            the value returned by write
+
+        Raises:
+            OSError: The operation was not possible due some system related,
+            error such as permissions, full disk, invalid filename and so on
+        """
+
+        # The temporary file is in the same directory, so it's renamed over
+        # filename without copying
+        temp = '%s.%s.tmp' % (filename, uuid.uuid4().hex[:8])
+
+        try:
+            with open(temp, 'xb', buffering=BUFFER_SIZE) as f:
+                result = write(f)
+            os.replace(temp, filename)
+        except Exception as error:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            if isinstance(error, OSError):
+                raise
+            raise OSError(error)
+
+        return result
+
+    def _rewrite_rows(self, filename):
+        """ Rewrites in place the rows changed since the last save
+
+        Returns:
+            bool: False if the rows can't be rewritten in place, because
+            filename is not the last saved file, it was changed since then
+            or most of the rows changed
+
+        Raises:
+            OSError: The operation was not possible due some system related,
+            error such as permissions, full disk, invalid filename and so on
+        """
+        saved = self._saved
+        unsaved = self._unsaved
+        if saved is None or unsaved is None:
+            return False
+
+        if saved != (os.path.abspath(filename), file_signature(filename)):
+            return False
+
+        if unsaved.count(1) * 2 > self.rows:
+            return False
+
+        # The changed rows are rendered before the file is touched
+        rows = []
+        row = unsaved.find(1)
+        while row != -1:
+            data = bytes(self._row_bytes(row))
+            if len(data) != self.cols:
+                return False
+            rows.append((row, data))
+            row = unsaved.find(1, row + 1)
+
+        self._saved = None
+        stride = self.cols + 1
+        try:
+            with open(filename, 'r+b', buffering=BUFFER_SIZE) as f:
+                last = -2
+                for row, data in rows:
+                    if row != last + 1:
+                        f.seek(row * stride)
+                    f.write(data + b'\n')
+                    last = row
+        except Exception as error:
+            if isinstance(error, OSError):
+                raise
+            raise OSError(error)
+
+        self._unsaved = bytearray(self.rows)
+        self._saved = (os.path.abspath(filename), file_signature(filename))
+        return True
+
+    def load_matrix(self, filename):
+        """ Loads the image matrix from a file written by save_matrix
+
+        The file is read at once and its rows are checked and converted to
+        the storage in bulk, instead of cell by cell. A file that is not a
+        saved image leaves the image as it is. Files written by save_binary
+        are loaded as well.
+
+        Args:
+            filename (str): filename of the saved image
+
+        Raises:
+            OSError: The file can't be read due some system related error,
+            such as permissions, missing file and so on
+            ValueError: The file is not a saved image, since its rows have
+            different widths or values the storage can't hold
+        """
+        cols, rows, image = self._read_file(filename)
+        self._replace()
+        self.cols = cols
+        self.rows = rows
+        self._assign(image)
+
+    def spill(self, filename):
+        """ Moves the cells of the image to a file, releasing their memory
+
+        The cells are saved in the binary format, or as text if they have
+        too many distinct values for it. Until restore is called with the
+        same file, the image has no cells and must not be used. Its size
+        and journal are kept, and its region index is dropped.
+
+        Args:
+            filename (str): filename of the spilled cells
 
         Raises:
             OSError: The operation was not possible due some system related,
             error such as permissions, full disk, invalid filename and so on
         """
         try:
-            with open(filename, 'w') as f:
-                f.write(str(self))
-        except:
-            raise OSError
+            self.save_binary(filename)
+        except ValueError:
+            self.save_matrix(filename)
+
+        # Nothing may keep a reference to the cells, or they would stay in
+        # memory
+        self.image = None
+        self._track()
+        self.is_image_set()
+        if self.regions is not None:
+            self.regions.clear()
+
+    def restore(self, filename):
+        """ Brings back the cells moved to a file by spill
+
+        Unlike load_matrix, this is not an edit: the cells are the ones the
+        image had, so nothing is recorded in the journal.
+
+        Args:
+            filename (str): filename of the spilled cells
+
+        Raises:
+            OSError: The file can't be read
+            ValueError: The file is not a saved image
+        """
+        _, _, image = self._read_file(filename)
+        self._stale = 0
+        self._assign(image)
+
+    def memory_size(self):
+        """ Estimates the memory held by the cells of the image
+
+        Returns:
+            int: approximate size of the image attribute, in bytes
+        """
+        if not self.image:
+            return 0
+
+        return sys.getsizeof(self.image) + sum(map(sys.getsizeof, self.image))
+
+    @classmethod
+    def from_file(cls, filename):
+        """ Creates an image loaded from a file written by save_matrix
+
+        Args:
+            filename (str): filename of the saved image
+
+        Returns:
+            TextImage: the loaded image
+
+        Raises:
+            OSError: The file can't be read
+            ValueError: The file is not a saved image
+        """
+        image = cls()
+        image.load_matrix(filename)
+        return image
+
+    def _read_file(self, filename):
+        """ Reads and parses a file written by save_matrix or save_binary
+
+        Returns:
+            tuple: number of columns, number of rows and the image attribute
+        """
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        if binary_format.is_binary(data):
+            data = binary_format.decode(data)
+
+        return self._parse(data)
+
+    def write_matrix(self, f):
+        """ Writes the image matrix to a binary file, one row at a time
+
+        No more than a row of the image is rendered at a time, so the
+        memory needed does not depend on the image size.
+
+        Args:
+            f (file): binary file opened for writing
+
+        Returns:
+            bool: Flags if every row was written with one byte per cell
+        """
+        if not self.is_image_set():
+            return False
+
+        fixed_width = True
+        for row in range(self.rows):
+            data = self._row_bytes(row)
+            fixed_width = fixed_width and len(data) == self.cols
+            f.write(data)
+            f.write(b'\n')
+
+        return fixed_width
+
+    #
+    # Edit bookkeeping
+    #
+
+    def _replace(self):
+        """ Prepares the whole image to be replaced by a new matrix
+
+        The image is saved in the journal, if any, as a new edit, and every
+        indexed region, rendered row and saving state is dropped.
+        """
+        if self.journal is not None:
+            self.journal.start()
+            self.journal.save_image(self)
+
+        if self.regions is not None:
+            self.regions.clear()
+
+        self._tracked = None
+        self._stale = 0
+
+    def _edit(self, col_top, row_top, col_bottom, row_bottom, value=None,
+              new=True):
+        """ Prepares a rectangle of cells about to be changed by an edit
+
+        The cells are saved in the journal, if any, as a new edit or as part
+        of the current one, the regions indexed around them are dropped and
+        their rows are marked as changed. The value written to the cells is
+        None if it's not a single one.
+        """
+        if self.journal is not None:
+            if new:
+                self.journal.start()
+            self.journal.save(self, col_top, row_top, col_bottom, row_bottom)
+
+        if self.regions is not None:
+            self.regions.invalidate(self, col_top, row_top, col_bottom,
+                                    row_bottom, value in (None, 'O'))
+
+        self._mark_rows(row_top, row_bottom)
+
+    def _track(self):
+        """ Drops the rendered rows and the saving state if the image
+        attribute was replaced since they were kept """
+        if self._tracked is not self.image:
+            self._row_cache = None
+            self._unsaved = None
+            self._saved = None
+            self._tracked = self.image
+
+    def _mark_rows(self, row_top, row_bottom):
+        """ Marks the rows row_top-row_bottom as changed, so they are
+        rendered and saved again """
+        count = row_bottom - row_top + 1
+
+        if count == self.rows:
+            self._row_cache = None
+        elif self._row_cache is not None:
+            self._row_cache[row_top:row_bottom+1] = [None] * count
+
+        if self._unsaved is not None:
+            self._unsaved[row_top:row_bottom+1] = b'\x01' * count
+
+    #
+    # Lazy clearing
+    #
+    # A storage that keeps its cells row by row may clear the image in
+    # constant time calling _expire, which starts a new generation: every
+    # row stamped with an older generation is stale and reads as 'O'. Its
+    # kernels then call _refresh before using any row, which zeroes the
+    # stale rows with the _zero_row kernel and stamps them again.
+    #
+
+    _generation = 0
+    _stamps = None
+    _stale = 0
+
+    def _expire(self):
+        """ Makes every row stale, so the whole image reads as 'O' """
+        if self._stamps is None or len(self._stamps) != self.rows:
+            self._stamps = [self._generation] * self.rows
+
+        self._generation += 1
+        self._stale = self.rows
+
+    def _refresh(self, row_top, row_bottom):
+        """ Zeroes the stale rows among row_top-row_bottom """
+        if not self._stale:
+            return
+
+        stamps = self._stamps
+        generation = self._generation
+        for row in range(row_top, row_bottom+1):
+            if stamps[row] != generation:
+                stamps[row] = generation
+                self._zero_row(row)
+                self._stale -= 1
+
+    #
+    # Storage kernels
+    #
+    # The methods below are the only ones that touch the image attribute
+    # directly. They assume that the image is set and that every position
+    # was already checked by the public methods above, so a different
+    # storage layout only needs to override them.
+    #
+
+    def _allocate(self, cols, rows):
+        """ Set the image attribute with an empty cols x rows matrix """
+        self.image = []
+        for _ in range(cols):
+            row = ['O' for _ in range(rows)]
+            self.image.append(row)
+
+    def _parse(self, data):
+        """ Convert the content of a saved image file to an image attribute,
+        without touching the image
+
+        Returns:
+            tuple: number of columns, number of rows and the image attribute
+        """
+        cols, lines = split_lines(data)
+        return cols, len(lines), [list(column) for column in zip(*lines)]
+
+    def _assign(self, image):
+        """ Set the image attribute with a matrix returned by _parse """
+        self.image = image
+
+    def _check_value(self, value):
+        """ Checks if a value can be stored in a cell, raising ValueError
+        if not. Any value can be stored in a list """
+
+    def _convert_segment(self, segment):
+        """ Converts a segment read by the _read_segment of any storage to
+        a list, decoding the segments of bytes """
+        if isinstance(segment, list):
+            return segment
+
+        return list(segment.decode('ascii'))
+
+    def _clear(self):
+        """ Set every cell of the image to 'O' """
+        for column in self.image:
+            column[:] = ['O'] * len(column)
+
+    def _get_cell(self, col, row):
+        """ Get the value of the cell at (col, row) """
+        return self.image[col][row]
+
+    def _set_cell(self, col, row, value):
+        """ Set the value of the cell at (col, row) """
+        self.image[col][row] = value
+
+    def _set_vertical(self, col, row_up, row_down, value):
+        """ Set the cells (col, row_up-row_down) with value """
+        self.image[col][row_up:row_down+1] = [value] * (row_down - row_up + 1)
+
+    def _set_horizontal(self, col_left, col_right, row, value):
+        """ Set the cells (col_left-col_right, row) with value """
+        for pos in range(col_left, col_right+1):
+            self.image[pos][row] = value
+
+    def _set_rect(self, col_top, row_top, col_bottom, row_bottom, value):
+        """ Set the rectangle from (col_top, row_top) to
+        (col_bottom, row_bottom) with value """
+        for col in range(col_top, col_bottom+1):
+            self._set_vertical(col, row_top, row_bottom, value)
+
+    def _read_segment(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row)
+
+        The segment type depends on the storage, but it always supports
+        len(), indexing and count().
+        """
+        return [self.image[col][row] for col in range(col_left, col_right+1)]
+
+    def _write_segment(self, row, col_left, segment):
+        """ Set the cells from (col_left, row) on with a segment read by
+        _read_segment """
+        for col, value in enumerate(segment, col_left):
+            self.image[col][row] = value
+
+    def _zero_runs(self, row, left, right):
+        """ Find the runs of 'O' cells of a row that touch an interval
+
+        Each run is returned whole, even if it goes beyond the interval.
+
+        Args:
+            row (int): Vertical position of the runs
+            left (int): Initial horizontal position of the interval
+            right (int): Final horizontal position of the interval
+        Returns:
+            list(tuple): first and last horizontal positions of each run
+        """
+        image = self.image
+        runs = []
+
+        col = left
+        while col > 0 and image[col][row] == 'O' and image[col-1][row] == 'O':
+            col -= 1
+
+        while col <= right:
+            if image[col][row] != 'O':
+                col += 1
+                continue
+
+            start = col
+            while col < self.cols and image[col][row] == 'O':
+                col += 1
+            runs.append((start, col - 1))
+
+        return runs
+
+    def _segment_str(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) joined as
+        a string """
+        return ''.join([self.image[col][row]
+                        for col in range(col_left, col_right+1)])
+
+    def _row_str(self, row):
+        """ Get the values of a row joined as a string, without newline """
+        return ''.join([column[row] for column in self.image])
+
+    def _row_bytes(self, row):
+        """ Get the values of a row encoded as bytes, without newline """
+        return self._row_str(row).encode('utf8')
 
     def __str__(self):
         """ Human readable representation of the class value"""
@@ -349,4 +1244,6 @@ class TextImage(object):
 
     def __repr__(self):
         """ Representation of the class value"""
-        return "TextImage(cols=%s, rows=%s)" % (self.cols, self.rows)
+        return "%s(cols=%s, rows=%s)" % (self.__class__.__name__,
+                                         self.cols,
+                                         self.rows)
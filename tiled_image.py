@@ -0,0 +1,300 @@
+# -*- coding: utf8 -*-
+"""Code for the TiledTextImage class, a sparse text image
+
+This module holds the TiledTextImage class, a TextImage that splits its
+matrix in square tiles and only keeps the tiles that were drawn. Huge images
+that are mostly 'O' cost memory proportional to their drawn content, and
+initializing or clearing them doesn't depend on their size.
+"""
+import sys
+from itertools import groupby
+from text_image import TextImage
+from compact_image import (ZERO, pack_segment, parse_rows, to_byte,
+                           zero_runs)
+
+#
+# Number of columns and rows of a tile
+TILE = 64
+
+
+class TiledTextImage(TextImage):
+    """ Text image stored as a sparse set of tiles
+
+    The matrix is split in TILE x TILE tiles. The image attribute maps the
+    (col, row) position of a tile in the tiles grid to its content:
+
+        - a tile that is all 'O' is not stored at all;
+        - a tile with a single value is stored as that single byte;
+        - any other tile is stored as a bytearray of TILE * TILE bytes,
+          row by row.
+
+    A tile is only allocated when it is partially written, and it collapses
+    back to a single byte when a write covers it or leaves it uniform.
+
+    Since each cell is one byte, the values must be single ASCII characters.
+    Any other value raises ValueError.
+
+    Args:
+        image (list(list)): a 2d list (columns of rows) to instantiate
+        cols (int): number of columns to instantiate a empty image
+        rows (int): number of rows to instantiate a empty image
+
+    Attributes:
+        image (dict): the tiles of the image that are not all 'O'
+        cols (int): number of columns of the image matrix
+        rows (int): number of rows of the image matrix
+    """
+
+    def __init__(self, image=[], cols=0, rows=0):
+
+        #
+        # If a image was passed, only its non 'O' cells are written
+        if image:
+            self.initialize_matrix(len(image), len(image[0]))
+            for col, column in enumerate(image):
+                for row, value in enumerate(column):
+                    if value != 'O':
+                        self._set_cell(col, row, value)
+            return
+
+        self.initialize_matrix(cols, rows)
+
+    def is_image_set(self):
+        """Check if the image has any cell
+
+        The tiles can't tell it, since an all 'O' image has no tiles.
+
+        Returns:
+            bool: flag of emtpy image attribute
+        """
+        return self.image is not None and self.cols > 0 and self.rows > 0
+
+    def memory_size(self):
+        """ Estimates the memory held by the cells of the image
+
+        Returns:
+            int: approximate size of the tiles and their map, in bytes
+        """
+        return sys.getsizeof(self.image) + sum(
+            map(sys.getsizeof, self.image.values()))
+
+    def _fill_box(self, col_top, row_top, col_bottom, row_bottom, value):
+        """ Set a rectangle of cells with value, tile by tile
+
+        Args:
+            col_top (int): Top horizontal position of the rectangle
+            row_top (int): Top verticaal position of the rectangle
+            col_bottom (int): Bottom horizontal position of the rectangle
+            row_bottom (int): Bottom vertical position of the rectangle
+            value (str): value to be inserted
+        """
+        byte = to_byte(value)
+        tiles = self.image
+
+        for tile_row in range(row_top // TILE, row_bottom // TILE + 1):
+            top = max(row_top, tile_row * TILE) - tile_row * TILE
+            bottom = min(row_bottom, tile_row * TILE + TILE - 1,
+                         self.rows - 1) - tile_row * TILE
+            height = min(TILE, self.rows - tile_row * TILE)
+
+            for tile_col in range(col_top // TILE, col_bottom // TILE + 1):
+                left = max(col_top, tile_col * TILE) - tile_col * TILE
+                right = min(col_bottom, tile_col * TILE + TILE - 1,
+                            self.cols - 1) - tile_col * TILE
+                width = min(TILE, self.cols - tile_col * TILE)
+                key = (tile_col, tile_row)
+
+                # A write covering the tile collapses it to its value
+                if top == 0 and left == 0 and \
+                        bottom == height - 1 and right == width - 1:
+                    if byte == ZERO:
+                        tiles.pop(key, None)
+                    else:
+                        tiles[key] = byte
+                    continue
+
+                tile = tiles.get(key, ZERO)
+                if len(tile) == 1:
+                    if tile == byte:
+                        continue
+                    tile = bytearray(tile * (TILE * TILE))
+                    tiles[key] = tile
+
+                line = byte * (right - left + 1)
+                for start in range(top * TILE, (bottom + 1) * TILE, TILE):
+                    tile[start+left:start+right+1] = line
+
+                # A tile left with a single value collapses back
+                if tile.count(tile[0]) == len(tile):
+                    if tile[0] == ZERO[0]:
+                        del tiles[key]
+                    else:
+                        tiles[key] = bytes(tile[:1])
+
+    #
+    # Storage kernels
+    #
+
+    def _allocate(self, cols, rows):
+        """ Set the image attribute with an empty cols x rows matrix """
+        self.image = {}
+
+    def _parse(self, data):
+        """ Convert the content of a saved image file to an image attribute,
+        without touching the image """
+        data, cols, rows = parse_rows(data)
+        stride = cols + 1
+        tiles = {}
+
+        for top in range(0, rows, TILE):
+            height = min(TILE, rows - top)
+            for left in range(0, cols, TILE):
+                width = min(TILE, cols - left)
+                lines = [data[start:start+width] for start in
+                         range(top * stride + left,
+                               (top + height) * stride + left, stride)]
+
+                # Uniform tiles are collapsed and the 'O' ones are dropped
+                cells = b''.join(lines)
+                value = cells[:1]
+                if cells.count(value) == len(cells):
+                    if value != ZERO:
+                        tiles[(left // TILE, top // TILE)] = value
+                    continue
+
+                tile = b''.join([line.ljust(TILE, value) for line in lines])
+                tiles[(left // TILE, top // TILE)] = bytearray(
+                    tile.ljust(TILE * TILE, value))
+
+        return cols, rows, tiles
+
+    def _check_value(self, value):
+        """ Checks if a value can be stored in a cell, raising ValueError
+        if not """
+        to_byte(value)
+
+    def _convert_segment(self, segment):
+        """ Converts a segment read by the _read_segment of any storage to
+        bytes, raising ValueError if some value can't be stored """
+        return pack_segment(segment)
+
+    def _clear(self):
+        """ Set every cell of the image to 'O' """
+        self.image.clear()
+
+    def _get_cell(self, col, row):
+        """ Get the value of the cell at (col, row) """
+        tile = self.image.get((col // TILE, row // TILE), ZERO)
+        if len(tile) == 1:
+            return chr(tile[0])
+
+        return chr(tile[(row % TILE) * TILE + col % TILE])
+
+    def _set_cell(self, col, row, value):
+        """ Set the value of the cell at (col, row) """
+        self._fill_box(col, row, col, row, value)
+
+    def _set_vertical(self, col, row_up, row_down, value):
+        """ Set the cells (col, row_up-row_down) with value """
+        self._fill_box(col, row_up, col, row_down, value)
+
+    def _set_horizontal(self, col_left, col_right, row, value):
+        """ Set the cells (col_left-col_right, row) with value """
+        self._fill_box(col_left, row, col_right, row, value)
+
+    def _set_rect(self, col_top, row_top, col_bottom, row_bottom, value):
+        """ Set the rectangle from (col_top, row_top) to
+        (col_bottom, row_bottom) with value """
+        self._fill_box(col_top, row_top, col_bottom, row_bottom, value)
+
+    def _read_segment(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) as bytes
+
+        Only the tiles of the segment are read, so its cost follows the
+        segment length, not the row length.
+        """
+        tiles = self.image
+        tile_row = row // TILE
+        start = (row % TILE) * TILE
+        output = []
+
+        for tile_col in range(col_left // TILE, col_right // TILE + 1):
+            left = max(col_left - tile_col * TILE, 0)
+            right = min(col_right - tile_col * TILE, TILE - 1) + 1
+            tile = tiles.get((tile_col, tile_row), ZERO)
+            if len(tile) == 1:
+                output.append(tile * (right - left))
+            else:
+                output.append(tile[start+left:start+right])
+
+        return b''.join(output)
+
+    def _write_segment(self, row, col_left, segment):
+        """ Set the cells from (col_left, row) on with a segment of bytes """
+        col = col_left
+        for value, run in groupby(segment):
+            length = len(list(run))
+            self._fill_box(col, row, col + length - 1, row, chr(value))
+            col += length
+
+    def _zero_runs(self, row, left, right):
+        """ Find the runs of 'O' cells of a row that touch an interval
+
+        Args:
+            row (int): Vertical position of the runs
+            left (int): Initial horizontal position of the interval
+            right (int): Final horizontal position of the interval
+        Returns:
+            list(tuple): first and last horizontal positions of each run
+        """
+        # The runs holding the interval ends are followed out of it a tile
+        # at a time, so only the tiles the runs cross are read
+        begin = left
+        if self._get_cell(left, row) == 'O':
+            while begin > 0:
+                low = (begin - 1) // TILE * TILE
+                piece = self._read_segment(row, low, begin - 1)
+                kept = len(piece.rstrip(ZERO))
+                begin = low + kept
+                if kept:
+                    break
+
+        end = right
+        if self._get_cell(right, row) == 'O':
+            while end < self.cols - 1:
+                high = min((end + 1) // TILE * TILE + TILE, self.cols) - 1
+                piece = self._read_segment(row, end + 1, high)
+                zeros = len(piece) - len(piece.lstrip(ZERO))
+                end += zeros
+                if zeros < len(piece):
+                    break
+
+        runs = zero_runs(memoryview(self._read_segment(row, begin, end)), 0,
+                         end - begin + 1, left - begin, right - begin)
+        return [(start + begin, stop + begin) for start, stop in runs]
+
+    def _segment_str(self, row, col_left, col_right):
+        """ Get the values of the cells (col_left-col_right, row) joined as
+        a string """
+        return self._read_segment(row, col_left, col_right).decode('ascii')
+
+    def _row_str(self, row):
+        """ Get the values of a row joined as a string, without newline """
+        return self._row_bytes(row).decode('ascii')
+
+    def _row_bytes(self, row):
+        """ Get the values of a row encoded as bytes, without newline """
+        tiles = self.image
+        tile_row = row // TILE
+        start = (row % TILE) * TILE
+        output = []
+
+        for tile_col in range(0, (self.cols + TILE - 1) // TILE):
+            width = min(TILE, self.cols - tile_col * TILE)
+            tile = tiles.get((tile_col, tile_row), ZERO)
+            if len(tile) == 1:
+                output.append(tile * width)
+            else:
+                output.append(tile[start:start+width])
+
+        return b''.join(output)